@@ -2,19 +2,27 @@
 """api.py - Create and configure the Game API exposing the resources.
 This can also contain game logic. For more complex games it would be wise to
 move game logic to another file. Ideally the API will be simple, concerned
-primarily with communication to/from the API's users."""
+primarily with communication to/from the API's users.
 
-import re
-import logging
-import endpoints
-from protorpc import remote, messages
-from google.appengine.api import memcache
-from google.appengine.api import taskqueue
+Every endpoint runs as an ndb toplevel so that asynchronous operations left
+running by the game code are completed before the response is returned."""
 
-from models import User, Game, Score, Rank, Game_History
-from models import StringMessage, NewGameForm, GameForm, MakeMoveForm,\
-    ScoreForms, GameForms, RankingForm, RankForm, RankForms, Game_HistoryForm
-from utils import get_by_urlsafe
+import datetime
+
+from startup import timed
+
+with timed('import endpoints'):
+    import endpoints
+    from protorpc import remote, messages
+from google.appengine.ext import ndb
+
+from models import User, Game, GameCache, GameStats, Score, Rank, UserStats,\
+    DailyStats, LEADERBOARD_SIZE
+from models import StringMessage, NewGameForm, NewGamesBulkForm, GameForm, MakeMoveForm,\
+    MakeMovesForm, MoveForms, HintForm, ScoreForms, GameForms, RankingForm,\
+    RankForm, RankForms, Game_HistoryForm, UserStatsForm, DailyStatsForm,\
+    TokenGameForm, TokenMoveForm
+from utils import get_key_by_urlsafe, get_cursor, instrumented
 
 NEW_GAME_REQUEST = endpoints.ResourceContainer(NewGameForm)
 GET_GAME_REQUEST = endpoints.ResourceContainer(
@@ -22,10 +30,48 @@ GET_GAME_REQUEST = endpoints.ResourceContainer(
 MAKE_MOVE_REQUEST = endpoints.ResourceContainer(
     MakeMoveForm,
     urlsafe_game_key=messages.StringField(1),)
+MAKE_MOVES_REQUEST = endpoints.ResourceContainer(
+    MakeMovesForm,
+    urlsafe_game_key=messages.StringField(1),)
+
+# Every letter once plus the whole word.
+MAX_MOVES = 27
+MAX_BULK_GAMES = 1000
 USER_REQUEST = endpoints.ResourceContainer(user_name=messages.StringField(1),
                                            email=messages.StringField(2))
-
-MEMCACHE_MOVES_REMAINING = 'MOVES_REMAINING'
+SCORES_REQUEST = endpoints.ResourceContainer(
+    page_size=messages.IntegerField(1),
+    cursor=messages.StringField(2))
+USER_SCORES_REQUEST = endpoints.ResourceContainer(
+    user_name=messages.StringField(1),
+    page_size=messages.IntegerField(2),
+    cursor=messages.StringField(3))
+HIGH_SCORES_REQUEST = endpoints.ResourceContainer(
+    RankingForm,
+    cursor=messages.StringField(2))
+DAILY_STATS_REQUEST = endpoints.ResourceContainer(
+    date=messages.StringField(1))
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+def get_page_size(page_size, default=DEFAULT_PAGE_SIZE):
+    """Returns the requested page size or the default one"""
+    if page_size is None or page_size == -1:
+        return default
+    if not 1 <= page_size <= MAX_PAGE_SIZE:
+        raise endpoints.BadRequestException(
+            'The page size must be between 1 and {}!'.format(MAX_PAGE_SIZE))
+    return page_size
+
+def token_game_form(game, token, message):
+    """Returns the TokenGameForm of a token game"""
+    return TokenGameForm(token=token,
+                         attempts_remaining=game.attempts_remaining,
+                         game_over=game.game_over,
+                         message=message,
+                         word_state=game.engine.word_state,
+                         current_guess=game.current_guess)
 
 @endpoints.api(name='hangman', version='v1')
 class GuessANumberApi(remote.Service):
@@ -35,13 +81,13 @@ class GuessANumberApi(remote.Service):
                       path='user',
                       name='create_user',
                       http_method='POST')
+    @instrumented
+    @ndb.toplevel
     def create_user(self, request):
         """Create a User. Requires a unique username"""
-        if User.query(User.name == request.user_name).get():
+        if not User.create(request.user_name, request.email):
             raise endpoints.ConflictException(
                     'A User with that name already exists!')
-        user = User(name=request.user_name, email=request.email)
-        user.put()
         return StringMessage(message='User {} created!'.format(
                 request.user_name))
 
@@ -50,32 +96,72 @@ class GuessANumberApi(remote.Service):
                       path='game',
                       name='new_game',
                       http_method='POST')
+    @instrumented
+    @ndb.toplevel
     def new_game(self, request):
         """Creates new game"""
-        user = User.query(User.name == request.user_name).get()
+        # The id of the game is allocated while the user is looked up.
+        game_ids = Game.allocate_ids_async(1)
+        user = User.get_by_name(request.user_name)
         if not user:
             raise endpoints.NotFoundException(
                     'A User with that name does not exist!')
         try:
-            game = Game.new_game(user.key, request.attempts)
-        except ValueError:
-            raise endpoints.BadRequestException('Attempts must be greater that'
-                                                'or equal to 1!')
-
-        # Use a task queue to update the average attempts remaining.
-        # This operation is not needed to complete the creation of a new game
-        # so it is performed out of sequence.
-        taskqueue.add(url='/tasks/cache_average_attempts')
+            game = Game.new_game(user.key, request.attempts,
+                                 min_length=request.min_length,
+                                 max_length=request.max_length,
+                                 difficulty=request.difficulty,
+                                 corpus=request.corpus,
+                                 game_id=game_ids.get_result()[0])
+        except ValueError as e:
+            raise endpoints.BadRequestException(str(e))
+
         return game.to_form('Good luck playing Hangman!')
 
+    @endpoints.method(request_message=NewGamesBulkForm,
+                      response_message=GameForms,
+                      path='games',
+                      name='new_games_bulk',
+                      http_method='POST')
+    @instrumented
+    @ndb.toplevel
+    def new_games_bulk(self, request):
+        """Creates a new game for each user name, e.g. for a tournament. A
+        name listed several times gets several games."""
+        if not 1 <= len(request.user_names) <= MAX_BULK_GAMES:
+            raise endpoints.BadRequestException(
+                'Between 1 and {} games can be created at once!'.format(
+                    MAX_BULK_GAMES))
+        keys = User.keys_by_name(request.user_names)
+        missing = sorted(name for name, key in keys.items() if not key)
+        if missing:
+            raise endpoints.NotFoundException(
+                u'No User is named: {}'.format(u', '.join(missing)))
+        names = User.names_async(keys.values())
+        try:
+            games = Game.new_games([keys[name] for name in request.user_names],
+                                   request.attempts,
+                                   min_length=request.min_length,
+                                   max_length=request.max_length,
+                                   difficulty=request.difficulty,
+                                   corpus=request.corpus)
+        except ValueError as e:
+            raise endpoints.BadRequestException(str(e))
+        names = names.get_result()
+        return GameForms(items=[game.convert_game_to_form(names[game.user])
+                                for game in games])
+
     @endpoints.method(request_message=GET_GAME_REQUEST,
                       response_message=GameForm,
                       path='game/{urlsafe_game_key}',
                       name='get_game',
                       http_method='GET')
+    @instrumented
+    @ndb.toplevel
     def get_game(self, request):
         """Return the current game state."""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
+        game_key = get_key_by_urlsafe(request.urlsafe_game_key, Game)
+        game, _ = GameCache.get(game_key)
         if game:
             return game.to_form('Time to make a move!')
         else:
@@ -86,195 +172,286 @@ class GuessANumberApi(remote.Service):
                       path='game/{urlsafe_game_key}',
                       name='make_move',
                       http_method='PUT')
+    @instrumented
+    @ndb.toplevel
     def make_move(self, request):
         """Makes a move. Returns a game state with message"""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
-        if game.game_over:
-            return game.to_form('Game already over!')
-        elif game.cancel:
-            return game.to_form('Cannot make a move in a cancelled game!')
-
-        # Begin the procedure for guess checking. First we see if the input is a letter.
-        # Then we test if the user is guessing the entire word in one shot.
-        # If they aren't, we only allow the user to guess a letter at a time.
-        msg = ''
-        if request.guess.isalpha():
-            guess = request.guess.lower()
-            if request.guess == game.target:
-                word_state = game.complete_game_state(guess)
-                msg = 'Word Guessed Correctly!'
-                game_history = Game_History.query(ancestor = game.key).get()
-                game_history.guesses.append(guess)
-                game_history.word_states.append(game.target)
-                game_history.put()
-            else:
-            #guess = request.guess.lower()
-
-                occurs = []
-                for m in re.finditer(guess,game.target):
-                    occurs.append(m.start()) #locations where the letter is found in target
-            
-                if len(request.guess) > 1:
-                    raise endpoints.BadRequestException('Please guess 1 letter at a time or guess the entire word!')
-                elif occurs:
-                    word_state = game.update_game_state(occurs, guess)
-                    msg = 'Letter Found!'
-                    game_history = Game_History.query(ancestor = game.key).get()
-                    game_history.guesses.append(guess)
-                    game_history.word_states.append(word_state)
-                    game_history.put()
-                else:
-                    msg = 'Letter not found!'
-                    game.attempts_remaining -= 1
-
-
-                    game_history = Game_History.query(ancestor = game.key).get()
-                    game_history.guesses.append(guess)
-                    game_history.word_states.append(game.word_state)
-                    game_history.put()
+        # The engine accepts a single letter or the entire word. Invalid and
+        # repeated guesses are rejected without costing an attempt.
+        game_key = get_key_by_urlsafe(request.urlsafe_game_key, Game)
+        try:
+            game, msg = Game.play_move(game_key, request.guess)
+        except ValueError as e:
+            raise endpoints.BadRequestException(str(e))
+        if not game:
+            raise endpoints.NotFoundException('Game not found!')
+        return game.to_form(msg)
 
-        else:
-            raise endpoints.BadRequestException('Please enter letters only! No symbols or numbers')
-        # game.attempts_remaining -= 1
-        #guess = request.guess.lower()
-
-        #occurs = []
-        #for m in re.finditer(guess,game.target):
-        #  occurs.append(m.start()) #locations where the letter is found in target
-
-        # if occurs:
-        #     word_state = game.update_game_state(occurs, guess)
-        #     msg = 'Letter Found!'
-        #     game_history = Game_History.query(ancestor = game.key).get()
-        #     game_history.guesses.append(guess)
-        #     game_history.word_states.append(word_state)
-        #     game_history.put()
-        # else:
-        #   msg = 'Letter not found!'
-        #   game.attempts_remaining -= 1
-
-
-        # if request.guess < game.target:
-        #     msg = 'Too low!'
-        # else:
-        #     msg = 'Too high!'
-
-        if game.attempts_remaining < 1:
-            game.end_game(False)
-            return game.to_form(msg + ' Game over!')
-        elif game.word_state == game.target:
-            game.end_game(True)
-            return game.to_form(msg + ' Game over!')
-        else:
-            game.put()
-            return game.to_form(msg)
+    @endpoints.method(request_message=MAKE_MOVES_REQUEST,
+                      response_message=MoveForms,
+                      path='game/{urlsafe_game_key}/moves',
+                      name='make_moves',
+                      http_method='PUT')
+    @instrumented
+    @ndb.toplevel
+    def make_moves(self, request):
+        """Makes several moves in order, stopping when the game ends. Returns
+        the game state along with the result of each move"""
+        if not 1 <= len(request.guesses) <= MAX_MOVES:
+            raise endpoints.BadRequestException(
+                'Please make between 1 and {} guesses!'.format(MAX_MOVES))
+        game_key = get_key_by_urlsafe(request.urlsafe_game_key, Game)
+        try:
+            game, moves = Game.play_moves(game_key, request.guesses)
+        except ValueError as e:
+            raise endpoints.BadRequestException(str(e))
+        if not game:
+            raise endpoints.NotFoundException('Game not found!')
+        return MoveForms(game=game.to_form(moves[-1].message),
+                         moves=[move.to_form() for move in moves])
 
-    @endpoints.method(response_message=ScoreForms,
+    @endpoints.method(request_message=SCORES_REQUEST,
+                      response_message=ScoreForms,
                       path='scores',
                       name='get_scores',
                       http_method='GET')
+    @instrumented
+    @ndb.toplevel
     def get_scores(self, request):
-        """Return all scores"""
-        return ScoreForms(items=[score.to_form() for score in Score.query()])
+        """Return a page of all scores"""
+        return Score.page_async(Score.query(),
+                                get_page_size(request.page_size),
+                                get_cursor(request.cursor)).get_result()
 
-    @endpoints.method(request_message=USER_REQUEST,
+    @endpoints.method(request_message=USER_SCORES_REQUEST,
                       response_message=ScoreForms,
                       path='scores/user/{user_name}',
                       name='get_user_scores',
                       http_method='GET')
+    @instrumented
+    @ndb.toplevel
     def get_user_scores(self, request):
-        """Returns all of an individual User's scores"""
-        user = User.query(User.name == request.user_name).get()
+        """Returns a page of an individual User's scores, most recent first"""
+        user = User.get_by_name(request.user_name)
         if not user:
             raise endpoints.NotFoundException(
                     'A User with that name does not exist!')
-        scores = Score.query(Score.user == user.key)
-        return ScoreForms(items=[score.to_form() for score in scores])
+        scores = Score.query(Score.user == user.key).order(-Score.date)
+        return Score.page_async(scores, get_page_size(request.page_size),
+                                get_cursor(request.cursor),
+                                user.name).get_result()
 
     @endpoints.method(response_message=StringMessage,
                       path='games/average_attempts',
                       name='get_average_attempts_remaining',
                       http_method='GET')
+    @instrumented
+    @ndb.toplevel
     def get_average_attempts(self, request):
-        """Get the cached average moves remaining"""
-        return StringMessage(message=memcache.get(MEMCACHE_MOVES_REMAINING) or '')
-
-    @staticmethod
-    def _cache_average_attempts():
-        """Populates memcache with the average moves remaining of Games"""
-        games = Game.query(Game.game_over == False).fetch()
-        if games:
-            count = len(games)
-            total_attempts_remaining = sum([game.attempts_remaining
-                                        for game in games])
-            average = float(total_attempts_remaining)/count
-            memcache.set(MEMCACHE_MOVES_REMAINING,
-                         'The average moves remaining is {:.2f}'.format(average))
+        """Get the average moves remaining of the active games"""
+        games, attempts_remaining = GameStats.totals()
+        if not games:
+            return StringMessage(message='')
+        average = float(attempts_remaining)/games
+        return StringMessage(
+            message='The average moves remaining is {:.2f}'.format(average))
 
     @endpoints.method(request_message=USER_REQUEST,
                       response_message=GameForms,
                       path='user/{user_name}/games',
                       name='get_user_games',
                       http_method='GET')
+    @instrumented
+    @ndb.toplevel
     def get_user_games(self,request):
-      user = User.query(User.name == request.user_name).get()
+      user = User.get_by_name(request.user_name)
       if not user:
             raise endpoints.NotFoundException(
                     'A User with that name does not exist!')
-      games = Game.query(Game.user == user.key, Game.cancel == False, Game.game_over == False)
-      #games.filter('')
-      return GameForms(items=[game.convert_game_to_form() for game in games])
+      return GameForms(items=Game.active_forms(user.key, user.name))
 
     @endpoints.method(request_message=GET_GAME_REQUEST,
                       response_message=GameForm,
                       path='game/{urlsafe_game_key}/cancel',
                       name='cancel_game',
                       http_method='PUT')
+    @instrumented
+    @ndb.toplevel
     def cancel_game(self,request):
-      game = get_by_urlsafe(request.urlsafe_game_key, Game)
-      if game and game.game_over != True:
-        game.cancel_game()
-        return game.to_form('Game Cancelled!')
+      game_key = get_key_by_urlsafe(request.urlsafe_game_key, Game)
+      game = Game.cancel_game(game_key)
+      if not game:
+        raise endpoints.NotFoundException('Game not found!')
       elif game.game_over == True:
         raise endpoints.BadRequestException('Cannot cancel a finished Game!')
-      else:
-        raise endpoints.NotFoundException('Game not found!')
+      return game.to_form('Game Cancelled!')
 
-    @endpoints.method(request_message=RankingForm,
+    @endpoints.method(request_message=HIGH_SCORES_REQUEST,
                       response_message=ScoreForms,
                       path='high_scores',
                       name='get_high_scores',
                       http_method='GET')
+    @instrumented
+    @ndb.toplevel
     def get_high_scores(self,request):
-      scores = Score.query().order(-Score.score)      
-      if request.number_of_results == -1:
-        return ScoreForms(items=[score.to_form() for score in scores])
-      else:
-        results = scores.fetch(limit=request.number_of_results)
-        return ScoreForms(items=[score.to_form() for score in results])
-
-    @endpoints.method(response_message=RankForms,
+      scores = Score.query().order(-Score.score, -Score.date)
+      return Score.page_async(scores,
+                              get_page_size(request.number_of_results),
+                              get_cursor(request.cursor)).get_result()
+
+    @endpoints.method(request_message=RankingForm,
+                      response_message=RankForms,
                       path='rankings',
                       name='get_user_rankings',
                       http_method="GET")
+    @instrumented
+    @ndb.toplevel
     def get_user_rankings(self,request):
-      Rank.make_rankings()
-      ranks = Rank.query().order(Rank.rank)
-      return RankForms(items=[rank.to_form() for rank in ranks])
+      """Returns the best number_of_results ranks, LEADERBOARD_SIZE by
+      default"""
+      ranks = Rank.top(get_page_size(request.number_of_results,
+                                     LEADERBOARD_SIZE))
+      return Rank.to_forms_async(ranks).get_result()
+
+    @endpoints.method(request_message=USER_REQUEST,
+                      response_message=RankForm,
+                      path='rankings/user/{user_name}',
+                      name='get_user_rank',
+                      http_method='GET')
+    @instrumented
+    @ndb.toplevel
+    def get_user_rank(self, request):
+      """Returns the rank of an individual User"""
+      user_key = User.key_by_name(request.user_name)
+      if not user_key:
+            raise endpoints.NotFoundException(
+                    'A User with that name does not exist!')
+      # The user is read along with its rank.
+      user, rank = ndb.get_multi([user_key, Rank.key_for(user_key)])
+      if not rank:
+            raise endpoints.NotFoundException(
+                    'That User has not finished a game yet!')
+      return rank.to_form(rank.position_async().get_result(), user.name)
 
     @endpoints.method(request_message=GET_GAME_REQUEST,
                       response_message=Game_HistoryForm,
                       path='{urlsafe_game_key}/history',
                       name='get_game_history',
                       http_method='GET')
+    @instrumented
+    @ndb.toplevel
     def get_game_history(self, request):
-      game = get_by_urlsafe(request.urlsafe_game_key, Game)
-      game_history = Game_History.query(ancestor = game.key).get()
-      return game_history.to_form()
+      game_key = get_key_by_urlsafe(request.urlsafe_game_key, Game)
+      game, game_history = GameCache.get(game_key)
+      if not game:
+        raise endpoints.NotFoundException('Game not found!')
+      return game_history.to_form(game.target)
+
+    @endpoints.method(request_message=GET_GAME_REQUEST,
+                      response_message=HintForm,
+                      path='game/{urlsafe_game_key}/hint',
+                      name='get_hint',
+                      http_method='GET')
+    @instrumented
+    @ndb.toplevel
+    def get_hint(self, request):
+        """Return the letter in the most of the words still possible, along
+        with how many words are still possible"""
+        game_key = get_key_by_urlsafe(request.urlsafe_game_key, Game)
+        game, game_history = GameCache.get(game_key)
+        if not game:
+            raise endpoints.NotFoundException('Game not found!')
+        if game.game_over or game.cancel:
+            raise endpoints.BadRequestException('Game already over!')
+        letter, candidates = game.hint(game_history)
+        return HintForm(letter=letter, candidates=candidates)
+
+    @endpoints.method(request_message=USER_REQUEST,
+                      response_message=UserStatsForm,
+                      path='stats/user/{user_name}',
+                      name='get_user_stats',
+                      http_method='GET')
+    @instrumented
+    @ndb.toplevel
+    def get_user_stats(self, request):
+        """Return the statistics of a User's finished games"""
+        user_key = User.key_by_name(request.user_name)
+        if not user_key:
+            raise endpoints.NotFoundException(
+                    'A User with that name does not exist!')
+        # The user is read along with its statistics.
+        user, stats = ndb.get_multi([user_key, UserStats.key_for(user_key)])
+        stats = stats or UserStats()
+        return stats.to_form(UserStatsForm(user_name=user.name))
+
+    @endpoints.method(request_message=DAILY_STATS_REQUEST,
+                      response_message=DailyStatsForm,
+                      path='stats/day',
+                      name='get_daily_stats',
+                      http_method='GET')
+    @instrumented
+    @ndb.toplevel
+    def get_daily_stats(self, request):
+        """Return the statistics of the games finished on a day (YYYY-MM-DD,
+        today by default) along with its best users"""
+        if request.date:
+            try:
+                day = datetime.datetime.strptime(request.date,
+                                                 '%Y-%m-%d').date()
+            except ValueError:
+                raise endpoints.BadRequestException(
+                    'The date must be formatted as YYYY-MM-DD!')
+        else:
+            day = datetime.date.today()
+        stats = DailyStats.for_day_async(day).get_result()
+        return stats.to_form_async(day).get_result()
+
+    @endpoints.method(request_message=NEW_GAME_REQUEST,
+                      response_message=TokenGameForm,
+                      path='token_game',
+                      name='new_token_game',
+                      http_method='POST')
+    @instrumented
+    @ndb.toplevel
+    def new_token_game(self, request):
+        """Creates a game that is not stored. Its state is held by the
+        returned token, which is passed to make_token_move instead of a
+        game key."""
+        user = User.get_by_name(request.user_name)
+        if not user:
+            raise endpoints.NotFoundException(
+                    'A User with that name does not exist!')
+        try:
+            game, token = Game.new_token_game(user.key, request.attempts,
+                                              min_length=request.min_length,
+                                              max_length=request.max_length,
+                                              difficulty=request.difficulty,
+                                              corpus=request.corpus)
+        except ValueError as e:
+            raise endpoints.BadRequestException(str(e))
+        return token_game_form(game, token, 'Good luck playing Hangman!')
+
+    @endpoints.method(request_message=TokenMoveForm,
+                      response_message=TokenGameForm,
+                      path='token_game',
+                      name='make_token_move',
+                      http_method='PUT')
+    @instrumented
+    @ndb.toplevel
+    def make_token_move(self, request):
+        """Makes a move in a token game. Returns the game state along with
+        the token of the next move. Only the end of the game is stored."""
+        try:
+            game, msg, token = Game.play_token_move(request.token,
+                                                    request.guess)
+        except ValueError as e:
+            raise endpoints.BadRequestException(str(e))
+        return token_game_form(game, token, msg)
 
 
 # @endpoints.api(name='hangman', version='v1')
 # class hangman(GuessANumberApi, remote.Service):
 
 
-api = endpoints.api_server([GuessANumberApi])
+with timed('build api_server'):
+    api = endpoints.api_server([GuessANumberApi])
@@ -0,0 +1,451 @@
+#!/usr/bin/env python
+
+"""benchmark.py - Microbenchmarks of the game. Most run without the App
+Engine SDK; the others run against the testbed stubs of the tests, found
+through the APPENGINE_SDK environment variable as for the tests. Each
+benchmark runs in its own process so that the reported peak resident memory
+belongs to that benchmark only. Benchmarks needing a library that is not
+installed, such as the SDK, NumPy or pycrypto, are skipped.
+
+Usage: python benchmark.py [name ...]"""
+
+import random
+import re
+import resource
+import subprocess
+import sys
+import time
+
+import corpus
+import engine
+
+BENCHMARKS = {}
+
+# The exit status of a benchmark skipped for a missing library.
+SKIPPED = 3
+
+
+def benchmark(f):
+    BENCHMARKS[f.__name__] = f
+    return f
+
+
+def report(name, seconds, runs):
+    """Prints the mean latency of a benchmark and the peak RSS so far"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print '{:<28} {:>10.4f} ms/op {:>8d} ops {:>8.1f} MB peak RSS'.format(
+        name, seconds * 1000.0 / runs, runs, rss / 1024.0)
+
+
+def report_percentiles(name, latencies):
+    """Prints the median and 99th percentile of latencies in seconds"""
+    latencies = sorted(latencies)
+    print '{:<28} {:>10.4f} ms p50 {:>10.4f} ms p99'.format(
+        name, latencies[len(latencies) // 2] * 1000.0,
+        latencies[int(len(latencies) * 0.99)] * 1000.0)
+
+
+@benchmark
+def new_game_word_file(runs=20):
+    """The original Game.new_game: read and split words.txt per game"""
+    start = time.time()
+    for _ in range(runs):
+        with open(corpus.WORDS_FILE, 'r') as f:
+            words = f.read().splitlines()
+        words[random.randint(1, len(words) - 1)].lower()
+    report('new_game_word_file', time.time() - start, runs)
+
+
+@benchmark
+def corpus_text_load():
+    """Parsing and indexing words.txt, the fallback when not compiled"""
+    start = time.time()
+    corpus.WordCorpus.from_file()
+    report('corpus_text_load', time.time() - start, 1)
+
+
+@benchmark
+def new_game_corpus(runs=100000):
+    """Game.new_game backed by the preloaded WordCorpus"""
+    start = time.time()
+    words = corpus.get_corpus()
+    report('corpus_first_load', time.time() - start, 1)
+
+    start = time.time()
+    for _ in range(runs):
+        words.random_word(min_length=6, max_length=9, difficulty='hard')
+    report('new_game_corpus', time.time() - start, runs)
+
+
+def _games(count):
+    """Returns count (target, guesses) pairs playing every letter of the
+    alphabet in a random order"""
+    words = corpus.get_corpus()
+    games = []
+    for _ in range(count):
+        letters = list(engine.ALPHABET)
+        random.shuffle(letters)
+        games.append((words.random_word(), letters))
+    return games
+
+
+@benchmark
+def moves_regex(count=2000):
+    """The original make_move: re.finditer and a list/join per move"""
+    games = _games(count)
+    moves = 0
+    start = time.time()
+    for target, letters in games:
+        word_state = '_' * len(target)
+        for guess in letters:
+            moves += 1
+            occurs = [m.start() for m in re.finditer(guess, target)]
+            if occurs:
+                state = list(word_state)
+                for l in occurs:
+                    state[l] = guess
+                word_state = ''.join(state)
+                if word_state == target:
+                    break
+    report('moves_regex', time.time() - start, moves)
+
+
+@benchmark
+def moves_engine(count=2000):
+    """make_move on the bitmask WordEngine, rendering the state each move"""
+    games = _games(count)
+    moves = 0
+    start = time.time()
+    for target, letters in games:
+        game = engine.WordEngine(target)
+        for guess in letters:
+            moves += 1
+            game.play(guess)
+            game.word_state
+            if game.won:
+                break
+    report('moves_engine', time.time() - start, moves)
+
+
+@benchmark
+def moves_token(count=2000):
+    """make_token_move without the endpoint: decode the token, play the
+    guess and encode the next token, every move"""
+    import gametoken
+    codec = gametoken.TokenCodec('benchmark secret')
+    games = _games(count)
+    moves = 0
+    start = time.time()
+    for target, letters in games:
+        token = codec.encode(gametoken.TokenGame.new(1, target, 26))
+        for guess in letters:
+            moves += 1
+            game = codec.decode(token)
+            game.play(guess)
+            token = codec.encode(game)
+            if game.game_over:
+                break
+    report('moves_token', time.time() - start, moves)
+
+
+def _histories(count):
+    """Returns count 26-move (target, guesses, word_states, moves) histories
+    recorded both as word state lists and as a move log"""
+    histories = []
+    for target, letters in _games(count):
+        game = engine.WordEngine(target)
+        guesses, word_states, moves = [''], ['_' * len(target)], []
+        for guess in letters:
+            hits = game.play(guess)
+            guesses.append(guess)
+            word_states.append(game.word_state)
+            moves.append(engine.pack_move(guess, hits))
+        histories.append((target, guesses, word_states, ''.join(moves)))
+    return histories
+
+
+@benchmark
+def history_word_states(count=2000):
+    """The original get_game_history output built with string concatenation
+    from the stored word states"""
+    histories = _histories(count)
+    size = 0
+    start = time.time()
+    for target, guesses, word_states, _ in histories:
+        size += sum(len(g) for g in guesses) + sum(len(w) for w in word_states)
+        moves = ""
+        for i in range(len(guesses)):
+            moves = moves + "Guess #" + str(i) + ": " + guesses[i]
+            moves = moves + " | Word State:" + word_states[i]
+            moves = moves + " , "
+    report('history_word_states', time.time() - start, count)
+    print '{:<28} {:>10.1f} bytes/history'.format('', size / float(count))
+
+
+@benchmark
+def history_move_log(count=2000):
+    """get_game_history output replayed from the packed move log"""
+    histories = _histories(count)
+    size = 0
+    start = time.time()
+    for target, _, _, log in histories:
+        size += len(log)
+        moves = ["Guess #0:  | Word State:{} , ".format('_' * len(target))]
+        for i, (guess, word_state) in enumerate(
+                engine.replay_moves(target, log)):
+            moves.append("Guess #{}: {} | Word State:{} , ".format(
+                i + 1, guess, word_state))
+        "".join(moves)
+    report('history_move_log', time.time() - start, count)
+    print '{:<28} {:>10.1f} bytes/history'.format('', size / float(count))
+
+
+def _hint_states(count):
+    """Returns count (word_state, guessed) pairs of games after the five most
+    common letters were guessed"""
+    states = []
+    for target, _ in _games(count):
+        game = engine.WordEngine(target)
+        for letter in corpus.LETTER_FREQUENCY[:5]:
+            game.play(letter)
+        states.append((game.word_state, game.guessed))
+    return states
+
+
+@benchmark
+def hint_scan(count=20):
+    """A hint computed by scanning the words of the corpus as strings"""
+    states = _hint_states(count)
+    words = corpus.get_corpus()
+    start = time.time()
+    for word_state, guessed in states:
+        counts = dict.fromkeys(engine.ALPHABET, 0)
+        for word in words.words(len(word_state), len(word_state)):
+            if all(s == '_' and not guessed & engine.letter_bit(l) or s == l
+                   for s, l in zip(word_state, word)):
+                for letter in set(word):
+                    counts[letter] += 1
+        max(counts, key=counts.get)
+    report('hint_scan', time.time() - start, count)
+
+
+@benchmark
+def hint_numpy(count=2000):
+    """A hint computed on the NumPy matrices of hint.py, once every length
+    has been indexed"""
+    import hint
+    states = _hint_states(count)
+    start = time.time()
+    hints = hint.get_hints()
+    for length in range(1, 25):
+        hints.for_length(length)
+    report('hint_index_build', time.time() - start, 1)
+
+    latencies = []
+    for word_state, guessed in states:
+        start = time.time()
+        hints.hint(word_state, guessed)
+        latencies.append(time.time() - start)
+    report('hint_numpy', sum(latencies), count)
+    report_percentiles('hint_numpy', latencies)
+
+
+def _testbed(latency=0):
+    """Activates the testbed stubs of the tests, with latency seconds added
+    to every API round trip. Raises ImportError without the App Engine
+    SDK."""
+    from tests import support
+    if not support.AVAILABLE:
+        raise ImportError(support.REASON)
+    support.init_testbed()
+    if latency:
+        support.inject_latency(latency)
+
+
+def _time(call, runs):
+    """Returns the seconds call() took over runs calls"""
+    start = time.time()
+    for _ in range(runs):
+        call()
+    return time.time() - start
+
+
+@benchmark
+def endpoint_round_trips(runs=50, latency=0.01):
+    """new_game, get_user_rank and get_user_stats with latency added to
+    every API call, against the way they used to wait for each call before
+    making the next one"""
+    _testbed(latency)
+    from google.appengine.ext import ndb
+    import api
+    from models import Game, Game_History, GameStats, Rank, ScoreBucket, \
+        User, UserStats
+
+    endpoints = api.GuessANumberApi()
+    endpoints.create_user(api.USER_REQUEST.combined_message_class(
+        user_name='alice'))
+    user = User.get_by_name('alice')
+    Rank(key=Rank.key_for(user.key), user=user.key, total_score=1.0).put()
+    UserStats(key=UserStats.key_for(user.key), games=1).put()
+    ScoreBucket.rebuild()
+    new_game = api.NEW_GAME_REQUEST.combined_message_class(
+        user_name='alice', attempts=5)
+    by_name = api.USER_REQUEST.combined_message_class(user_name='alice')
+
+    @ndb.transactional_tasklet
+    def create(game):
+        GameStats.adjust_later(1, game.attempts_remaining)
+        yield game.put_async()
+        yield Game_History(key=Game_History.key_for(game.key)).put_async()
+
+    @ndb.toplevel
+    def new_game_sequential():
+        user = User.get_by_name('alice')
+        word = corpus.get_corpus().random_word()
+        game = Game(user=user.key, target=word, attempts_allowed=5,
+                    attempts_remaining=5, game_over=False,
+                    word_state='_' * len(word), cancel=False,
+                    current_guess='', guessed_letters=0)
+        create(game).get_result()
+        game.to_form('Good luck playing Hangman!')
+
+    @ndb.toplevel
+    def user_rank_sequential():
+        user = User.get_by_name('alice')
+        rank = Rank.key_for(user.key).get()
+        rank.to_form(rank.position_async().get_result(), user.name)
+
+    @ndb.toplevel
+    def user_stats_sequential():
+        user = User.get_by_name('alice')
+        stats = UserStats.key_for(user.key).get()
+        stats.to_form(api.UserStatsForm(user_name=user.name))
+
+    for name, call in (
+            ('new_game_sequential', new_game_sequential),
+            ('new_game', lambda: endpoints.new_game(new_game)),
+            ('user_rank_sequential', user_rank_sequential),
+            ('user_rank', lambda: endpoints.get_user_rank(by_name)),
+            ('user_stats_sequential', user_stats_sequential),
+            ('user_stats', lambda: endpoints.get_user_stats(by_name))):
+        report(name, _time(call, runs), runs)
+
+
+@benchmark
+def bulk_games(games=1000, latency=0.01):
+    """A tournament of games created by one new_games_bulk call against as
+    many new_game calls, with latency added to every API call"""
+    _testbed(latency)
+    import api
+
+    endpoints = api.GuessANumberApi()
+    names = ['user{}'.format(i) for i in range(10)]
+    for name in names:
+        endpoints.create_user(api.USER_REQUEST.combined_message_class(
+            user_name=name))
+    requests = [api.NEW_GAME_REQUEST.combined_message_class(
+        user_name=names[i % len(names)], attempts=5) for i in range(games)]
+    bulk = api.NewGamesBulkForm(
+        user_names=[request.user_name for request in requests], attempts=5)
+
+    start = time.time()
+    for request in requests:
+        endpoints.new_game(request)
+    report('new_game', time.time() - start, games)
+    start = time.time()
+    endpoints.new_games_bulk(bulk)
+    report('new_games_bulk', time.time() - start, games)
+
+
+@benchmark
+def batched_moves(games=100, guesses=5, latency=0.01):
+    """guesses letters played by one make_moves call against as many
+    make_move calls, with latency added to every API call"""
+    _testbed(latency)
+    import api
+
+    endpoints = api.GuessANumberApi()
+    endpoints.create_user(api.USER_REQUEST.combined_message_class(
+        user_name='alice'))
+    new_game = api.NEW_GAME_REQUEST.combined_message_class(
+        user_name='alice', attempts=26)
+    plays = [(endpoints.new_game(new_game).urlsafe_key,
+              random.sample(engine.ALPHABET, guesses))
+             for _ in range(2 * games)]
+
+    start = time.time()
+    for urlsafe_key, letters in plays[:games]:
+        for letter in letters:
+            endpoints.make_move(api.MAKE_MOVE_REQUEST.combined_message_class(
+                urlsafe_game_key=urlsafe_key, guess=letter))
+    report('make_move', time.time() - start, games * guesses)
+    start = time.time()
+    for urlsafe_key, letters in plays[games:]:
+        endpoints.make_moves(api.MAKE_MOVES_REQUEST.combined_message_class(
+            urlsafe_game_key=urlsafe_key, guesses=letters))
+    report('make_moves', time.time() - start, games * guesses)
+
+
+@benchmark
+def user_games(runs=20):
+    """get_user_games for users with hundreds of active games, read with the
+    projection query of Game.active_forms against whole games, as the
+    endpoint used to. Datastore bytes are those of the requests and
+    responses of the query."""
+    _testbed()
+    from google.appengine.ext import ndb
+    from models import Game
+    from utils import RpcCounter
+
+    words = corpus.get_corpus()
+    for count in (200, 500):
+        user = ndb.Key('User', count)
+        games = []
+        for _ in range(count):
+            target = words.random_word()
+            game = engine.WordEngine(target)
+            for letter in random.sample(engine.ALPHABET, 4):
+                game.play(letter)
+            games.append(Game(user=user, target=target, attempts_allowed=10,
+                              attempts_remaining=6, game_over=False,
+                              word_state=game.word_state, cancel=False,
+                              current_guess=letter,
+                              guessed_letters=game.guessed))
+        ndb.put_multi(games)
+
+        def whole_games():
+            query = Game.query(Game.user == user, Game.cancel == False,
+                               Game.game_over == False)
+            return [game.convert_game_to_form('alice') for game in query]
+
+        for name, call in (('user_games_entities', whole_games),
+                           ('user_games_projection',
+                            lambda: Game.active_forms(user, 'alice'))):
+            with RpcCounter() as rpcs:
+                seconds = _time(call, runs)
+            report('{}_{}'.format(name, count), seconds, runs)
+            print '{:<28} {:>10.0f} bytes/op'.format(
+                '', rpcs.size('datastore_v3') / float(runs))
+
+
+def main(names):
+    """Runs benchmarks, each in its own process. Returns the exit status:
+    non-zero if any failed."""
+    if len(names) == 1:
+        try:
+            BENCHMARKS[names[0]]()
+        except ImportError as e:
+            print '{:<28} skipped: {}'.format(names[0], e)
+            return SKIPPED
+        return 0
+    failed = [name for name in names or sorted(BENCHMARKS)
+              if subprocess.call([sys.executable, __file__, name])
+              not in (0, SKIPPED)]
+    if failed:
+        print 'Failed: {}'.format(', '.join(failed))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+
+"""build_words.py - Compiles the plain text word list into the binary format
+that corpus.py memory-maps at startup. Words that are not purely alphabetic
+or are longer than 32 letters are dropped, and case variants such as 'A' and
+'a' are merged. Run this before
+deploying whenever words.txt changes.
+
+Usage: python build_words.py [words.txt [words.bin]]"""
+
+import os
+import sys
+
+from corpus import WORDS_FILE, COMPILED_WORDS_FILE, WordCorpus, \
+    normalize_words
+
+
+def build(source=WORDS_FILE, target=COMPILED_WORDS_FILE):
+    """Compiles source into target and returns the compiled corpus"""
+    with open(source, 'r') as f:
+        lines = f.read().splitlines()
+    corpus = WordCorpus.from_words(normalize_words(lines))
+
+    # Write to a temporary file first so that running instances never map a
+    # partially written file.
+    with open(target + '.tmp', 'wb') as f:
+        corpus.write(f)
+    os.rename(target + '.tmp', target)
+
+    print '{}: {} lines, {} words kept, {} bytes written to {}'.format(
+        source, len(lines), len(corpus), os.path.getsize(target), target)
+    return corpus
+
+
+if __name__ == '__main__':
+    build(*sys.argv[1:])
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+"""coldstart.py - Reports where the startup time of a new instance goes:
+each step a cold instance takes before serving, from importing the modules
+to loading the word corpus, is timed in a fresh interpreter. Steps needing
+the App Engine SDK are run when its path is given with --sdk. Run it before
+and after changes to track startup latency regressions.
+
+Usage: python coldstart.py [--runs N] [--sdk PATH]"""
+
+import argparse
+import json
+import subprocess
+import sys
+
+# Each step runs after the ones before it, in the same interpreter.
+STEPS = [
+    ('import corpus', 'import corpus'),
+    ('import engine', 'import engine'),
+    ('load corpus', 'corpus.get_corpus()'),
+    ('import storage', 'import storage'),
+    ('import google.appengine', 'from google.appengine.ext import ndb'),
+    ('import models', 'import models'),
+    ('import main', 'import main'),
+    ('import endpoints', 'import endpoints'),
+    ('import api (api_server)', 'import api'),
+    # Deferred until an instance serves its first hint or token game.
+    ('import hint (numpy)', 'import hint'),
+    ('import gametoken (pycrypto)', 'import gametoken'),
+]
+
+# Runs in the fresh interpreter: times each step and prints them as JSON.
+RUNNER = '''
+import json, sys, time
+sdk = sys.argv[1]
+if sdk:
+    sys.path.insert(0, sdk)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+timings = []
+for name, statement in json.loads(sys.stdin.read()):
+    start = time.time()
+    try:
+        exec statement
+    except ImportError as e:
+        timings.append((name, None, str(e)))
+        continue
+    timings.append((name, (time.time() - start) * 1000.0, None))
+print json.dumps(timings)
+'''
+
+
+def cold_start(sdk):
+    """Returns the (step, ms or None, error) of one cold start"""
+    process = subprocess.Popen([sys.executable, '-c', RUNNER, sdk or ''],
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    output, _ = process.communicate(json.dumps(STEPS))
+    if process.returncode:
+        sys.exit('The cold start failed')
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--sdk', help='path of the App Engine SDK')
+    args = parser.parse_args()
+
+    runs = [cold_start(args.sdk) for _ in range(args.runs)]
+    total = 0.0
+    for i, (name, _, error) in enumerate(runs[0]):
+        if error:
+            print '{:<32} {:>10}   {}'.format(name, 'skipped', error)
+            continue
+        times = sorted(run[i][1] for run in runs)
+        median = times[len(times) // 2]
+        total += median
+        print '{:<32} {:>10.1f} ms median {:>10.1f} ms max'.format(
+            name, median, times[-1])
+    print '{:<32} {:>10.1f} ms'.format('total', total)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,411 @@
+"""corpus.py - The word corpus that Game targets are picked from.
+The dictionary is loaded once per instance, on first use, into a single
+contiguous string plus an offset table instead of one Python string per word.
+Words are indexed by length, distinct-letter count and difficulty so that a
+random pick for a given set of constraints takes constant time.
+
+The corpus can be compiled ahead of time with build_words.py into a binary
+file which is memory-mapped read-only, so loading it does no parsing and the
+pages are shared by every process on the machine. The layout is:
+
+    header       magic, version, word count, bucket count
+    offsets      word count + 1 uint32 offsets into the packed words
+    buckets      bucket count (length, distinct, difficulty, start, count)
+    bucket words word count uint32 word indexes grouped by bucket
+    words        the packed lowercase words
+
+Besides words.txt, themed and per-language dictionaries can be hosted as
+dictionaries/<name>.txt, compiled to dictionaries/<name>.bin. They are loaded
+on demand by a CorpusRegistry, which keeps the most recently used ones
+resident within a memory budget. The budget counts the structures derived
+from a dictionary, such as its hint index, along with the dictionary."""
+
+import array
+import bisect
+import collections
+import os
+import random
+import re
+import struct
+import threading
+import time
+
+from engine import MAX_WORD_LENGTH
+
+try:
+    import mmap
+except ImportError:
+    mmap = None
+
+WORDS_FILE = 'words.txt'
+COMPILED_WORDS_FILE = 'words.bin'
+
+DEFAULT_CORPUS = 'words'
+DICTIONARIES_DIR = 'dictionaries'
+CORPUS_NAME = re.compile(r'^[a-z0-9_-]{1,64}$')
+# Bytes of dictionaries kept resident per instance.
+CORPUS_CACHE_BYTES = 64 * 1024 * 1024
+
+MAGIC = 'HMWD'
+VERSION = 1
+HEADER = struct.Struct('<4sHxxII')
+BUCKET = struct.Struct('<BBBxII')
+UINT32 = struct.Struct('<I')
+
+# Letters ordered from most to least common in English text. A letter's
+# position in this string is its rarity.
+LETTER_FREQUENCY = 'etaoinshrdlcumwfgypbvkjxqz'
+RARITY = dict((letter, i) for i, letter in enumerate(LETTER_FREQUENCY))
+
+DIFFICULTIES = ('easy', 'medium', 'hard')
+
+
+def difficulty_score(word):
+    """Returns the mean rarity (0-250) of the distinct letters of a word.
+    Words made of uncommon letters are harder to guess."""
+    letters = set(word)
+    return sum(RARITY[l] for l in letters) * 10 // len(letters)
+
+
+def normalize(word):
+    """Returns the lowercase form of a word, or None if it cannot be played:
+    if it has characters other than a-z or more letters than the move log
+    can record"""
+    word = word.strip().lower()
+    if (word and len(word) <= MAX_WORD_LENGTH and word.isalpha() and
+            all(l in RARITY for l in word)):
+        return word
+    return None
+
+
+def normalize_words(lines):
+    """Returns the playable words of a word list, lowercased and without
+    duplicates such as 'A' and 'a', in their original order"""
+    seen = set()
+    words = []
+    for line in lines:
+        word = normalize(line)
+        if word and word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+class PackedArray(object):
+    """A read-only view of little-endian uint32 values stored in a buffer"""
+
+    def __init__(self, buf, offset, length):
+        self._buf = buf
+        self._offset = offset
+        self._length = length
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, i):
+        return UINT32.unpack_from(self._buf, self._offset + 4 * i)[0]
+
+
+class WordCorpus(object):
+    """A read-only list of words with a (length, distinct, difficulty) index.
+    Structures derived from the words are attached to the corpus, so that
+    they are dropped along with it and their size counts towards its own."""
+
+    def __init__(self, data, offsets, buckets, base=0):
+        self._data = data
+        self._base = base
+        self._offsets = offsets
+        self._buckets = buckets
+        self._longest = max(length for length, _, _ in self._buckets)
+        self._selections = {}
+        self._derived = {}
+        self._derived_lock = threading.Lock()
+        # Called without arguments when nbytes changes, by the registry.
+        self.on_resize = None
+
+    @classmethod
+    def from_words(cls, words):
+        """Builds the corpus and its index from a list of normalized words"""
+        offsets = array.array('I', [0])
+        scores = array.array('B')
+        for word in words:
+            offsets.append(offsets[-1] + len(word))
+            scores.append(difficulty_score(word))
+
+        # Split the scores into three equally sized difficulty bands.
+        ordered = sorted(scores)
+        thresholds = (ordered[len(ordered) // 3],
+                      ordered[2 * len(ordered) // 3])
+
+        buckets = {}
+        for i, word in enumerate(words):
+            level = sum(1 for t in thresholds if scores[i] > t)
+            key = (len(word), len(set(word)), DIFFICULTIES[level])
+            buckets.setdefault(key, array.array('I')).append(i)
+        return cls(''.join(words), offsets, buckets)
+
+    @classmethod
+    def from_file(cls, path=WORDS_FILE):
+        """Reads and normalizes a newline separated word list"""
+        with open(path, 'r') as f:
+            return cls.from_words(normalize_words(f))
+
+    @classmethod
+    def from_compiled(cls, path=COMPILED_WORDS_FILE):
+        """Maps a corpus compiled by build_words.py. Only the bucket directory
+        is decoded; words and bucket entries are read from the mapping on
+        demand. Falls back to reading the file if mmap is unavailable."""
+        with open(path, 'rb') as f:
+            if mmap:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                buf = f.read()
+
+        magic, version, word_count, bucket_count = HEADER.unpack_from(buf)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('{} is not a compiled word list'.format(path))
+
+        offsets_at = HEADER.size
+        buckets_at = offsets_at + 4 * (word_count + 1)
+        entries_at = buckets_at + BUCKET.size * bucket_count
+        data_at = entries_at + 4 * word_count
+
+        buckets = {}
+        for i in range(bucket_count):
+            length, distinct, level, start, count = BUCKET.unpack_from(
+                buf, buckets_at + BUCKET.size * i)
+            buckets[(length, distinct, DIFFICULTIES[level])] = PackedArray(
+                buf, entries_at + 4 * start, count)
+        offsets = PackedArray(buf, offsets_at, word_count + 1)
+        return cls(buf, offsets, buckets, base=data_at)
+
+    def write(self, f):
+        """Writes the corpus in the compiled format to a binary file"""
+        keys = sorted(self._buckets)
+        f.write(HEADER.pack(MAGIC, VERSION, len(self), len(keys)))
+        f.write(''.join(UINT32.pack(self._offsets[i])
+                        for i in range(len(self) + 1)))
+        start = 0
+        for length, distinct, level in keys:
+            count = len(self._buckets[(length, distinct, level)])
+            f.write(BUCKET.pack(length, distinct, DIFFICULTIES.index(level),
+                                start, count))
+            start += count
+        for key in keys:
+            bucket = self._buckets[key]
+            f.write(''.join(UINT32.pack(bucket[i])
+                            for i in range(len(bucket))))
+        f.write(self._data[self._base:self._base + self._offsets[len(self)]])
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    @property
+    def nbytes(self):
+        """The memory held by the words, the offsets, the index and the
+        derived structures that report their own nbytes"""
+        if self._base:
+            # A compiled corpus holds all of them in its mapping.
+            size = len(self._data)
+        else:
+            size = len(self._data) + 4 * (len(self._offsets) + len(self))
+        return size + sum(getattr(derived, 'nbytes', 0)
+                          for derived in self._derived.values())
+
+    def derived(self, name, build):
+        """Returns the structure derived from the corpus under a name,
+        building it with build(corpus) the first time"""
+        structure = self._derived.get(name)
+        if structure is None:
+            with self._derived_lock:
+                structure = self._derived.get(name)
+                if structure is None:
+                    structure = self._derived[name] = build(self)
+            self.resized()
+        return structure
+
+    def resized(self):
+        """Tells the registry holding the corpus that nbytes changed"""
+        if self.on_resize is not None:
+            self.on_resize()
+
+    def word(self, i):
+        """Returns the i-th word of the corpus"""
+        return self._data[self._base + self._offsets[i]:
+                          self._base + self._offsets[i + 1]]
+
+    def _select(self, min_length, max_length, distinct, difficulty):
+        """Returns the buckets matching the constraints along with their
+        cumulative sizes. The result is memoized per set of constraints.
+        Raises a ValueError if the length range is empty."""
+        if ((min_length is not None and min_length < 1) or
+                (max_length is not None and max_length < 1)):
+            raise ValueError('Word lengths must be greater than or equal to 1')
+        if (min_length is not None and max_length is not None and
+                min_length > max_length):
+            raise ValueError('min_length must not be greater than max_length')
+        # Clamp the lengths so that the memo stays bounded by the corpus.
+        min_length = 1 if min_length is None else min_length
+        max_length = (self._longest if max_length is None else
+                      min(max_length, self._longest))
+        query = (min_length, max_length, distinct, difficulty)
+        selection = self._selections.get(query)
+        if selection is None:
+            buckets = []
+            totals = []
+            total = 0
+            for key in sorted(self._buckets):
+                length, letters, level = key
+                if (length < min_length or length > max_length or
+                        (distinct and letters != distinct) or
+                        (difficulty and level != difficulty)):
+                    continue
+                total += len(self._buckets[key])
+                buckets.append(self._buckets[key])
+                totals.append(total)
+            selection = (buckets, totals)
+            if totals:
+                self._selections[query] = selection
+        return selection
+
+    def count(self, min_length=None, max_length=None, distinct=None,
+              difficulty=None):
+        """Returns the number of words matching the constraints"""
+        totals = self._select(min_length, max_length, distinct, difficulty)[1]
+        return totals[-1] if totals else 0
+
+    def words(self, min_length=None, max_length=None, distinct=None,
+              difficulty=None):
+        """Yields every word matching the constraints"""
+        for bucket in self._select(min_length, max_length, distinct,
+                                   difficulty)[0]:
+            for i in range(len(bucket)):
+                yield self.word(bucket[i])
+
+    def random_word(self, min_length=None, max_length=None, distinct=None,
+                    difficulty=None):
+        """Returns a random word matching the constraints. Raises a
+        ValueError if the constraints are invalid or match no word."""
+        if difficulty and difficulty not in DIFFICULTIES:
+            raise ValueError('Difficulty must be one of: {}'.format(
+                ', '.join(DIFFICULTIES)))
+        buckets, totals = self._select(min_length, max_length, distinct,
+                                       difficulty)
+        if not totals:
+            raise ValueError('No word matches the requested length and '
+                             'difficulty!')
+        n = random.randrange(totals[-1])
+        i = bisect.bisect_right(totals, n)
+        bucket = buckets[i]
+        return self.word(bucket[n - totals[i] + len(bucket)])
+
+
+def corpus_files(name):
+    """Returns the plain text and the compiled file of a dictionary"""
+    if name == DEFAULT_CORPUS:
+        return WORDS_FILE, COMPILED_WORDS_FILE
+    path = os.path.join(DICTIONARIES_DIR, name)
+    return path + '.txt', path + '.bin'
+
+
+def load_corpus(name=DEFAULT_CORPUS):
+    """Maps the compiled word list of a dictionary if it has been built,
+    otherwise parses its plain text word list"""
+    text, compiled = corpus_files(name)
+    if os.path.exists(compiled):
+        return WordCorpus.from_compiled(compiled)
+    return WordCorpus.from_file(text)
+
+
+class CorpusRegistry(object):
+    """Loads dictionaries on first use and shares them between threads. The
+    least recently used ones are evicted once the resident dictionaries take
+    more than max_bytes, checked as one is loaded and as the structures
+    derived from one grow; the most recently used one is always kept. A
+    dictionary is loaded by one thread at a time while the others keep being
+    served."""
+
+    def __init__(self, max_bytes=CORPUS_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._resident = collections.OrderedDict()
+        self._stats = {}
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def _resident_corpus(self, name):
+        """Returns a resident dictionary, marking it as most recently used"""
+        corpus = self._resident.pop(name, None)
+        if corpus is not None:
+            self._resident[name] = corpus
+            self._stats[name]['hits'] += 1
+        return corpus
+
+    def get(self, name=None):
+        """Returns a dictionary, loading it if it is not resident. Raises a
+        ValueError if there is no such dictionary."""
+        name = name or DEFAULT_CORPUS
+        with self._lock:
+            corpus = self._resident_corpus(name)
+            if corpus is not None:
+                return corpus
+        if not CORPUS_NAME.match(name) or not any(
+                os.path.exists(path) for path in corpus_files(name)):
+            raise ValueError('Unknown dictionary: {}'.format(name))
+
+        with self._lock:
+            loading = self._loading.setdefault(name, threading.Lock())
+        with loading:
+            with self._lock:
+                # Another thread may have loaded it in the meantime.
+                corpus = self._resident_corpus(name)
+                if corpus is not None:
+                    return corpus
+            start = time.time()
+            corpus = load_corpus(name)
+            load_ms = (time.time() - start) * 1000.0
+            with self._lock:
+                stats = self._stats.setdefault(
+                    name, {'loads': 0, 'hits': 0, 'evictions': 0})
+                stats['loads'] += 1
+                stats['load_ms'] = round(load_ms, 3)
+                stats['bytes'] = corpus.nbytes
+                self._resident[name] = corpus
+                self._evict()
+            corpus.on_resize = self._trim
+            return corpus
+
+    def _trim(self):
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        total = sum(corpus.nbytes for corpus in self._resident.values())
+        while total > self.max_bytes and len(self._resident) > 1:
+            name, corpus = self._resident.popitem(last=False)
+            total -= corpus.nbytes
+            self._stats[name]['bytes'] = corpus.nbytes
+            self._stats[name]['evictions'] += 1
+
+    def stats(self):
+        """Returns the load time, size and use of every dictionary loaded so
+        far by this instance, and whether it is still resident. The size of
+        a resident dictionary is its current one, derived structures
+        included."""
+        with self._lock:
+            for name, corpus in self._resident.items():
+                self._stats[name]['bytes'] = corpus.nbytes
+            return dict((name, dict(stats, resident=name in self._resident))
+                        for name, stats in self._stats.items())
+
+
+_registry = CorpusRegistry()
+
+
+def get_corpus(name=None):
+    """Returns a dictionary of the instance wide registry, words.txt by
+    default, loading it on first use"""
+    return _registry.get(name)
+
+
+def corpus_stats():
+    return _registry.stats()
@@ -0,0 +1,197 @@
+"""engine.py - The Hangman rules on plain integers. This module does not depend
+on the Datastore so that it can be used and benchmarked on its own, and so
+that the Datastore models, the token games and the storage backends all play
+and score games with the same rules.
+
+A WordEngine precomputes, for each of the 26 letters, a bitmask of the
+positions where it occurs in the target. The letters guessed so far are kept
+as a 26-bit mask, which makes evaluating a guess, detecting a win and
+rejecting a repeated guess single integer operations.
+
+The moves of a game are logged as packed (letter, revealed positions)
+records, from which the word state after each move can be replayed."""
+
+import struct
+
+ALPHABET = 'abcdefghijklmnopqrstuvwxyz'
+
+MOVE = struct.Struct('<cI')
+WORD_GUESS = '*'
+# The positions a move revealed are logged as a 32-bit mask.
+MAX_WORD_LENGTH = 32
+
+ALREADY_OVER = 'Game already over!'
+CANCELLED = 'Cannot make a move in a cancelled game!'
+
+
+def letter_bit(letter):
+    """Returns the bit of a lowercase letter in a guessed-letters mask"""
+    return 1 << (ord(letter) - 97)
+
+
+def letters_mask(word):
+    """Returns the guessed-letters mask of the letters of a word"""
+    mask = 0
+    for letter in word:
+        if letter in ALPHABET:
+            mask |= letter_bit(letter)
+    return mask
+
+
+def render(target, revealed):
+    """Returns the target with the positions not in revealed replaced by '_'"""
+    return ''.join(letter if revealed >> i & 1 else '_'
+                   for i, letter in enumerate(target))
+
+
+def pack_move(guess, hits):
+    """Returns the move log record of a guess and the positions it revealed"""
+    return MOVE.pack(WORD_GUESS if len(guess) > 1 else str(guess), hits)
+
+
+def pack_word_states(guesses, word_states):
+    """Returns the move log of a history recorded as a list of guesses and
+    the word state after each of them"""
+    moves = []
+    for i in range(1, len(guesses)):
+        hits = 0
+        for j, (before, after) in enumerate(zip(word_states[i - 1],
+                                                word_states[i])):
+            if before != after:
+                hits |= 1 << j
+        moves.append(pack_move(guesses[i], hits))
+    return ''.join(moves)
+
+
+def replay_moves(target, moves):
+    """Yields the guess and the resulting word state of each move of a move
+    log, one move at a time"""
+    state = ['_'] * len(target)
+    for offset in xrange(0, len(moves), MOVE.size):
+        letter, hits = MOVE.unpack_from(moves, offset)
+        while hits:
+            i = (hits & -hits).bit_length() - 1
+            state[i] = target[i]
+            hits &= hits - 1
+        yield target if letter == WORD_GUESS else letter, ''.join(state)
+
+
+def describe_move(guess, hits):
+    """Returns the message of a valid guess that revealed hits"""
+    if len(guess) > 1:
+        return 'Word Guessed Correctly!'
+    return 'Letter Found!' if hits else 'Letter not found!'
+
+
+def check_attempts(attempts):
+    """Raises a ValueError unless a game can allow this many attempts"""
+    if attempts < 1:
+        raise ValueError('Attempts must be greater than or equal to 1')
+
+
+def is_over(engine, attempts_remaining):
+    """Returns whether a game is over: its word found or its attempts used"""
+    return attempts_remaining < 1 or engine.won
+
+
+def play_turn(engine, guess, attempts_remaining):
+    """Plays a guess of a game on its WordEngine. Returns the message
+    describing the result, the mask of the positions revealed and the
+    attempts remaining: a letter missing from the target costs one. The
+    message ends with 'Game over!' if the guess ended the game. Raises an
+    InvalidGuessError, without playing it, for a guess WordEngine.play
+    rejects."""
+    hits = engine.play(guess)
+    if not hits and len(guess) == 1:
+        attempts_remaining -= 1
+    message = describe_move(guess, hits)
+    if is_over(engine, attempts_remaining):
+        message += ' Game over!'
+    return message, hits, attempts_remaining
+
+
+def score_game(attempts_allowed, attempts_remaining):
+    """Returns the guesses missed and the score of a finished game: the
+    share of its attempts left, so that games allowing more attempts do not
+    score more"""
+    return (attempts_allowed - attempts_remaining,
+            attempts_remaining / float(attempts_allowed))
+
+
+class InvalidGuessError(ValueError):
+    """Raised for a guess that cannot be played"""
+
+
+class WordEngine(object):
+    """The state of one Hangman word: its target and the guessed letters"""
+    __slots__ = ('target', 'positions', 'letters', 'solved', 'guessed',
+                 'revealed', '_word_state')
+
+    def __init__(self, target, guessed=0):
+        self.target = target
+        self.positions = [0] * 26
+        for i, letter in enumerate(target):
+            self.positions[ord(letter) - 97] |= 1 << i
+        self.letters = letters_mask(target)
+        self.solved = (1 << len(target)) - 1
+        self.guessed = 0
+        self.revealed = 0
+        self._word_state = None
+        self._reveal(guessed)
+
+    @classmethod
+    def from_word_state(cls, target, word_state):
+        """Rebuilds the engine of a game saved before guessed letters were
+        recorded. Only the letters found so far can be recovered."""
+        return cls(target, letters_mask(word_state))
+
+    def _reveal(self, guessed):
+        new = guessed & ~self.guessed
+        self.guessed |= guessed
+        hits = 0
+        while new:
+            bit = new & -new
+            hits |= self.positions[bit.bit_length() - 1]
+            new ^= bit
+        if hits:
+            self.revealed |= hits
+            self._word_state = None
+        return hits
+
+    def has_guessed(self, letter):
+        return bool(self.guessed & letter_bit(letter))
+
+    def play(self, guess):
+        """Plays a letter or a whole word guess and returns the mask of the
+        positions it revealed, 0 if the letter is not in the target. Raises
+        an InvalidGuessError for anything else or a repeated letter."""
+        guess = guess.lower()
+        if len(guess) == 1 and 'a' <= guess <= 'z':
+            bit = 1 << (ord(guess) - 97)
+            if self.guessed & bit:
+                raise InvalidGuessError(
+                    'You have already guessed that letter!')
+            self.guessed |= bit
+            hits = self.positions[ord(guess) - 97]
+            if hits:
+                self.revealed |= hits
+                self._word_state = None
+            return hits
+        if not guess or not all(l in ALPHABET for l in guess):
+            raise InvalidGuessError(
+                'Please enter letters only! No symbols or numbers')
+        if guess != self.target:
+            raise InvalidGuessError('Please guess 1 letter at a time or '
+                                    'guess the entire word!')
+        return self._reveal(self.letters)
+
+    @property
+    def won(self):
+        return self.revealed == self.solved
+
+    @property
+    def word_state(self):
+        """The target with the letters not guessed yet replaced by '_'"""
+        if self._word_state is None:
+            self._word_state = render(self.target, self.revealed)
+        return self._word_state
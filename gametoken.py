@@ -0,0 +1,131 @@
+"""gametoken.py - Stateless games whose whole state travels with the client.
+
+The state of a token game (its id, user, target, guessed letters and
+attempts) is packed into a few dozen bytes, encrypted with AES-CTR under a
+fresh random IV and signed with HMAC-SHA256, then returned to the client in
+place of a game key. A move decodes the token, plays the guess on a
+WordEngine and encodes a new token, without any storage I/O.
+
+The client cannot read the target or forge a state, but nothing stops it
+from replaying an older token of the same game to take back a guess. A game
+is only scored the first time it ends, keyed by its id, so replaying its
+last move does not score it again; misses can still be taken back before
+then, so token games are meant for casual play."""
+
+import base64
+import hashlib
+import hmac
+import os
+import struct
+
+from Crypto.Cipher import AES
+from Crypto.Util import Counter
+
+from engine import ALREADY_OVER, WordEngine, is_over, play_turn
+
+VERSION = 1
+# version, IV; then encrypted: game id, user id, guessed letters, attempts
+# allowed, attempts remaining, followed by the target; then the signature.
+HEADER = struct.Struct('<B8s')
+STATE = struct.Struct('<12sqIBB')
+SIGNATURE_SIZE = 16
+
+
+def _compare_digest(a, b):
+    """Compares two strings in a time independent of where they differ"""
+    if len(a) != len(b):
+        return False
+    result = 0
+    for x, y in zip(a, b):
+        result |= ord(x) ^ ord(y)
+    return result == 0
+
+# hmac.compare_digest only exists from Python 2.7.7.
+compare_digest = getattr(hmac, 'compare_digest', _compare_digest)
+
+
+class InvalidTokenError(ValueError):
+    """Raised for a token that was not issued by this app or was altered"""
+
+
+class TokenGame(object):
+    """The state of a token game, played with the same rules as Game"""
+    __slots__ = ('game_id', 'user_id', 'engine', 'attempts_allowed',
+                 'attempts_remaining', 'current_guess')
+
+    def __init__(self, game_id, user_id, target, guessed, attempts_allowed,
+                 attempts_remaining):
+        self.game_id = game_id
+        self.user_id = user_id
+        self.engine = WordEngine(target, guessed)
+        self.attempts_allowed = attempts_allowed
+        self.attempts_remaining = attempts_remaining
+        self.current_guess = ''
+
+    @classmethod
+    def new(cls, user_id, target, attempts):
+        if not 1 <= attempts <= 255:
+            raise ValueError('Attempts must be between 1 and 255')
+        return cls(os.urandom(12), user_id, target, 0, attempts, attempts)
+
+    @property
+    def game_over(self):
+        return is_over(self.engine, self.attempts_remaining)
+
+    def play(self, guess):
+        """Plays a guess and returns the message describing its result.
+        Raises a ValueError if the guess is invalid or was already made."""
+        if self.game_over:
+            raise ValueError(ALREADY_OVER)
+        msg, _, self.attempts_remaining = play_turn(
+            self.engine, guess, self.attempts_remaining)
+        self.current_guess = guess.lower()
+        return msg
+
+
+class TokenCodec(object):
+    """Encodes and decodes the tokens of TokenGames under a secret"""
+
+    def __init__(self, secret):
+        self._cipher_key = hmac.new(secret, 'encrypt',
+                                    hashlib.sha256).digest()
+        self._signing_key = hmac.new(secret, 'sign', hashlib.sha256).digest()
+
+    def _cipher(self, iv):
+        return AES.new(self._cipher_key, AES.MODE_CTR,
+                       counter=Counter.new(64, prefix=iv))
+
+    def _sign(self, data):
+        return hmac.new(self._signing_key, data,
+                        hashlib.sha256).digest()[:SIGNATURE_SIZE]
+
+    def encode(self, game):
+        """Returns the urlsafe token of a game"""
+        iv = os.urandom(8)
+        state = STATE.pack(game.game_id, game.user_id, game.engine.guessed,
+                           game.attempts_allowed, game.attempts_remaining)
+        data = HEADER.pack(VERSION, iv) + self._cipher(iv).encrypt(
+            state + game.engine.target)
+        return base64.urlsafe_b64encode(data + self._sign(data)).rstrip('=')
+
+    def decode(self, token):
+        """Returns the game of a token. Raises an InvalidTokenError if the
+        token is malformed, altered or was signed with another secret."""
+        try:
+            token = base64.urlsafe_b64decode(
+                str(token) + '=' * (-len(token) % 4))
+        except (TypeError, UnicodeEncodeError):
+            raise InvalidTokenError('Invalid token')
+        data, signature = token[:-SIGNATURE_SIZE], token[-SIGNATURE_SIZE:]
+        if (len(data) <= HEADER.size + STATE.size or
+                not compare_digest(self._sign(data), signature)):
+            raise InvalidTokenError('Invalid token')
+        version, iv = HEADER.unpack_from(data)
+        if version != VERSION:
+            raise InvalidTokenError('Invalid token')
+
+        plain = self._cipher(iv).decrypt(data[HEADER.size:])
+        game_id, user_id, guessed, allowed, remaining = STATE.unpack_from(
+            plain)
+        return TokenGame(game_id, user_id, plain[STATE.size:], guessed,
+                         allowed, remaining)
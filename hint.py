@@ -0,0 +1,102 @@
+"""hint.py - Suggests the next letter of a game from the words of the corpus
+that are still possible.
+
+The words of each length are held as a NumPy uint8 matrix of letter codes, one
+row per word, along with a boolean matrix of the letters each word contains.
+A hint keeps the rows matching the revealed positions whose hidden positions
+hold none of the guessed letters, then counts the remaining words containing
+each letter, all with vectorized operations instead of a loop over strings."""
+
+import threading
+
+import numpy
+
+from corpus import get_corpus
+from engine import ALPHABET
+
+
+class LengthIndex(object):
+    """The words of one length of the corpus"""
+    __slots__ = ('codes', 'contains')
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.contains.nbytes
+
+    def __init__(self, words, length):
+        words = ''.join(words)
+        count = len(words) // length
+        if count:
+            self.codes = numpy.frombuffer(words, dtype=numpy.uint8).reshape(
+                count, length) - numpy.uint8(97)
+        else:
+            self.codes = numpy.zeros((0, length), dtype=numpy.uint8)
+        self.contains = numpy.zeros((count, 26), dtype=bool)
+        self.contains[numpy.arange(count)[:, numpy.newaxis], self.codes] = True
+
+    def candidates(self, word_state, guessed):
+        """Returns the boolean mask of the words matching a word state in
+        which the letters of the guessed mask were played"""
+        excluded = numpy.array([bool(guessed >> i & 1) for i in range(26)])
+        known = [i for i, letter in enumerate(word_state) if letter != '_']
+        hidden = [i for i, letter in enumerate(word_state) if letter == '_']
+
+        matches = numpy.ones(len(self.codes), dtype=bool)
+        if known:
+            letters = numpy.array([ord(word_state[i]) - 97 for i in known],
+                                  dtype=numpy.uint8)
+            matches &= (self.codes[:, known] == letters).all(axis=1)
+            excluded[letters] = True
+        if hidden:
+            matches &= ~excluded[self.codes[:, hidden]].any(axis=1)
+        return matches, excluded
+
+    def hint(self, word_state, guessed):
+        """Returns the letter not guessed yet that is in the most of the
+        possible words, or None if there is none, along with the number of
+        possible words"""
+        matches, excluded = self.candidates(word_state, guessed)
+        counts = self.contains[matches].sum(axis=0)
+        counts[excluded] = 0
+        best = int(counts.argmax())
+        return (ALPHABET[best] if counts[best] else None,
+                int(matches.sum()))
+
+
+class HintIndex(object):
+    """The corpus split into a LengthIndex per word length, each built the
+    first time a game of that length asks for a hint. Its size counts
+    towards the corpus's in the registry's memory budget."""
+
+    def __init__(self, words):
+        self._words = words
+        self._lengths = {}
+        self._lock = threading.Lock()
+
+    def for_length(self, length):
+        index = self._lengths.get(length)
+        if index is None:
+            with self._lock:
+                index = self._lengths.get(length)
+                if index is None:
+                    index = LengthIndex(self._words.words(length, length),
+                                        length)
+                    self._lengths[length] = index
+            self._words.resized()
+        return index
+
+    @property
+    def nbytes(self):
+        return sum(index.nbytes for index in list(self._lengths.values()))
+
+    def hint(self, word_state, guessed):
+        """Returns the suggested letter and the number of possible words for
+        a word state and the mask of the letters guessed so far"""
+        return self.for_length(len(word_state)).hint(word_state, guessed)
+
+
+def get_hints(corpus=None):
+    """Returns the HintIndex of a dictionary, words.txt by default. It is
+    derived from the WordCorpus so that it is dropped along with it when the
+    dictionary is evicted."""
+    return get_corpus(corpus).derived('hints', HintIndex)
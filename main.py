@@ -2,67 +2,382 @@
 
 """main.py - This file contains handlers that are called by taskqueue and/or
 cronjobs."""
+import csv
+import datetime
+import json
 import logging
 
-import webapp2
-from google.appengine.api import mail, app_identity
-from api import GuessANumberApi
+import startup
+from startup import timed
 
-from models import User, Game
+# The imports are timed as the instance starts; the heavier dependencies of
+# models are imported on their own so that they are timed separately.
+with timed('import webapp2'):
+    import webapp2
+with timed('import google.appengine'):
+    from google.appengine.api import mail, app_identity, taskqueue
+    from google.appengine.datastore.datastore_query import Cursor
+    from google.appengine.ext import ndb
+    from google.appengine.runtime import apiproxy_errors
+with timed('import models'):
+    from models import User, UserName, Game, GameCache, GameStats, \
+        Game_History, Rank, Score, ScoreBucket, LEADERBOARD_SIZE
+    from utils import handler_stats, instrumented
+from corpus import corpus_stats, get_corpus
 #from google.appengine.ext import db
 #import logging
 
+# Active games read per scan task, and users per mail task.
+REMINDER_SCAN_BATCH = 1000
+REMINDER_SHARD_SIZE = 100
+REMINDER_MAX_ATTEMPTS = 5
+# Scores read per rollup backfill scan task, and rolled up per shard task.
+ROLLUP_SCAN_BATCH = 1000
+ROLLUP_SHARD_SIZE = 100
+# Time format of the reaper's cutoff in task parameters.
+REAP_BEFORE_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+
 class SendReminderEmail(webapp2.RequestHandler):
+    @instrumented
     def get(self):
-        """Send a reminder email to each User with an email about games.
-        Called every hour using a cron job"""
+        """Start sending a reminder email to each User with an email about
+        their incomplete games. Called every hour using a cron job"""
+        run = datetime.datetime.utcnow().strftime('%Y%m%d%H')
+        try:
+            taskqueue.add(url='/tasks/scan_reminders', params={'run': run},
+                          name='reminders-{}'.format(run))
+        except (taskqueue.TaskAlreadyExistsError,
+                taskqueue.TombstonedTaskError):
+            logging.info('Reminders %s have already been started', run)
+
+
+class ScanReminders(webapp2.RequestHandler):
+    @instrumented
+    def post(self):
+        """Count the incomplete games of each user from a page of a projection
+        query ordered by user, and fan the users out into mail tasks. The
+        last user of the page may have more games on the next page, so it is
+        carried over to the task scanning that page."""
+        run = self.request.get('run')
+        page = int(self.request.get('page', 0))
+        cursor = self.request.get('cursor')
+        groups = json.loads(self.request.get('carry', '[]'))
+
+        query = Game.query(Game.game_over == False, Game.cancel == False,
+                           projection=[Game.user]).order(Game.user)
+        games, cursor, more = query.fetch_page(
+            REMINDER_SCAN_BATCH,
+            start_cursor=Cursor(urlsafe=cursor) if cursor else None)
+        for game in games:
+            user = game.user.urlsafe()
+            if groups and groups[-1][0] == user:
+                groups[-1][1] += 1
+            else:
+                groups.append([user, 1])
+
+        carry = groups[-1:] if more else []
+        groups = groups[:-1] if more else groups
+        # Task names make a retried scan skip the tasks it already added.
+        tasks = [taskqueue.Task(
+            url='/tasks/send_reminders',
+            params={'reminders': json.dumps(groups[i:i + REMINDER_SHARD_SIZE])},
+            name='reminders-{}-{}-{}'.format(run, page, i))
+            for i in range(0, len(groups), REMINDER_SHARD_SIZE)]
+        if more:
+            tasks.append(taskqueue.Task(
+                url='/tasks/scan_reminders',
+                params={'run': run, 'page': page + 1,
+                        'cursor': cursor.urlsafe(), 'carry': json.dumps(carry)},
+                name='reminders-{}-{}'.format(run, page + 1)))
+        try:
+            taskqueue.Queue().add(tasks)
+        except (taskqueue.TaskAlreadyExistsError,
+                taskqueue.TombstonedTaskError):
+            pass
+
+
+class SendReminders(webapp2.RequestHandler):
+    @instrumented
+    def post(self):
+        """Send the reminder emails of a shard of users. The users are fetched
+        with a single get, and emails that fail are retried by a new task
+        holding only them, with an increasing delay."""
+        reminders = json.loads(self.request.get('reminders'))
+        attempt = int(self.request.get('attempt', 0))
+        users = ndb.get_multi([ndb.Key(urlsafe=key) for key, _ in reminders])
         app_id = app_identity.get_application_id()
-        users = User.query(User.email != None)
-        
-        #logging.info('DEBUG DEBUG DEBUG')
-        
-        for user in users:
-            games = Game.query(Game.user == user.key, Game.game_over == False, Game.cancel == False).fetch()
-            if games:
-                subject = 'This is a reminder'
-                body = 'Hello {}, you still have {} incomplete Hangman games!'.format(user.name, len(games))
+
+        failed = []
+        for (key, count), user in zip(reminders, users):
+            if not user or not user.email:
+                continue
+            subject = 'This is a reminder'
+            body = 'Hello {}, you still have {} incomplete Hangman games!'.format(user.name, count)
+            try:
                 mail.send_mail('noreply@{}.appspotmail.com'.format(app_id),
-                           user.email,
-                           subject,
-                           body)
-        
-        # Original Code
-        # for game in games:
-        #     logging.info(game)
-        #     use = game.user.get()
-        #     subject = 'This is a reminder!'
-        #     body = 'Hello {}, you still have incomplete Hangman games!'.format(use.name)
-        #     # This will send test emails, the arguments to send_mail are:
-        #     # from, to, subject, body
-        #     mail.send_mail('noreply@{}.appspotmail.com'.format(app_id),
-        #                    use.email,
-        #                    subject,
-        #                    body)
-
-        # for user in users:
-        #     subject = 'This is a reminder!'
-        #     body = 'Hello {}, try out Hangman!'.format(user.name)
-        #     # This will send test emails, the arguments to send_mail are:
-        #     # from, to, subject, body
-        #     mail.send_mail('noreply@{}.appspotmail.com'.format(app_id),
-        #                    user.email,
-        #                    subject,
-        #                    body)
-
-
-class UpdateAverageMovesRemaining(webapp2.RequestHandler):
+                               user.email,
+                               subject,
+                               body)
+            except (mail.Error, apiproxy_errors.Error) as e:
+                logging.warning('Reminder to %s failed: %s', user.email, e)
+                failed.append([key, count])
+
+        if failed and attempt + 1 < REMINDER_MAX_ATTEMPTS:
+            taskqueue.add(url='/tasks/send_reminders',
+                          params={'reminders': json.dumps(failed),
+                                  'attempt': attempt + 1},
+                          countdown=60 * 2 ** attempt)
+        elif failed:
+            logging.error('Giving up on %d reminders', len(failed))
+
+
+class ReconcileGameStats(webapp2.RequestHandler):
+    @instrumented
+    def get(self):
+        """Recount the active games counters from the Game entities.
+        Called every day using a cron job"""
+        GameStats.reconcile()
+
+
+class AdjustGameStats(webapp2.RequestHandler):
+    @instrumented
+    def post(self):
+        """Add games created in bulk to the active games counters"""
+        GameStats.adjust(int(self.request.get('games')),
+                         int(self.request.get('attempts')))
+
+
+class MigrateRanks(webapp2.RequestHandler):
+    @instrumented
+    def post(self):
+        """Rekey the Rank entities created before ranks were keyed by user.
+        Run once after deploying."""
+        Rank.migrate()
+        self.response.set_status(204)
+
+
+class RebuildLeaderboard(webapp2.RequestHandler):
+    @instrumented
+    def post(self):
+        """Recount the leaderboard's score buckets from the Rank entities.
+        Run once after migrating the ranks."""
+        ScoreBucket.rebuild()
+        self.response.set_status(204)
+
+
+class MoveScoreBucket(webapp2.RequestHandler):
+    @instrumented
+    def post(self):
+        """Move a rank between the leaderboard's score buckets after its
+        game ended"""
+        old = self.request.get('old')
+        ScoreBucket.move(int(old) if old else None,
+                         int(self.request.get('new')))
+
+
+class MigrateUserNames(webapp2.RequestHandler):
+    @instrumented
+    def post(self):
+        """Index the names of a batch of existing User entities and enqueue
+        the next batch. Run once after deploying."""
+        cursor = self.request.get('cursor')
+        cursor = UserName.migrate_batch(
+            Cursor(urlsafe=cursor) if cursor else None)
+        if cursor:
+            taskqueue.add(url='/tasks/migrate_user_names',
+                          params={'cursor': cursor.urlsafe()})
+        self.response.set_status(204)
+
+
+class ExportScores(webapp2.RequestHandler):
+    BATCH_SIZE = 500
+    BATCHES_PER_REQUEST = 20
+
+    @instrumented
+    def get(self):
+        """Write Score entities as CSV rows for offline analytics, a batch at
+        a time. Each request covers a bounded number of batches; the export
+        continues from the cursor in the X-Next-Cursor header until it is
+        absent."""
+        cursor = self.request.get('cursor')
+        cursor = Cursor(urlsafe=cursor) if cursor else None
+        self.response.headers['Content-Type'] = 'text/csv'
+        writer = csv.writer(self.response.out)
+        if not cursor:
+            writer.writerow(['user_name', 'date', 'won', 'guesses', 'score'])
+
+        batches = Score.batches(self.BATCH_SIZE, cursor)
+        for i, (scores, cursor) in enumerate(batches):
+            names = User.names_async(score.user
+                                     for score in scores).get_result()
+            writer.writerows([names[score.user].encode('utf-8'), score.date,
+                              score.won, score.guesses, score.score]
+                             for score in scores)
+            if (i + 1 == self.BATCHES_PER_REQUEST and
+                    len(scores) == self.BATCH_SIZE):
+                self.response.headers['X-Next-Cursor'] = cursor.urlsafe()
+                break
+
+
+class MigrateGameHistories(webapp2.RequestHandler):
+    @instrumented
+    def post(self):
+        """Convert a batch of legacy Game_History entities to the move log
+        and enqueue the next batch. Run once after deploying."""
+        cursor = self.request.get('cursor')
+        cursor = Game_History.migrate_batch(
+            Cursor(urlsafe=cursor) if cursor else None)
+        if cursor:
+            taskqueue.add(url='/tasks/migrate_game_histories',
+                          params={'cursor': cursor.urlsafe()})
+        self.response.set_status(204)
+
+
+class StartReapingGames(webapp2.RequestHandler):
+    @instrumented
+    def get(self):
+        """Start reaping the cancelled games and the unfinished games that
+        have not been played for a while. Called every day using a cron job"""
+        now = datetime.datetime.utcnow()
+        run = now.strftime('%Y%m%d')
+        tasks = [taskqueue.Task(
+            url='/tasks/reap_games',
+            params={'cancelled': int(cancelled),
+                    'before': Game.reap_before(cancelled, now).strftime(
+                        REAP_BEFORE_FORMAT)},
+            name='reap-{}-{}'.format(run, int(cancelled)))
+            for cancelled in (True, False)]
+        try:
+            taskqueue.Queue().add(tasks)
+        except (taskqueue.TaskAlreadyExistsError,
+                taskqueue.TombstonedTaskError):
+            logging.info('Reaping %s has already been started', run)
+
+
+class ReapGames(webapp2.RequestHandler):
+    @instrumented
+    def post(self):
+        """Archive and delete a batch of stale games and enqueue the next
+        batch. The cutoff is fixed by the cron run so that the cursor stays
+        valid across batches."""
+        cancelled = bool(int(self.request.get('cancelled')))
+        before = self.request.get('before')
+        cursor = self.request.get('cursor')
+        cursor = Game.reap_batch(
+            cancelled,
+            datetime.datetime.strptime(before, REAP_BEFORE_FORMAT),
+            Cursor(urlsafe=cursor) if cursor else None)
+        if cursor:
+            taskqueue.add(url='/tasks/reap_games',
+                          params={'cancelled': int(cancelled),
+                                  'before': before,
+                                  'cursor': cursor.urlsafe()})
+
+
+class MigrateGameActivity(webapp2.RequestHandler):
+    @instrumented
     def post(self):
-        """Update game listing announcement in memcache."""
-        GuessANumberApi._cache_average_attempts()
+        """Stamp the last activity of a batch of existing games and enqueue
+        the next batch. Run once after deploying."""
+        cursor = self.request.get('cursor')
+        cursor = Game.migrate_batch(Cursor(urlsafe=cursor) if cursor else None)
+        if cursor:
+            taskqueue.add(url='/tasks/migrate_game_activity',
+                          params={'cursor': cursor.urlsafe()})
         self.response.set_status(204)
 
 
+class BackfillRollups(webapp2.RequestHandler):
+    @instrumented
+    def post(self):
+        """Fan a page of the Score keys, ordered by user and date, out into
+        tasks rolling them up, and enqueue the scan of the next page. Run
+        once after deploying; scores are only ever rolled up once, so the
+        backfill can be rerun safely."""
+        cursor = self.request.get('cursor')
+        query = Score.query().order(Score.user, -Score.date)
+        keys, cursor, more = query.fetch_page(
+            ROLLUP_SCAN_BATCH, keys_only=True,
+            start_cursor=Cursor(urlsafe=cursor) if cursor else None)
+        tasks = [taskqueue.Task(
+            url='/tasks/roll_up_scores',
+            params={'scores': json.dumps([key.urlsafe() for key in
+                                          keys[i:i + ROLLUP_SHARD_SIZE]])})
+            for i in range(0, len(keys), ROLLUP_SHARD_SIZE)]
+        if more:
+            tasks.append(taskqueue.Task(url='/tasks/backfill_rollups',
+                                        params={'cursor': cursor.urlsafe()}))
+        if tasks:
+            taskqueue.Queue().add(tasks)
+        self.response.set_status(204)
+
+
+class RollUpScores(webapp2.RequestHandler):
+    @instrumented
+    def post(self):
+        """Roll up a shard of Scores into their UserStats and DailyStats"""
+        Score.roll_up_batch([ndb.Key(urlsafe=key) for key in
+                             json.loads(self.request.get('scores'))])
+
+
+class ReportHandlerStats(webapp2.RequestHandler):
+    def get(self):
+        """Return the latency histograms and API call totals of the handlers
+        served by this instance, along with its game cache hits and misses,
+        the load time and size of its dictionaries and its startup timings,
+        as JSON. POST resets the handlers' stats."""
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps({
+            'latency_buckets_ms': handler_stats.LATENCY_BUCKETS,
+            'handlers': handler_stats.snapshot(),
+            'game_cache': GameCache.stats(),
+            'corpora': corpus_stats(),
+            'startup_ms': startup.timings(),
+        }, indent=2))
+
+    def post(self):
+        handler_stats.reset()
+        self.response.set_status(204)
+
+
+class Warmup(webapp2.RequestHandler):
+    def get(self):
+        """Do the work of the first requests of a new instance before it
+        serves them: import the API, load the word corpus, and prime the
+        leaderboard and its users' names in memcache. Called by App Engine as
+        the instance starts. pycrypto and the token secret are left to the
+        first token game, as NumPy is to the first hint."""
+        with timed('import api (endpoints, api_server)'):
+            import api
+        with timed('load corpus'):
+            get_corpus()
+        with timed('prime leaderboard'):
+            ranks = Rank.top(LEADERBOARD_SIZE)
+        with timed('prime user names'):
+            names = User.names_async(rank.user for rank in ranks).get_result()
+            ndb.get_multi([UserName.key_for(name)
+                           for name in names.values() if name])
+        logging.info('startup_ms %s', json.dumps(startup.timings()))
+
+
 app = webapp2.WSGIApplication([
+    ('/_ah/warmup', Warmup),
     ('/crons/send_reminder', SendReminderEmail),
-    ('/tasks/cache_average_attempts', UpdateAverageMovesRemaining),
+    ('/tasks/scan_reminders', ScanReminders),
+    ('/tasks/send_reminders', SendReminders),
+    ('/crons/reconcile_game_stats', ReconcileGameStats),
+    ('/crons/reap_games', StartReapingGames),
+    ('/tasks/reap_games', ReapGames),
+    ('/tasks/migrate_game_activity', MigrateGameActivity),
+    ('/tasks/adjust_game_stats', AdjustGameStats),
+    ('/tasks/migrate_ranks', MigrateRanks),
+    ('/tasks/migrate_game_histories', MigrateGameHistories),
+    ('/tasks/rebuild_leaderboard', RebuildLeaderboard),
+    ('/tasks/move_score_bucket', MoveScoreBucket),
+    ('/tasks/export_scores', ExportScores),
+    ('/tasks/migrate_user_names', MigrateUserNames),
+    ('/tasks/handler_stats', ReportHandlerStats),
+    ('/tasks/backfill_rollups', BackfillRollups),
+    ('/tasks/roll_up_scores', RollUpScores),
 ], debug=True)
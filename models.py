@@ -2,34 +2,239 @@
 entities used by the Game. Because these classes are also regular Python
 classes they can include methods (such as 'to_form' and 'new_game')."""
 
+import bisect
+import collections
+import json
+import os
 import random
-import logging
-from datetime import date
+import threading
+import zlib
+from datetime import date, datetime, timedelta
 from protorpc import messages
+from google.appengine.api import datastore_errors, memcache, taskqueue
 from google.appengine.ext import ndb
 
+from corpus import get_corpus
+from engine import ALREADY_OVER, CANCELLED, WordEngine, check_attempts, \
+    is_over, letters_mask, pack_move, pack_word_states, play_turn, \
+    replay_moves, score_game
+
 
 class User(ndb.Model):
     """User profile"""
     name = ndb.StringProperty(required=True)
     email =ndb.StringProperty()
 
+    @classmethod
+    @ndb.tasklet
+    def names_async(cls, user_keys):
+        """Returns a dict of the names of the given users, fetched with a
+        single get_multi. Users are served from ndb's in-context cache and
+        memcache when they have been read before. The others are read with
+        eventual consistency, which lets the Datastore get them in one RPC
+        instead of one per 10 entity groups."""
+        keys = list(set(user_keys))
+        users = yield ndb.get_multi_async(
+            keys, read_policy=ndb.EVENTUAL_CONSISTENCY)
+        raise ndb.Return(dict((key, user.name if user else '')
+                              for key, user in zip(keys, users)))
+
+    @classmethod
+    def get_by_name(cls, name):
+        """Returns the user with a name, ignoring case, or None. Users are
+        found through their UserName with key gets; users created before
+        UserName existed are found as _get_unindexed does."""
+        user_name = UserName.key_for(name).get()
+        if user_name:
+            return user_name.user.get()
+        return cls._get_unindexed(name)
+
+    @classmethod
+    def keys_by_name(cls, names):
+        """Returns a dict of the keys of the users with the given names, None
+        for names without a user, with a single get_multi of their UserNames.
+        Unindexed names are looked up as get_by_name does."""
+        names = list(set(names))
+        user_names = ndb.get_multi([UserName.key_for(name) for name in names])
+        keys = {}
+        for name, user_name in zip(names, user_names):
+            if user_name:
+                keys[name] = user_name.user
+            else:
+                user = cls._get_unindexed(name)
+                keys[name] = user.key if user else None
+        return keys
+
+    @classmethod
+    def key_by_name(cls, name):
+        """Returns the key of the user with a name, or None, without reading
+        the user, so that it can be read along with the user's entities"""
+        return cls.keys_by_name([name])[name]
+
+    @classmethod
+    def _get_unindexed(cls, name):
+        """Returns the user created before UserName existed with a name,
+        ignoring case, after indexing it, or None. An exact match is found
+        with a query and any other casing by scanning the users, in key order
+        as UserName.migrate_batch visits them; nothing is read once the
+        migration has finished."""
+        if UserName.all_indexed():
+            return None
+        user = cls.query(cls.name == name).get()
+        if not user:
+            key = UserName.key_for(name)
+            user = next((user for user in cls.query().iter(batch_size=500)
+                         if UserName.key_for(user.name) == key), None)
+            if not user:
+                return None
+        # Indexed now, so that no new user can take the name meanwhile.
+        user_name = UserName.get_or_insert(UserName.key_for(name).id(),
+                                           user=user.key)
+        return user if user_name.user == user.key else user_name.user.get()
+
+    @classmethod
+    def create(cls, name, email):
+        """Creates a user along with its UserName in a transaction. Returns
+        the user, or None if the name is already taken, ignoring case, or
+        concurrent creations of the name kept the transaction from
+        committing."""
+        if cls._get_unindexed(name):
+            return None
+        # Ids cannot be allocated in a transaction.
+        user_key = ndb.Key(cls, cls.allocate_ids(1)[0])
+        try:
+            return cls._create(user_key, name, email)
+        except datastore_errors.TransactionFailedError:
+            return None
+
+    @classmethod
+    @ndb.transactional(xg=True)
+    def _create(cls, user_key, name, email):
+        user_name_key = UserName.key_for(name)
+        if user_name_key.get():
+            return None
+        user = cls(key=user_key, name=name, email=email)
+        ndb.put_multi([user, UserName(key=user_name_key, user=user.key)])
+        return user
+
+class UserName(ndb.Model):
+    """Unique index of user names, keyed by the normalized name"""
+    user = ndb.KeyProperty(required=True, kind='User', indexed=False)
+
+    @classmethod
+    def key_for(cls, name):
+        return ndb.Key(cls, name.strip().lower())
+
+    @staticmethod
+    def all_indexed():
+        """Returns whether the names of every user created before UserName
+        existed have been indexed"""
+        return UserNamesIndexed.get_by_id('all') is not None
+
+    @classmethod
+    def migrate_batch(cls, cursor=None, batch_size=100):
+        """Indexes the names of a batch of users created before UserName
+        existed and returns the cursor of the next batch, or None once every
+        user has been visited"""
+        users, cursor, more = User.query().fetch_page(batch_size,
+                                                      start_cursor=cursor)
+        keys = [cls.key_for(user.name) for user in users]
+        missing = {}
+        for key, user, user_name in zip(keys, users, ndb.get_multi(keys)):
+            # Names differing only by case keep the first user's index.
+            if not user_name:
+                missing.setdefault(key, cls(key=key, user=user.key))
+        ndb.put_multi(missing.values())
+        if more:
+            return cursor
+        UserNamesIndexed(id='all').put()
+        return None
+
+class UserNamesIndexed(ndb.Model):
+    """Stored once UserName.migrate_batch has visited every user, after
+    which names missing from the index are known not to be taken"""
+
 class Game_History(ndb.Model):
-    # user = ndb.KeyProperty(required=True, kind='User')
+    """The moves of a game, packed as (letter, revealed positions) records.
+    Histories saved before the move log kept the guesses and a copy of the
+    word state after each of them, and are converted when next written."""
+    moves = ndb.BlobProperty(default='')
     guesses = ndb.StringProperty(repeated=True)
     word_states = ndb.StringProperty(repeated=True)
-    # game = ndb.KeyProperty(required=True, kind = 'Game')
-    # game_progress = ndb.StructuredProperty(Game, repeated=True)
-    def to_form(self):
+
+    # Cached along with its game by GameCache instead.
+    _use_memcache = False
+
+    @classmethod
+    def key_for(cls, game_key):
+        """Returns the key of the history of a game"""
+        return ndb.Key(cls, 1, parent=game_key)
+
+    @classmethod
+    def for_game(cls, game_key):
+        """Returns the history of a game. Histories created before they were
+        keyed by their game are found with an ancestor query."""
+        return (cls.key_for(game_key).get() or
+                cls.query(ancestor=game_key).get())
+
+    @property
+    def is_legacy(self):
+        return bool(self.guesses)
+
+    def migrate(self):
+        """Converts a legacy history to the move log"""
+        if self.is_legacy:
+            self.moves = pack_word_states(self.guesses, self.word_states)
+            self.guesses = []
+            self.word_states = []
+
+    @classmethod
+    def migrate_batch(cls, cursor=None, batch_size=100):
+        """Converts a batch of legacy histories and returns the cursor of the
+        next batch, or None once every history has been visited. Each one is
+        converted in its own transaction, concurrently, so that a move
+        appended since the batch was read is kept."""
+        histories, cursor, more = cls.query().fetch_page(
+            batch_size, start_cursor=cursor)
+        futures = [cls._migrate_async(history.key)
+                   for history in histories if history.is_legacy]
+        for future in futures:
+            future.get_result()
+        return cursor if more else None
+
+    @classmethod
+    @ndb.transactional_tasklet
+    def _migrate_async(cls, key):
+        history = yield key.get_async()
+        if history and history.is_legacy:
+            history.migrate()
+            yield history.put_async()
+
+    def add_move(self, guess, hits):
+        """Appends a guess and the positions it revealed to the move log"""
+        self.migrate()
+        self.moves += pack_move(guess, hits)
+
+    def replay(self, target):
+        """Yields the guess and the resulting word state of each move,
+        starting with the blank word before the first guess"""
+        if self.is_legacy:
+            for guess, word_state in zip(self.guesses, self.word_states):
+                yield guess, word_state
+            return
+        yield '', '_' * len(target)
+        for move in replay_moves(target, self.moves):
+            yield move
+
+    def to_form(self, target):
         form = Game_HistoryForm()
-        form.guesses = self.guesses
-        form.word_states = self.word_states
-        moves = ""
-        for i in range(len(self.guesses)):
-            moves = moves + "Guess #" + str(i) + ": " + self.guesses[i]
-            moves = moves + " | Word State:" + self.word_states[i]
-            moves = moves + " , "
-        form.output = moves
+        moves = []
+        for i, (guess, word_state) in enumerate(self.replay(target)):
+            form.guesses.append(guess)
+            form.word_states.append(word_state)
+            moves.append("Guess #{}: {} | Word State:{} , ".format(
+                i, guess, word_state))
+        form.output = "".join(moves)
         return form
 
 class Game_HistoryForm(messages.Message):
@@ -47,37 +252,90 @@ class Game(ndb.Model):
     word_state = ndb.StringProperty(required=True)
     cancel = ndb.BooleanProperty(required=True)
     current_guess = ndb.StringProperty(required=True)
+    guessed_letters = ndb.IntegerProperty(indexed=False)
+    last_activity = ndb.DateTimeProperty(auto_now=True)
+    # The dictionary the target was picked from, None for words.txt.
+    corpus = ndb.StringProperty(indexed=False)
 
-    @classmethod
-    def new_game(cls, user, attempts):
-        """Creates and returns a new game"""
-        
-        with open('words.txt', 'r') as f:
-            words = f.read().splitlines()
+    # Cached along with its history by GameCache instead.
+    _use_memcache = False
 
-        word = words[random.randint(1,len(words))]
-        word.lower()
+    # How long cancelled and unfinished games are kept since their last move.
+    REAP_CANCELLED_AFTER = timedelta(days=7)
+    REAP_IDLE_AFTER = timedelta(days=30)
 
+    @classmethod
+    def new_game(cls, user, attempts, min_length=None, max_length=None,
+                 difficulty=None, corpus=None, game_id=None):
+        """Creates and returns a new game with a word of the named
+        dictionary, words.txt by default. game_id is an id allocated for the
+        game beforehand, e.g. while its user was being looked up."""
+        check_attempts(attempts)
+
+        word = get_corpus(corpus).random_word(min_length=min_length,
+                                        max_length=max_length,
+                                        difficulty=difficulty)
         blanks = "".join('_' for i in word)
 
-        if attempts < 1:
-            raise ValueError('Attempts must be greater than or equal to 1')
-        game = Game(user=user,
-                    target=word.lower(),
+        # Ids cannot be allocated in a transaction.
+        game = Game(id=game_id or cls.allocate_ids(1)[0],
+                    user=user,
+                    target=word,
                     attempts_allowed=attempts,
                     attempts_remaining=attempts,
                     game_over=False,
                     word_state = blanks,
                     cancel = False,
-                    current_guess='')
-        game.put()
-
-        # game_key = ndb.Key(Game,)
-        game_history = Game_History(guesses = [''], word_states = [blanks], parent=game.key)
-        game_history.put()
-        # game_history.game = ndb.Key(Game,game)
+                    current_guess='',
+                    guessed_letters=0,
+                    corpus=corpus or None)
+        game._create_async().get_result()
         return game
 
+    @classmethod
+    def new_games(cls, users, attempts, min_length=None, max_length=None,
+                  difficulty=None, corpus=None):
+        """Creates and returns a new game for each of a list of user keys.
+        The keys are allocated at once and every game and history is written
+        with one put_multi, outside of a transaction. The active games
+        counters are then adjusted by a single task."""
+        check_attempts(attempts)
+        if not users:
+            return []
+
+        words = get_corpus(corpus)
+        first, _ = cls.allocate_ids(len(users))
+        games = []
+        for i, user in enumerate(users):
+            word = words.random_word(min_length=min_length,
+                                     max_length=max_length,
+                                     difficulty=difficulty)
+            games.append(Game(id=first + i,
+                              user=user,
+                              target=word,
+                              attempts_allowed=attempts,
+                              attempts_remaining=attempts,
+                              game_over=False,
+                              word_state='_' * len(word),
+                              cancel=False,
+                              current_guess='',
+                              guessed_letters=0,
+                              corpus=corpus or None))
+        ndb.put_multi(games + [Game_History(key=Game_History.key_for(game.key))
+                               for game in games])
+        GameStats.adjust_later(len(games), len(games) * attempts)
+        return games
+
+    @ndb.transactional_tasklet
+    def _create_async(self):
+        """Puts a new game, whose id is allocated, along with its history
+        and counts it as active. The entities are written with one
+        put_multi while the task is added."""
+        task = GameStats.adjust_later_async(1, self.attempts_remaining)
+        yield ndb.put_multi_async(
+            [self, Game_History(key=Game_History.key_for(self.key))])
+        yield task
+
     def to_form(self, message):
         """Returns a GameForm representation of the Game"""
         form = GameForm()
@@ -91,59 +349,519 @@ class Game(ndb.Model):
         form.current_guess = self.current_guess
         return form
 
-    def end_game(self, won=False):
+    def end_game(self, won=False, rank=None):
         """Ends the game - if won is True, the player won. - if won is False,
-        the player lost."""
+        the player lost. Adds the game's score to the user's rank, creating
+        it if it is None. Returns the Score and the Rank, which the caller
+        puts along with the game before rolling the score up with
+        Score.roll_up_later. The rank is moved between the leaderboard's
+        buckets by a task, added transactionally."""
         self.game_over = True
-        self.put()
         # Add the game to the score 'board'
-        value = (self.attempts_allowed-(self.attempts_allowed-self.attempts_remaining))/float(self.attempts_allowed)
+        guesses, value = score_game(self.attempts_allowed,
+                                    self.attempts_remaining)
         score = Score(user=self.user, date=date.today(), won=won,
-                      guesses=self.attempts_allowed - self.attempts_remaining, score=value)
-        score.put()
+                      guesses=guesses, score=value)
 
         game_score = value
-        rank = Rank.query().filter(Rank.user == self.user).get()
-        logging.info('DEBUG DEBUG DEBUG')
-        logging.info(rank)
+        old_total = rank.total_score if rank else None
         if rank:
             rank.total_score=rank.total_score+game_score
-            rank.put()
         else:
-            rank = Rank(user = self.user, total_score=game_score)
-            rank.put()
-
-
-    def update_game_state(self, loc, guess):
-        state = list(self.word_state)
-        for l in loc:
-            state[l] = guess
-        self.word_state = "".join(state)
-        self.current_guess=guess
-        self.put()
-        return self.word_state
-
-    def complete_game_state(self,guess):
-        state = guess
-        self.word_state = "".join(state)
-        self.current_guess = guess
-        self.put()
-        return self.word_state
-
-    def convert_game_to_form(self):
+            rank = Rank(key=Rank.key_for(self.user), user=self.user,
+                        total_score=game_score)
+        ScoreBucket.move_later(old_total, rank.total_score)
+        return [score, rank]
+
+    @classmethod
+    def new_token_game(cls, user, attempts, min_length=None, max_length=None,
+                       difficulty=None, corpus=None):
+        """Creates a stateless token game. Returns the game and its token."""
+        # pycrypto is only imported by the instances serving token games.
+        from gametoken import TokenGame
+        word = get_corpus(corpus).random_word(min_length=min_length,
+                                        max_length=max_length,
+                                        difficulty=difficulty)
+        game = TokenGame.new(user.id(), word, attempts)
+        return game, TokenSecret.codec().encode(game)
+
+    @classmethod
+    def play_token_move(cls, token, guess):
+        """Plays a guess in a token game. Returns the game, the message and
+        the new token. Nothing is read or written unless the game ends, when
+        its score is recorded. Raises a ValueError if the token or the guess
+        is invalid."""
+        codec = TokenSecret.codec()
+        game = codec.decode(token)
+        msg = game.play(guess)
+        if game.game_over:
+            cls.end_token_game(game)
+        return game, msg, codec.encode(game)
+
+    @classmethod
+    @ndb.transactional(xg=True)
+    def end_token_game(cls, token_game):
+        """Records the Score of a finished token game like end_game does,
+        keyed by the game's id. A game can be ended again by replaying one of
+        its older tokens, so the Score is only inserted if its key does not
+        exist yet. Returns whether the game was scored."""
+        user = ndb.Key(User, token_game.user_id)
+        score_key = ndb.Key(Score, 'token-' + token_game.game_id.encode('hex'))
+        score, rank = ndb.get_multi([score_key, Rank.key_for(user)])
+        if score:
+            return False
+        game = cls(user=user, target=token_game.engine.target,
+                   attempts_allowed=token_game.attempts_allowed,
+                   attempts_remaining=token_game.attempts_remaining)
+        ended = game.end_game(token_game.engine.won, rank)
+        ended[0].key = score_key
+        ndb.put_multi(ended)
+        Score.roll_up_later([score_key])
+        total_score = ended[1].total_score
+        ndb.get_context().call_on_commit(
+            lambda: Rank.invalidate_top(total_score))
+        return True
+
+    @classmethod
+    def play_move(cls, game_key, guess):
+        """Plays a guess and returns the game along with a message, or
+        (None, None) if the game does not exist"""
+        game, moves = cls.play_moves(game_key, [guess])
+        return game, moves[0].message if game else None
+
+    @classmethod
+    @ndb.transactional(xg=True)
+    def play_moves(cls, game_key, guesses):
+        """Plays guesses in order, in a transaction, until the game ends.
+        Returns the game along with the Move of each guess played, or
+        (None, []) if the game does not exist. Raises a ValueError, playing
+        none of them, if any guess is invalid.
+
+        The game and its history are read with one get and everything the
+        moves change, including the Score and Rank when the game ends, is
+        written with one put. The active games counters are adjusted, and the
+        Score rolled up, by tasks once it commits."""
+        game, game_history = ndb.get_multi([game_key,
+                                            Game_History.key_for(game_key)])
+        if not game:
+            return None, []
+        if game.game_over:
+            return game, [game.move(guesses[0], ALREADY_OVER)]
+        elif game.cancel:
+            return game, [game.move(guesses[0], CANCELLED)]
+        if not game_history:
+            game_history = Game_History.query(ancestor=game_key).get()
+
+        attempts_remaining = game.attempts_remaining
+        moves = []
+        for i, guess in enumerate(guesses):
+            try:
+                msg, hits = game.update_game_state(guess)
+            except ValueError as e:
+                if len(guesses) > 1:
+                    raise ValueError('Guess #{} ({}): {}'.format(i + 1, guess, e))
+                raise
+            game_history.add_move(game.current_guess, hits)
+            moves.append(game.move(guess, msg))
+            if game.game_over:
+                break
+
+        entities = [game, game_history]
+        if game.game_over:
+            ended = game.end_game(game.engine.won,
+                                  Rank.key_for(game.user).get())
+            entities += ended
+            GameStats.adjust_later(-1, -attempts_remaining)
+        else:
+            GameStats.adjust_later(
+                0, game.attempts_remaining - attempts_remaining)
+        ndb.put_multi(entities)
+        context = ndb.get_context()
+        if game.game_over:
+            Score.roll_up_later([ended[0].key])
+            total_score = ended[1].total_score
+            context.call_on_commit(lambda: Rank.invalidate_top(total_score))
+
+        context.call_on_commit(lambda: GameCache.update(game, game_history))
+        return game, moves
+
+    def move(self, guess, message):
+        """Returns the Move of a guess in the current state of the game"""
+        return Move(guess, message, self.word_state, self.attempts_remaining)
+
+    @property
+    def engine(self):
+        """The WordEngine holding the target and guessed letters"""
+        engine = getattr(self, '_engine', None)
+        if engine is None or engine.target != self.target:
+            if self.guessed_letters is None:
+                engine = WordEngine.from_word_state(self.target,
+                                                    self.word_state)
+            else:
+                engine = WordEngine(self.target, self.guessed_letters)
+            self._engine = engine
+        return engine
+
+    def hint(self, game_history):
+        """Returns the suggested next letter, None if no word of the corpus
+        matches the game, and the number of words still possible"""
+        # NumPy is only imported by the instances asked for hints.
+        from hint import get_hints
+        guessed = self.engine.guessed
+        if self.guessed_letters is None:
+            # Only the letters found can be recovered from a legacy game.
+            guessed |= letters_mask(''.join(
+                guess for guess, _ in game_history.replay(self.target)
+                if len(guess) == 1))
+        return get_hints(self.corpus).hint(self.word_state, guessed)
+
+    def update_game_state(self, guess):
+        """Plays a guess and returns the message describing its result along
+        with the mask of the positions it revealed. Sets game_over if the
+        guess ended the game, which the caller then ends with end_game.
+        Raises a ValueError if the guess is invalid or was already made."""
+        engine = self.engine
+        msg, hits, self.attempts_remaining = play_turn(
+            engine, guess, self.attempts_remaining)
+        self.guessed_letters = engine.guessed
+        self.word_state = engine.word_state
+        self.current_guess = guess.lower()
+        self.game_over = is_over(engine, self.attempts_remaining)
+        return msg, hits
+
+    @classmethod
+    def active_forms(cls, user_key, user_name):
+        """Returns the GameForms of the active games of a user, read with a
+        projection query on the fields they show. The target and the game
+        history stay on the server, and no entity is fetched."""
+        query = cls.query(cls.user == user_key, cls.cancel == False,
+                          cls.game_over == False,
+                          projection=[cls.attempts_remaining,
+                                      cls.current_guess, cls.word_state])
+        return [GameForm(urlsafe_key=game.key.urlsafe(),
+                         attempts_remaining=game.attempts_remaining,
+                         game_over=False,
+                         message='A game',
+                         user_name=user_name,
+                         word_state=game.word_state,
+                         cancel=False,
+                         current_guess=game.current_guess)
+                for game in query.iter(batch_size=500)]
+
+    def convert_game_to_form(self, user_name=None):
         return GameForm(urlsafe_key=self.key.urlsafe(), 
                         attempts_remaining=self.attempts_remaining,
                         game_over=self.game_over,
                         message='A game',
-                        user_name=self.user.get().name,
+                        user_name=user_name or self.user.get().name,
                         word_state=self.word_state,
                         cancel = self.cancel,
                         current_guess=self.current_guess)
 
-    def cancel_game(self):
-        self.cancel=True
-        self.put()
+    @classmethod
+    @ndb.transactional
+    def cancel_game(cls, game_key):
+        """Cancels a game unless it is over and stops counting it as active.
+        Returns the game, or None if it does not exist."""
+        game, game_history = ndb.get_multi([game_key,
+                                            Game_History.key_for(game_key)])
+        if not game or game.game_over or game.cancel:
+            return game
+        game.cancel=True
+        game.put()
+        GameStats.adjust_later(-1, -game.attempts_remaining)
+        if game_history:
+            ndb.get_context().call_on_commit(
+                lambda: GameCache.update(game, game_history))
+        else:
+            ndb.get_context().call_on_commit(
+                lambda: GameCache.invalidate(game_key))
+        return game
+
+
+    @classmethod
+    def reap_before(cls, cancelled, now=None):
+        """Returns the time before which cancelled, or else unfinished, games
+        were last played to be reaped"""
+        now = now or datetime.utcnow()
+        return now - (cls.REAP_CANCELLED_AFTER if cancelled else
+                      cls.REAP_IDLE_AFTER)
+
+    def is_stale(self, cancelled, before):
+        return (self.cancel == cancelled and not self.game_over and
+                self.last_activity is not None and
+                self.last_activity < before)
+
+    @classmethod
+    def reap_batch(cls, cancelled, before, cursor=None, batch_size=100):
+        """Archives and deletes a batch of the cancelled, or else unfinished,
+        games last played before a time, along with their histories. Returns
+        the cursor of the next batch, or None once every game has been
+        visited. A run must pass the same time to every batch. Each game is
+        reaped in its own transaction, concurrently, which reads it again:
+        the index may be stale, and a game played since is kept."""
+        if cancelled:
+            query = cls.query(cls.cancel == True, cls.last_activity < before)
+        else:
+            query = cls.query(cls.cancel == False, cls.game_over == False,
+                              cls.last_activity < before)
+        keys, cursor, more = query.fetch_page(batch_size, keys_only=True,
+                                              start_cursor=cursor)
+        futures = [cls._reap_async(key, cancelled, before) for key in keys]
+        GameCache.invalidate_multi([key for key, future in zip(keys, futures)
+                                    if future.get_result()])
+        return cursor if more else None
+
+    @classmethod
+    @ndb.transactional_tasklet(xg=True)
+    def _reap_async(cls, key, cancelled, before):
+        """Archives and deletes a game along with its history if it is still
+        stale, and stops counting it as active. Returns whether it did."""
+        game, game_history = yield ndb.get_multi_async(
+            [key, Game_History.key_for(key)])
+        if not game or not game.is_stale(cancelled, before):
+            raise ndb.Return(False)
+        if not game_history:
+            game_history = yield Game_History.query(ancestor=key).get_async()
+        yield ArchivedGame.archive(game, game_history).put_async()
+        yield ndb.delete_multi_async(
+            [key] + ([game_history.key] if game_history else []))
+        if not cancelled:
+            GameStats.adjust_later(-1, -game.attempts_remaining)
+        raise ndb.Return(True)
+
+    @classmethod
+    def migrate_batch(cls, cursor=None, batch_size=100):
+        """Stamps the last activity of a batch of the games created before it
+        was recorded and returns the cursor of the next batch, or None once
+        every game has been visited. Each one is stamped in its own
+        transaction, concurrently, so that a move made since the batch was
+        read is kept."""
+        games, cursor, more = cls.query().fetch_page(batch_size,
+                                                     start_cursor=cursor)
+        futures = [cls._stamp_async(game.key)
+                   for game in games if game.last_activity is None]
+        for future in futures:
+            future.get_result()
+        return cursor if more else None
+
+    @classmethod
+    @ndb.transactional_tasklet
+    def _stamp_async(cls, key):
+        game = yield key.get_async()
+        if game and game.last_activity is None:
+            # last_activity is set to now when it is put.
+            yield game.put_async()
+
+
+class ArchivedGame(ndb.Model):
+    """The final state of a reaped game, keyed by the id of the game. The
+    word state after each move can be replayed from the move log."""
+    user = ndb.KeyProperty(required=True, kind='User')
+    target = ndb.StringProperty(required=True, indexed=False)
+    attempts_allowed = ndb.IntegerProperty(required=True, indexed=False)
+    attempts_remaining = ndb.IntegerProperty(required=True, indexed=False)
+    cancel = ndb.BooleanProperty(required=True, indexed=False)
+    moves = ndb.BlobProperty(default='')
+    last_activity = ndb.DateTimeProperty(indexed=False)
+
+    @classmethod
+    def archive(cls, game, game_history):
+        """Returns the archive of a game along with its history, if any"""
+        moves = ''
+        if game_history:
+            game_history.migrate()
+            moves = game_history.moves
+        return cls(id=game.key.id(), user=game.user, target=game.target,
+                   attempts_allowed=game.attempts_allowed,
+                   attempts_remaining=game.attempts_remaining,
+                   cancel=game.cancel, moves=moves,
+                   last_activity=game.last_activity)
+
+
+class TokenSecret(ndb.Model):
+    """The secret encrypting and signing the tokens of token games, created
+    on first use"""
+    secret = ndb.BlobProperty(required=True)
+
+    _codec = None
+    _codec_lock = threading.Lock()
+
+    @classmethod
+    def codec(cls):
+        """Returns the instance wide TokenCodec, reading the secret once"""
+        if cls._codec is None:
+            from gametoken import TokenCodec
+            with cls._codec_lock:
+                if cls._codec is None:
+                    secret = cls.get_or_insert('secret',
+                                               secret=os.urandom(32)).secret
+                    TokenSecret._codec = TokenCodec(secret)
+        return cls._codec
+
+
+class Move(collections.namedtuple(
+        'Move', 'guess message word_state attempts_remaining')):
+    """The result of one guess of a game"""
+
+    def to_form(self):
+        return MoveForm(guess=self.guess, message=self.message,
+                        word_state=self.word_state,
+                        attempts_remaining=self.attempts_remaining)
+
+
+class GameCache(object):
+    """Read-through memcache of a Game along with its Game_History, keyed
+    by the game's urlsafe key. The Datastore stays authoritative: moves,
+    including those ending a game, and cancellations are made in
+    transactions and only then written through to the cache, with
+    compare-and-set so that concurrent writers cannot leave an older state
+    behind."""
+    PREFIX = 'GAME:'
+    TTL = 600
+    # Compare-and-set attempts before giving up on writing a state through.
+    CAS_ATTEMPTS = 5
+
+    _stats = collections.Counter()
+    _stats_lock = threading.Lock()
+
+    @classmethod
+    def _count(cls, name):
+        with cls._stats_lock:
+            cls._stats[name] += 1
+
+    @classmethod
+    def stats(cls):
+        """Returns this instance's cache hits and misses"""
+        with cls._stats_lock:
+            return {'hits': cls._stats['hits'], 'misses': cls._stats['misses']}
+
+    @classmethod
+    def _memcache_key(cls, game_key):
+        return cls.PREFIX + game_key.urlsafe()
+
+    @classmethod
+    def get(cls, game_key):
+        """Returns the game and its history, (None, None) if the game does
+        not exist"""
+        key = cls._memcache_key(game_key)
+        cached = memcache.get(key)
+        if cached is not None:
+            cls._count('hits')
+            return cached
+        cls._count('misses')
 
+        game, game_history = ndb.get_multi([game_key,
+                                            Game_History.key_for(game_key)])
+        if not game:
+            return None, None
+        if not game_history:
+            game_history = Game_History.for_game(game_key)
+        # add rather than set: a move may have cached a newer state already.
+        memcache.add(key, (game, game_history), time=cls.TTL)
+        return game, game_history
+
+    @staticmethod
+    def _version(game, game_history):
+        """Orders the states of a game: moves only add to its history, and
+        ending or cancelling it is final"""
+        return game.game_over or game.cancel, len(game_history.moves)
+
+    @classmethod
+    def update(cls, game, game_history):
+        """Caches the state of a game after a committed move or cancellation,
+        unless a newer one is cached already. Ended and cancelled games are
+        written rather than evicted, since a reader that read the game
+        before it ended could otherwise add the state it read back."""
+        client = memcache.Client()
+        key = cls._memcache_key(game.key)
+        version = cls._version(game, game_history)
+        for _ in range(cls.CAS_ATTEMPTS):
+            cached = client.gets(key)
+            if cached is None:
+                if client.add(key, (game, game_history), time=cls.TTL):
+                    return
+            elif cls._version(*cached) >= version:
+                return
+            elif client.cas(key, (game, game_history), time=cls.TTL):
+                return
+        if version[0]:
+            # Nothing is newer than a final state.
+            client.set(key, (game, game_history), time=cls.TTL)
+        else:
+            client.delete(key)
+
+    @classmethod
+    def invalidate(cls, game_key):
+        memcache.delete(cls._memcache_key(game_key))
+
+    @classmethod
+    def invalidate_multi(cls, game_keys):
+        memcache.delete_multi([cls._memcache_key(key) for key in game_keys])
+
+
+class GameStats(ndb.Model):
+    """One shard of the counters of the active games, those that are neither
+    over nor cancelled. Spreading the counters over several entities keeps
+    concurrent adjustments from contending on a single entity group. Games
+    adjust them through tasks rather than in their own transactions, which
+    would otherwise all contend on the shards."""
+    SHARDS = 20
+    active_games = ndb.IntegerProperty(default=0, indexed=False)
+    attempts_remaining = ndb.IntegerProperty(default=0, indexed=False)
+
+    @classmethod
+    def random_key(cls):
+        return ndb.Key(cls, random.randint(1, cls.SHARDS))
+
+    @classmethod
+    @ndb.transactional
+    def adjust(cls, games, attempts):
+        """Adds to a random shard on its own"""
+        key = cls.random_key()
+        stats = key.get() or cls(key=key)
+        stats.active_games += games
+        stats.attempts_remaining += attempts
+        stats.put()
+
+    @classmethod
+    def adjust_later(cls, games, attempts):
+        """Enqueues a task adjusting the counters. In a transaction, the task
+        is added transactionally, so that it only runs if that commits."""
+        if games or attempts:
+            cls.adjust_later_async(games, attempts).get_result()
+
+    @classmethod
+    def adjust_later_async(cls, games, attempts):
+        """Enqueues the task of adjust_later and returns its RPC"""
+        task = taskqueue.Task(url='/tasks/adjust_game_stats',
+                              params={'games': games, 'attempts': attempts})
+        return task.add_async(transactional=ndb.in_transaction())
+
+    @classmethod
+    def totals(cls):
+        """Returns the number of active games and their attempts remaining"""
+        shards = ndb.get_multi([ndb.Key(cls, i)
+                                for i in range(1, cls.SHARDS + 1)])
+        return (sum(s.active_games for s in shards if s),
+                sum(s.attempts_remaining for s in shards if s))
+
+    @classmethod
+    def reconcile(cls):
+        """Recounts the active games from scratch to correct any drift. The
+        counters are read before the scan and then adjusted by the drift
+        found rather than overwritten, so that the adjustments committed
+        while the scan runs are kept."""
+        counted_games, counted_attempts = cls.totals()
+        games = 0
+        attempts = 0
+        query = Game.query(Game.game_over == False, Game.cancel == False,
+                           projection=[Game.attempts_remaining])
+        for game in query.iter(batch_size=1000):
+            games += 1
+            attempts += game.attempts_remaining
+        if games != counted_games or attempts != counted_attempts:
+            cls.adjust(games - counted_games, attempts - counted_attempts)
 
 
 class Score(ndb.Model):
@@ -153,29 +871,382 @@ class Score(ndb.Model):
     won = ndb.BooleanProperty(required=True)
     guesses = ndb.IntegerProperty(required=True)
     score = ndb.FloatProperty(required=True)
+    # Whether the score has been added to its UserStats and DailyStats,
+    # which tasks do after its game ends.
+    rolled_up = ndb.BooleanProperty(default=False, indexed=False)
 
-    def to_form(self):
-        return ScoreForm(user_name=self.user.get().name, won=self.won,
+    # Read through queries, and written with its game, which ndb would
+    # otherwise put in a separate batch.
+    _use_memcache = False
+
+    # Cross-group transactions are limited to 25 entity groups.
+    ROLL_UP_GROUPS = 25
+
+    def to_form(self, user_name=None):
+        return ScoreForm(user_name=user_name or self.user.get().name, won=self.won,
                          date=str(self.date), guesses=self.guesses, score=self.score)
 
+    @classmethod
+    @ndb.tasklet
+    def to_forms_async(cls, scores):
+        """Returns the ScoreForms of scores, resolving all user names at once"""
+        scores = list(scores)
+        names = yield User.names_async(score.user for score in scores)
+        raise ndb.Return(ScoreForms(items=[score.to_form(names[score.user])
+                                           for score in scores]))
+
+    @classmethod
+    @ndb.tasklet
+    def page_async(cls, query, page_size, cursor=None, user_name=None):
+        """Returns the ScoreForms of a page of a Score query, along with the
+        cursor of the next page if there is one. user_name is the name of
+        the user of every score when the query is for a single user."""
+        scores, next_cursor, more = yield query.fetch_page_async(
+            page_size, start_cursor=cursor)
+        if user_name:
+            forms = ScoreForms(items=[score.to_form(user_name)
+                                      for score in scores])
+        else:
+            forms = yield cls.to_forms_async(scores)
+        if more and next_cursor:
+            forms.next_cursor = next_cursor.urlsafe()
+        raise ndb.Return(forms)
+
+    @classmethod
+    @ndb.transactional(xg=True)
+    def roll_up(cls, score_keys):
+        """Adds the Scores not rolled up yet to their UserStats and
+        DailyStats, and marks them. The scores and the rollups they touch
+        must span at most ROLL_UP_GROUPS entity groups."""
+        scores = [score for score in ndb.get_multi(score_keys)
+                  if score and not score.rolled_up]
+        keys = list(set([UserStats.key_for(score.user) for score in scores] +
+                        [DailyStats.key_for(score.date, score.user)
+                         for score in scores]))
+        totals = {}
+        for key, entity in zip(keys, ndb.get_multi(keys)):
+            model = UserStats if key.kind() == UserStats._get_kind() \
+                else DailyStats
+            totals[key] = entity or model(key=key)
+        for score in scores:
+            totals[UserStats.key_for(score.user)].add(score)
+            totals[DailyStats.key_for(score.date, score.user)].add(score)
+            score.rolled_up = True
+        ndb.put_multi(scores + totals.values())
+
+    @classmethod
+    def roll_up_later(cls, score_keys):
+        """Enqueues a task rolling up Scores. In a transaction, the task is
+        added transactionally."""
+        taskqueue.add(url='/tasks/roll_up_scores',
+                      params={'scores': json.dumps([key.urlsafe()
+                                                    for key in score_keys])},
+                      transactional=ndb.in_transaction())
+
+    @classmethod
+    def roll_up_batch(cls, score_keys):
+        """Rolls up a batch of Scores in as few transactions as the entity
+        group limit allows. Scores ordered by user and date share their
+        rollups, which lets more of them into each transaction."""
+        chunk, rollups = [], set()
+        for score in ndb.get_multi(score_keys):
+            if not score or score.rolled_up:
+                continue
+            keys = set([UserStats.key_for(score.user),
+                        DailyStats.key_for(score.date, score.user)])
+            if len(chunk) + len(rollups | keys) + 1 > cls.ROLL_UP_GROUPS:
+                cls.roll_up(chunk)
+                chunk, rollups = [], set()
+            chunk.append(score.key)
+            rollups |= keys
+        if chunk:
+            cls.roll_up(chunk)
+
+    @classmethod
+    def batches(cls, batch_size, cursor=None):
+        """Yields every Score in lists of at most batch_size, each along with
+        the cursor following it, without holding more than one batch"""
+        more = True
+        while more:
+            scores, cursor, more = cls.query().fetch_page(batch_size,
+                                                          start_cursor=cursor)
+            if scores:
+                yield scores, cursor
+
+LEADERBOARD_SIZE = 100
+MEMCACHE_LEADERBOARD = 'LEADERBOARD'
+# Seconds the cached leaderboard may lag behind scores that do not enter it.
+LEADERBOARD_TTL = 60
+
+class ScoreBucket(ndb.Model):
+    """Number of Ranks whose total_score is in a range. The ranges widen
+    geometrically, bucket id ending at SCALE * (RATIO ** id - 1): most users
+    have low totals, which are spread over narrow buckets, while the few
+    high totals share wide ones. Both the buckets above a score and the
+    ranks ahead of it in its own bucket are then few to count. Ranks are
+    moved between buckets by tasks, outside of the transactions of the
+    games, which would otherwise all contend on the first buckets."""
+    SCALE = 1.0
+    RATIO = 1.1
+    # The upper bounds of the buckets; scores above the last share one more.
+    BOUNDS = [SCALE * (RATIO ** i - 1) for i in range(1, 401)]
+    count = ndb.IntegerProperty(default=0, indexed=False)
+
+    @classmethod
+    def id_for(cls, total_score):
+        return bisect.bisect_right(cls.BOUNDS, total_score) + 1
+
+    @classmethod
+    def key_for(cls, total_score):
+        return ndb.Key(cls, cls.id_for(total_score))
+
+    @classmethod
+    def upper_bound(cls, bucket_id):
+        """Returns the total_score ending a bucket, None for the last one"""
+        if bucket_id > len(cls.BOUNDS):
+            return None
+        return cls.BOUNDS[bucket_id - 1]
+
+    @classmethod
+    def move_later(cls, old_total, new_total):
+        """Enqueues a task moving a rank from the bucket of old_total (None
+        for a new rank) to the bucket of new_total, if they differ. In a
+        transaction, the task is added transactionally."""
+        new = cls.id_for(new_total)
+        old = None if old_total is None else cls.id_for(old_total)
+        if old != new:
+            taskqueue.add(url='/tasks/move_score_bucket',
+                          params={'old': old or '', 'new': new},
+                          transactional=ndb.in_transaction())
+
+    @classmethod
+    @ndb.transactional(xg=True)
+    def move(cls, old, new):
+        """Moves a rank from bucket old (None for a new rank) to bucket new"""
+        keys = [ndb.Key(cls, new)]
+        if old is not None:
+            keys.append(ndb.Key(cls, old))
+        buckets = [bucket or cls(key=key)
+                   for key, bucket in zip(keys, ndb.get_multi(keys))]
+        buckets[0].count += 1
+        if len(buckets) > 1:
+            buckets[1].count -= 1
+        ndb.put_multi(buckets)
+
+    @classmethod
+    def rebuild(cls):
+        """Recounts every bucket from the Rank entities. Moves made while it
+        runs may be lost, so run it again if games ended meanwhile."""
+        counts = collections.Counter()
+        for rank in Rank.query(projection=[Rank.total_score]).iter(
+                batch_size=1000):
+            counts[cls.id_for(rank.total_score)] += 1
+        ndb.delete_multi([key for key in cls.query().iter(keys_only=True)
+                          if key.id() not in counts])
+        ndb.put_multi([cls(id=bucket_id, count=count)
+                       for bucket_id, count in counts.items()])
+
 class Rank(ndb.Model):
     user = ndb.KeyProperty(required=True, kind='User')
     total_score = ndb.FloatProperty(required=True)
-    rank = ndb.IntegerProperty(default = 0)
+
+    # Written with the game that ends, which ndb would otherwise put in a
+    # separate batch. The best ranks are cached by top instead.
+    _use_memcache = False
 
     @classmethod
-    def make_rankings(cls):
-        ranks = Rank.query().order(-Rank.total_score)
-        val = 1
-        for rank in ranks:
-            rank.rank = val
-            val = val + 1
-            rank.put()
+    def key_for(cls, user_key):
+        """Returns the key of a user's rank"""
+        return ndb.Key(cls, user_key.id())
 
-    def to_form(self):
-        return RankForm(user_name=self.user.get().name, total_score=self.total_score,
-                        rank = self.rank)
+    @classmethod
+    def migrate(cls):
+        """Rekeys the ranks created before they were keyed by their user,
+        merging them into the keyed rank if one already exists"""
+        for legacy in cls.query(projection=[cls.user]):
+            if legacy.key == cls.key_for(legacy.user):
+                continue
+            cls._migrate_rank(legacy.key)
 
+    @classmethod
+    @ndb.transactional(xg=True)
+    def _migrate_rank(cls, legacy_key):
+        legacy = legacy_key.get()
+        if not legacy:
+            return
+        rank = cls.key_for(legacy.user).get()
+        if rank:
+            rank.total_score += legacy.total_score
+        else:
+            rank = cls(key=cls.key_for(legacy.user), user=legacy.user,
+                       total_score=legacy.total_score)
+        rank.put()
+        legacy.key.delete()
+
+    @classmethod
+    def top(cls, number_of_results=LEADERBOARD_SIZE):
+        """Returns the best number_of_results ranks ordered by total_score
+        descending. The first LEADERBOARD_SIZE ranks are served from
+        memcache."""
+        if number_of_results < 0:
+            raise ValueError('number_of_results must not be negative')
+        if number_of_results > LEADERBOARD_SIZE:
+            return cls.query().order(-cls.total_score).fetch(
+                number_of_results)
+        ranks = memcache.get(MEMCACHE_LEADERBOARD)
+        if ranks is None:
+            ranks = cls.query().order(-cls.total_score).fetch(LEADERBOARD_SIZE)
+            memcache.set(MEMCACHE_LEADERBOARD, ranks, time=LEADERBOARD_TTL)
+        return ranks[:number_of_results]
+
+    @classmethod
+    def invalidate_top(cls, total_score):
+        """Drops the cached leaderboard if a rank with this total_score
+        belongs in it. Call it once the rank is committed: a leaderboard
+        read before then would otherwise be cached again without it."""
+        ranks = memcache.get(MEMCACHE_LEADERBOARD)
+        if ranks is not None and (len(ranks) < LEADERBOARD_SIZE or
+                                  total_score >= ranks[-1].total_score):
+            memcache.delete(MEMCACHE_LEADERBOARD)
+
+    @ndb.tasklet
+    def position_async(self):
+        """Returns the 1-based position of this rank. Counts the users in
+        the buckets above this one and, concurrently, the users ahead in this
+        bucket. Positions lag behind the games whose bucket tasks have not
+        run yet."""
+        bucket_key = ScoreBucket.key_for(self.total_score)
+        ahead = Rank.query(Rank.total_score > self.total_score)
+        upper = ScoreBucket.upper_bound(bucket_key.id())
+        if upper is not None:
+            ahead = ahead.filter(Rank.total_score < upper)
+        buckets, ahead = yield (
+            ScoreBucket.query(ScoreBucket.key > bucket_key).fetch_async(),
+            ahead.count_async())
+        raise ndb.Return(sum(bucket.count for bucket in buckets) + ahead + 1)
+
+    def to_form(self, rank, user_name=None):
+        return RankForm(user_name=user_name or self.user.get().name,
+                        total_score=self.total_score, rank = rank)
+
+    @classmethod
+    @ndb.tasklet
+    def to_forms_async(cls, ranks):
+        """Returns the RankForms of ranks ordered from the first, resolving
+        all user names at once"""
+        names = yield User.names_async(rank.user for rank in ranks)
+        raise ndb.Return(RankForms(items=[rank.to_form(i + 1, names[rank.user])
+                                          for i, rank in enumerate(ranks)]))
+
+
+class ScoreTotals(ndb.Model):
+    """Totals of a set of Scores, kept up to date as games end so that
+    statistics are read from one entity instead of scanning Scores"""
+    games = ndb.IntegerProperty(default=0, indexed=False)
+    wins = ndb.IntegerProperty(default=0, indexed=False)
+    guesses = ndb.IntegerProperty(default=0, indexed=False)
+    total_score = ndb.FloatProperty(default=0.0, indexed=False)
+    best_score = ndb.FloatProperty(indexed=False)
+
+    def add(self, score):
+        self.games += 1
+        self.wins += 1 if score.won else 0
+        self.guesses += score.guesses
+        self.total_score += score.score
+        self.best_score = max(self.best_score, score.score)
+
+    def merge(self, totals):
+        """Adds the totals of another set of Scores"""
+        self.games += totals.games
+        self.wins += totals.wins
+        self.guesses += totals.guesses
+        self.total_score += totals.total_score
+        self.best_score = max(self.best_score, totals.best_score)
+
+    def to_form(self, form):
+        form.games = self.games
+        form.wins = self.wins
+        form.guesses = self.guesses
+        form.total_score = self.total_score
+        form.best_score = self.best_score
+        if self.games:
+            form.average_score = self.total_score / self.games
+        return form
+
+
+class UserStats(ScoreTotals):
+    """The totals of the Scores of a user, keyed by the user's id"""
+
+    @classmethod
+    def key_for(cls, user_key):
+        return ndb.Key(cls, user_key.id())
+
+
+class DailyLeader(ndb.Model):
+    user = ndb.KeyProperty(required=True, kind='User')
+    score = ndb.FloatProperty(required=True)
+
+
+class DailyStats(ScoreTotals):
+    """The totals of the Scores of a day along with the best score of each of
+    the DAILY_LEADERS best users of the day. A day is split in SHARDS by
+    user, keyed by its ISO date and shard, so that concurrent roll-ups
+    rarely write the same entity; for_day_async merges them."""
+    DAILY_LEADERS = 10
+    SHARDS = 20
+    leaders = ndb.LocalStructuredProperty(DailyLeader, repeated=True)
+
+    @classmethod
+    def key_for(cls, day, user_key):
+        shard = zlib.crc32(str(user_key.id())) % cls.SHARDS
+        return ndb.Key(cls, '{}/{}'.format(day.isoformat(), shard))
+
+    @classmethod
+    @ndb.tasklet
+    def for_day_async(cls, day):
+        """Returns the statistics of a day, merged from its shards and from
+        the unsharded entity, keyed by the ISO date alone, of earlier
+        versions"""
+        keys = [ndb.Key(cls, day.isoformat())] + [
+            ndb.Key(cls, '{}/{}'.format(day.isoformat(), shard))
+            for shard in range(cls.SHARDS)]
+        stats = cls()
+        for shard in (yield ndb.get_multi_async(keys)):
+            if shard:
+                stats.merge(shard)
+        raise ndb.Return(stats)
+
+    def add(self, score):
+        super(DailyStats, self).add(score)
+        self.add_leader(score.user, score.score)
+
+    def merge(self, totals):
+        super(DailyStats, self).merge(totals)
+        for leader in totals.leaders:
+            self.add_leader(leader.user, leader.score)
+
+    def add_leader(self, user, score):
+        """Keeps the best score of a user if it is among the best ones"""
+        for leader in self.leaders:
+            if leader.user == user:
+                if leader.score >= score:
+                    return
+                self.leaders.remove(leader)
+                break
+        self.leaders.append(DailyLeader(user=user, score=score))
+        # Stable, so that users tied with a score keep the order they got it.
+        self.leaders.sort(key=lambda leader: -leader.score)
+        del self.leaders[self.DAILY_LEADERS:]
+
+    @ndb.tasklet
+    def to_form_async(self, day):
+        """Returns the DailyStatsForm, resolving the leaders' names at once"""
+        names = yield User.names_async(leader.user for leader in self.leaders)
+        form = self.to_form(DailyStatsForm(date=day.isoformat()))
+        form.leaders = [DailyLeaderForm(user_name=names[leader.user],
+                                        score=leader.score)
+                        for leader in self.leaders]
+        raise ndb.Return(form)
 
 
 class GameForm(messages.Message):
@@ -193,10 +1264,23 @@ class GameForms(messages.Message):
     "Return multiple GameForms"
     items = messages.MessageField(GameForm,1,repeated=True)
 
+class NewGamesBulkForm(messages.Message):
+    """Used to create a game for each of several users at once"""
+    user_names = messages.StringField(1, repeated=True)
+    min_length = messages.IntegerField(2)
+    max_length = messages.IntegerField(3)
+    attempts = messages.IntegerField(4, default=5)
+    difficulty = messages.StringField(5)
+    corpus = messages.StringField(6)
+
 class NewGameForm(messages.Message):
     """Used to create a new game"""
     user_name = messages.StringField(1, required=True)
+    min_length = messages.IntegerField(2)
+    max_length = messages.IntegerField(3)
     attempts = messages.IntegerField(4, default=5)
+    difficulty = messages.StringField(5)
+    corpus = messages.StringField(6)
 
 class RankingForm(messages.Message):
     number_of_results = messages.IntegerField(1, default=-1)
@@ -213,6 +1297,41 @@ class MakeMoveForm(messages.Message):
     """Used to make a move in an existing game"""
     guess = messages.StringField(1, required=True)
 
+class MakeMovesForm(messages.Message):
+    """Used to make several moves in an existing game at once"""
+    guesses = messages.StringField(1, repeated=True)
+
+class MoveForm(messages.Message):
+    """The result of one of the guesses of make_moves"""
+    guess = messages.StringField(1, required=True)
+    message = messages.StringField(2, required=True)
+    word_state = messages.StringField(3, required=True)
+    attempts_remaining = messages.IntegerField(4, required=True)
+
+class HintForm(messages.Message):
+    """The letter suggested by get_hint"""
+    letter = messages.StringField(1)
+    candidates = messages.IntegerField(2, required=True)
+
+class TokenGameForm(messages.Message):
+    """The state of a token game along with the token of its next move"""
+    token = messages.StringField(1, required=True)
+    attempts_remaining = messages.IntegerField(2, required=True)
+    game_over = messages.BooleanField(3, required=True)
+    message = messages.StringField(4, required=True)
+    word_state = messages.StringField(5, required=True)
+    current_guess = messages.StringField(6, required=True)
+
+class TokenMoveForm(messages.Message):
+    """Used to make a move in a token game"""
+    token = messages.StringField(1, required=True)
+    guess = messages.StringField(2, required=True)
+
+class MoveForms(messages.Message):
+    """The game state after make_moves and the result of each guess played"""
+    game = messages.MessageField(GameForm, 1, required=True)
+    moves = messages.MessageField(MoveForm, 2, repeated=True)
+
 
 class ScoreForm(messages.Message):
     """ScoreForm for outbound Score information"""
@@ -225,6 +1344,32 @@ class ScoreForm(messages.Message):
 class ScoreForms(messages.Message):
     """Return multiple ScoreForms"""
     items = messages.MessageField(ScoreForm, 1, repeated=True)
+    next_cursor = messages.StringField(2)
+
+class UserStatsForm(messages.Message):
+    """The statistics of a user's finished games"""
+    user_name = messages.StringField(1, required=True)
+    games = messages.IntegerField(2, required=True)
+    wins = messages.IntegerField(3, required=True)
+    guesses = messages.IntegerField(4, required=True)
+    total_score = messages.FloatField(5, required=True)
+    best_score = messages.FloatField(6)
+    average_score = messages.FloatField(7)
+
+class DailyLeaderForm(messages.Message):
+    user_name = messages.StringField(1, required=True)
+    score = messages.FloatField(2, required=True)
+
+class DailyStatsForm(messages.Message):
+    """The statistics of the games finished on a day and its best users"""
+    date = messages.StringField(1, required=True)
+    games = messages.IntegerField(2, required=True)
+    wins = messages.IntegerField(3, required=True)
+    guesses = messages.IntegerField(4, required=True)
+    total_score = messages.FloatField(5, required=True)
+    best_score = messages.FloatField(6)
+    average_score = messages.FloatField(7)
+    leaders = messages.MessageField(DailyLeaderForm, 8, repeated=True)
 
 
 class StringMessage(messages.Message):
@@ -0,0 +1,63 @@
+"""ndb_storage.py - The Repository of the Datastore models, for running the
+same code against App Engine as against the backends of storage.py. Games
+are identified by their urlsafe keys and users by their keys."""
+
+from google.appengine.ext import ndb
+
+from models import User, Game, Game_History, Score, Rank
+from storage import GameState, NotFoundError, Repository, ScoreState
+from utils import get_key_by_urlsafe
+
+
+class NdbRepository(Repository):
+    """Delegates to the Datastore models. The GameState returned by
+    make_move leaves out the move log, which get_game reads."""
+
+    @staticmethod
+    def _state(game, game_history=None):
+        return GameState(game.key.urlsafe(), game.user, game.target,
+                         game.attempts_allowed, game.attempts_remaining,
+                         game.game_over, game.cancel, game.engine.guessed,
+                         game.current_guess,
+                         game_history.moves if game_history else '')
+
+    @staticmethod
+    def _user(user_name):
+        user = User.get_by_name(user_name)
+        if not user:
+            raise NotFoundError('A User with that name does not exist!')
+        return user
+
+    def create_user(self, name, email=None):
+        return User.create(name, email) is not None
+
+    def new_game(self, user_name, attempts=5, min_length=None,
+                 max_length=None, difficulty=None):
+        return self._state(Game.new_game(self._user(user_name).key, attempts,
+                                         min_length=min_length,
+                                         max_length=max_length,
+                                         difficulty=difficulty))
+
+    def get_game(self, game_id):
+        game_key = get_key_by_urlsafe(game_id, Game)
+        game, game_history = ndb.get_multi([game_key,
+                                            Game_History.key_for(game_key)])
+        return self._state(game, game_history) if game else None
+
+    def make_move(self, game_id, guess):
+        game, msg = Game.play_move(get_key_by_urlsafe(game_id, Game), guess)
+        return (self._state(game), msg) if game else (None, None)
+
+    def user_scores(self, user_name):
+        user = self._user(user_name)
+        scores = Score.query(Score.user == user.key).order(-Score.date)
+        return [ScoreState(score.user, score.date, score.won, score.guesses,
+                           score.score) for score in scores]
+
+    def top_ranks(self, number_of_results):
+        if number_of_results < 0:
+            ranks = Rank.query().order(-Rank.total_score).fetch()
+        else:
+            ranks = Rank.top(number_of_results)
+        names = User.names_async(rank.user for rank in ranks).get_result()
+        return [(names[rank.user], rank.total_score) for rank in ranks]
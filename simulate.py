@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+
+"""simulate.py - Self-play harness for load testing and regression
+benchmarking the game logic without deploying. Games are created and played
+with the same corpus and engine as Game.new_game and make_move, by pluggable
+guessing strategies, across a process pool. With --backend they are played
+through an in-memory or SQLite Repository of storage.py instead, storing
+every move.
+
+Usage: python simulate.py [--games N] [--strategy frequency|entropy]
+                          [--backend engine|memory|sqlite] ..."""
+
+import argparse
+import math
+import multiprocessing
+import random
+import string
+import time
+
+import corpus
+import engine
+import storage
+
+
+class FrequencyStrategy(object):
+    """Guesses letters from the most to the least common in English"""
+
+    def __init__(self, words, length):
+        self.order = corpus.LETTER_FREQUENCY
+
+    def guess(self, game):
+        for letter in self.order:
+            if not game.has_guessed(letter):
+                return letter
+
+    def observe(self, letter, hits):
+        pass
+
+
+class EntropyStrategy(FrequencyStrategy):
+    """Keeps the dictionary words consistent with the moves so far and
+    guesses the letter whose outcome splits them into the most evenly sized
+    groups, i.e. with the highest entropy. Guesses the word once a single
+    candidate remains."""
+
+    # Translation tables mapping one letter to '1' and every other to '0', so
+    # that word.translate(PATTERNS[letter]) is where the letter occurs.
+    PATTERNS = dict((letter, string.maketrans(
+        string.ascii_lowercase, ''.join('1' if l == letter else '0'
+                                        for l in string.ascii_lowercase)))
+        for letter in string.ascii_lowercase)
+    # Per process, the words and best first guess of each length.
+    _words = {}
+    _first_guesses = {}
+
+    def __init__(self, words, length):
+        super(EntropyStrategy, self).__init__(words, length)
+        self.length = length
+        self.candidates = None
+        if length not in self._words:
+            self._words[length] = list(words.words(length, length))
+
+    def _candidates(self):
+        if self.candidates is None:
+            self.candidates = self._words[self.length]
+        return self.candidates
+
+    def guess(self, game):
+        first = self.candidates is None
+        if first and self.length in self._first_guesses:
+            return self._first_guesses[self.length]
+        candidates = self._candidates()
+        if len(candidates) == 1:
+            return candidates[0]
+        if not candidates:
+            return super(EntropyStrategy, self).guess(game)
+
+        best, best_entropy = None, -1.0
+        for letter in string.ascii_lowercase:
+            if game.has_guessed(letter):
+                continue
+            table = self.PATTERNS[letter]
+            groups = {}
+            for word in candidates:
+                pattern = word.translate(table)
+                groups[pattern] = groups.get(pattern, 0) + 1
+            entropy = -sum(n * math.log(float(n) / len(candidates))
+                           for n in groups.values())
+            if entropy > best_entropy:
+                best, best_entropy = letter, entropy
+        if first:
+            self._first_guesses[self.length] = best
+        return best
+
+    def observe(self, letter, hits):
+        if len(letter) > 1:
+            return
+        expected = ''.join('1' if hits >> i & 1 else '0'
+                           for i in range(self.length))
+        table = self.PATTERNS[letter]
+        self.candidates = [word for word in self._candidates()
+                           if word.translate(table) == expected]
+
+
+STRATEGIES = {
+    'frequency': FrequencyStrategy,
+    'entropy': EntropyStrategy,
+}
+
+
+def play(words, strategy_class, attempts, constraints):
+    """Plays one game the way Game.new_game and make_move do. Returns whether
+    it was won, the number of moves and the latency of each step."""
+    start = time.time()
+    target = words.random_word(**constraints)
+    game = engine.WordEngine(target)
+    history = []
+    new_game_latency = time.time() - start
+
+    strategy = strategy_class(words, len(target))
+    move_latencies = []
+    while not engine.is_over(game, attempts):
+        guess = strategy.guess(game)
+        start = time.time()
+        _, hits, attempts = engine.play_turn(game, guess, attempts)
+        history.append(engine.pack_move(guess, hits))
+        game.word_state
+        move_latencies.append(time.time() - start)
+        strategy.observe(guess, hits)
+    return game.won, new_game_latency, move_latencies
+
+
+def play_stored(repository, user_name, words, strategy_class, attempts,
+                constraints):
+    """Plays one game through a Repository, like play"""
+    start = time.time()
+    game = repository.new_game(user_name, attempts, **constraints)
+    new_game_latency = time.time() - start
+
+    strategy = strategy_class(words, len(game.target))
+    move_latencies = []
+    state = game.engine
+    while not game.game_over:
+        guess = strategy.guess(state)
+        start = time.time()
+        game, _ = repository.make_move(game.id, guess)
+        move_latencies.append(time.time() - start)
+        hits = game.engine.revealed & ~state.revealed
+        state = game.engine
+        strategy.observe(guess, hits)
+    return state.won, new_game_latency, move_latencies
+
+
+def open_repository(backend, path):
+    if backend == 'memory':
+        return storage.InMemoryRepository()
+    elif backend == 'sqlite':
+        return storage.SQLiteRepository(path)
+
+
+def run(args):
+    """Plays a chunk of games in a worker process"""
+    games, strategy, attempts, constraints, seed, backend, path = args
+    random.seed(seed)
+    words = corpus.get_corpus()
+    results = []
+    repository = open_repository(backend, path)
+    user_name = 'simulate-{}'.format(seed)
+    if repository:
+        repository.create_user(user_name)
+    for _ in range(games):
+        if repository:
+            results.append(play_stored(repository, user_name, words,
+                                       STRATEGIES[strategy], attempts,
+                                       constraints))
+        else:
+            results.append(play(words, STRATEGIES[strategy], attempts,
+                                constraints))
+    if repository:
+        repository.close()
+    return results
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--games', type=int, default=1000)
+    parser.add_argument('--strategy', choices=sorted(STRATEGIES),
+                        default='frequency')
+    parser.add_argument('--attempts', type=int, default=6)
+    parser.add_argument('--processes', type=int,
+                        default=multiprocessing.cpu_count())
+    parser.add_argument('--min-length', type=int)
+    parser.add_argument('--max-length', type=int)
+    parser.add_argument('--difficulty', choices=corpus.DIFFICULTIES)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--backend', choices=('engine', 'memory', 'sqlite'),
+                        default='engine')
+    parser.add_argument('--sqlite-path', default='simulate.db')
+    args = parser.parse_args()
+
+    constraints = {'min_length': args.min_length,
+                   'max_length': args.max_length,
+                   'difficulty': args.difficulty}
+    chunks = [(args.games // args.processes +
+               (1 if i < args.games % args.processes else 0),
+               args.strategy, args.attempts, constraints, args.seed + i,
+               args.backend, args.sqlite_path)
+              for i in range(args.processes)]
+
+    # Load the corpus before forking so that the workers share it, and
+    # create the database once rather than in every worker at the same time.
+    corpus.get_corpus()
+    repository = open_repository(args.backend, args.sqlite_path)
+    if repository:
+        repository.close()
+    start = time.time()
+    pool = multiprocessing.Pool(args.processes)
+    results = [r for chunk in pool.map(run, chunks) for r in chunk]
+    pool.close()
+    elapsed = time.time() - start
+
+    wins = sum(1 for won, _, _ in results if won)
+    new_games = [latency for _, latency, _ in results]
+    moves = [latency for _, _, latencies in results for latency in latencies]
+    print ('{} games with the {} strategy, {} attempts, {} processes, '
+           '{} backend'.format(len(results), args.strategy, args.attempts,
+                               args.processes, args.backend))
+    print '{:>12.1f} games/sec'.format(len(results) / elapsed)
+    print '{:>12.1f} moves/sec'.format(len(moves) / elapsed)
+    print '{:>12.1f} % won'.format(100.0 * wins / len(results))
+    print '{:>12.2f} moves/game'.format(len(moves) / float(len(results)))
+    for name, latencies in (('new_game', new_games), ('make_move', moves)):
+        print '{:>12.1f} us p50 {:>8.1f} us p99 {}'.format(
+            percentile(latencies, 0.5) * 1e6,
+            percentile(latencies, 0.99) * 1e6, name)
+
+
+if __name__ == '__main__':
+    main()
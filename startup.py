@@ -0,0 +1,28 @@
+"""startup.py - Timings of the work an instance does before it can serve its
+first request: importing modules and loading data. They are recorded as the
+instance starts and warms up, and reported by /tasks/handler_stats."""
+
+import collections
+import contextlib
+import threading
+import time
+
+_timings = collections.OrderedDict()
+_timings_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def timed(name):
+    """Records the time taken by the enclosed block under a name"""
+    start = time.time()
+    try:
+        yield
+    finally:
+        with _timings_lock:
+            _timings[name] = round((time.time() - start) * 1000.0, 3)
+
+
+def timings():
+    """Returns the recorded timings in ms, in the order they were recorded"""
+    with _timings_lock:
+        return collections.OrderedDict(_timings)
@@ -0,0 +1,347 @@
+"""storage.py - Storage backends for the game outside of App Engine.
+
+A Repository stores users, games with their move logs, scores and ranks, and
+plays the games with the rules of engine.py, which the Datastore models play
+them with too. The ndb backend in ndb_storage.py delegates to models.py; the
+backends here hold the data in process memory or in a SQLite database, so
+that the core game can be self-hosted or benchmarked without the SDK. Every
+backend returns the same plain GameState and ScoreState records.
+
+The endpoints of api.py are not served through a Repository: they use the
+Datastore models directly, along with what only those provide, such as the
+game cache, the leaderboard buckets, statistics and token games."""
+
+import collections
+import datetime
+import sqlite3
+import threading
+
+from corpus import get_corpus
+from engine import ALREADY_OVER, CANCELLED, WordEngine, check_attempts, \
+    is_over, pack_move, play_turn, score_game
+
+
+class NotFoundError(LookupError):
+    """Raised for a user that does not exist"""
+
+
+class GameState(object):
+    """The state of a game as stored by a Repository"""
+    __slots__ = ('id', 'user', 'target', 'attempts_allowed',
+                 'attempts_remaining', 'game_over', 'cancel',
+                 'guessed_letters', 'current_guess', 'moves')
+
+    def __init__(self, id, user, target, attempts_allowed,
+                 attempts_remaining=None, game_over=False, cancel=False,
+                 guessed_letters=0, current_guess='', moves=''):
+        self.id = id
+        self.user = user
+        self.target = target
+        self.attempts_allowed = attempts_allowed
+        self.attempts_remaining = (attempts_allowed if attempts_remaining is
+                                   None else attempts_remaining)
+        self.game_over = game_over
+        self.cancel = cancel
+        self.guessed_letters = guessed_letters
+        self.current_guess = current_guess
+        self.moves = moves
+
+    @property
+    def engine(self):
+        return WordEngine(self.target, self.guessed_letters)
+
+    @property
+    def word_state(self):
+        return self.engine.word_state
+
+
+ScoreState = collections.namedtuple('ScoreState',
+                                    'user date won guesses score')
+
+
+class Repository(object):
+    """The operations every storage backend provides. Unknown users raise
+    a NotFoundError, invalid games and guesses a ValueError."""
+
+    def create_user(self, name, email=None):
+        """Creates a user and returns True, or False if the name is taken"""
+        raise NotImplementedError
+
+    def new_game(self, user_name, attempts=5, min_length=None,
+                 max_length=None, difficulty=None):
+        """Creates and returns a new GameState"""
+        raise NotImplementedError
+
+    def get_game(self, game_id):
+        """Returns the GameState of a game, or None if it does not exist"""
+        raise NotImplementedError
+
+    def make_move(self, game_id, guess):
+        """Plays a guess and returns the GameState along with a message, or
+        (None, None) if the game does not exist"""
+        raise NotImplementedError
+
+    def user_scores(self, user_name):
+        """Returns the ScoreStates of a user, the most recent first"""
+        raise NotImplementedError
+
+    def top_ranks(self, number_of_results):
+        """Returns the (user name, total score) of the best number_of_results
+        users, best first, or of every user if it is negative"""
+        raise NotImplementedError
+
+    def flush(self):
+        """Makes the writes so far durable"""
+
+    def close(self):
+        self.flush()
+
+
+class LocalRepository(Repository):
+    """Plays the games of a backend that stores them through a few
+    primitive operations, serialized by a lock"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _name_key(name):
+        return name.strip().lower()
+
+    def create_user(self, name, email=None):
+        with self._lock:
+            if self._user_id(name) is not None:
+                return False
+            self._insert_user(name, email)
+            return True
+
+    def new_game(self, user_name, attempts=5, min_length=None,
+                 max_length=None, difficulty=None):
+        check_attempts(attempts)
+        word = get_corpus().random_word(min_length=min_length,
+                                        max_length=max_length,
+                                        difficulty=difficulty)
+        with self._lock:
+            user = self._user_id(user_name)
+            if user is None:
+                raise NotFoundError('A User with that name does not exist!')
+            game = GameState(None, user, word, attempts)
+            self._insert_game(game)
+            return game
+
+    def get_game(self, game_id):
+        with self._lock:
+            return self._load_game(game_id)
+
+    def make_move(self, game_id, guess):
+        with self._lock:
+            game = self._load_game(game_id)
+            if not game:
+                return None, None
+            if game.game_over:
+                return game, ALREADY_OVER
+            elif game.cancel:
+                return game, CANCELLED
+
+            engine = game.engine
+            msg, hits, game.attempts_remaining = play_turn(
+                engine, guess, game.attempts_remaining)
+            game.guessed_letters = engine.guessed
+            game.current_guess = guess.lower()
+            game.moves += pack_move(game.current_guess, hits)
+            game.game_over = is_over(engine, game.attempts_remaining)
+            self._save_game(game)
+            if game.game_over:
+                guesses, score = score_game(game.attempts_allowed,
+                                            game.attempts_remaining)
+                self._add_score(ScoreState(game.user, datetime.date.today(),
+                                           engine.won, guesses, score))
+            return game, msg
+
+
+class InMemoryRepository(LocalRepository):
+    """Holds everything in dicts of this process"""
+
+    def __init__(self):
+        super(InMemoryRepository, self).__init__()
+        self._users = {}
+        self._names = {}
+        self._games = {}
+        self._scores = collections.defaultdict(list)
+        self._ranks = collections.defaultdict(float)
+
+    def _user_id(self, name):
+        return self._names.get(self._name_key(name))
+
+    def _insert_user(self, name, email):
+        user = len(self._users) + 1
+        self._users[user] = (name, email)
+        self._names[self._name_key(name)] = user
+
+    def _insert_game(self, game):
+        game.id = len(self._games) + 1
+        self._save_game(game)
+
+    def _load_game(self, game_id):
+        state = self._games.get(game_id)
+        return GameState(game_id, *state) if state else None
+
+    def _save_game(self, game):
+        self._games[game.id] = (game.user, game.target, game.attempts_allowed,
+                                game.attempts_remaining, game.game_over,
+                                game.cancel, game.guessed_letters,
+                                game.current_guess, game.moves)
+
+    def _add_score(self, score):
+        self._scores[score.user].append(score)
+        self._ranks[score.user] += score.score
+
+    def user_scores(self, user_name):
+        with self._lock:
+            user = self._user_id(user_name)
+            if user is None:
+                raise NotFoundError('A User with that name does not exist!')
+            return sorted(self._scores[user], key=lambda score: score.date,
+                          reverse=True)
+
+    def top_ranks(self, number_of_results):
+        with self._lock:
+            ranks = sorted(self._ranks.items(), key=lambda rank: -rank[1])
+            if number_of_results >= 0:
+                ranks = ranks[:number_of_results]
+            return [(self._users[user][0], total) for user, total in ranks]
+
+
+class SQLiteRepository(LocalRepository):
+    """Stores everything in a SQLite database in WAL mode. Writes are
+    grouped into one transaction committed every commit_every writes, and on
+    flush and close; a crash loses at most the writes not committed yet."""
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            name_key TEXT NOT NULL UNIQUE,
+            email TEXT);
+        CREATE TABLE IF NOT EXISTS games (
+            id INTEGER PRIMARY KEY,
+            user INTEGER NOT NULL REFERENCES users,
+            target TEXT NOT NULL,
+            attempts_allowed INTEGER NOT NULL,
+            attempts_remaining INTEGER NOT NULL,
+            game_over INTEGER NOT NULL,
+            cancel INTEGER NOT NULL,
+            guessed_letters INTEGER NOT NULL,
+            current_guess TEXT NOT NULL,
+            moves BLOB NOT NULL);
+        CREATE TABLE IF NOT EXISTS scores (
+            id INTEGER PRIMARY KEY,
+            user INTEGER NOT NULL REFERENCES users,
+            date TEXT NOT NULL,
+            won INTEGER NOT NULL,
+            guesses INTEGER NOT NULL,
+            score REAL NOT NULL);
+        CREATE INDEX IF NOT EXISTS scores_user ON scores (user, date DESC);
+        CREATE TABLE IF NOT EXISTS ranks (
+            user INTEGER PRIMARY KEY REFERENCES users,
+            total_score REAL NOT NULL);
+        CREATE INDEX IF NOT EXISTS ranks_total ON ranks (total_score DESC);
+    '''
+
+    def __init__(self, path, commit_every=100):
+        super(SQLiteRepository, self).__init__()
+        self._db = sqlite3.connect(path, timeout=30,
+                                   check_same_thread=False)
+        self._db.text_factory = str
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(self.SCHEMA)
+        self._commit_every = commit_every
+        self._pending = 0
+
+    def _write(self, sql, params):
+        cursor = self._db.execute(sql, params)
+        self._pending += 1
+        if self._pending >= self._commit_every:
+            self.flush()
+        return cursor
+
+    def flush(self):
+        with self._lock:
+            self._db.commit()
+            self._pending = 0
+
+    def close(self):
+        self.flush()
+        self._db.close()
+
+    def _user_id(self, name):
+        row = self._db.execute('SELECT id FROM users WHERE name_key = ?',
+                               (self._name_key(name),)).fetchone()
+        return row[0] if row else None
+
+    def _insert_user(self, name, email):
+        self._write('INSERT INTO users (name, name_key, email) '
+                    'VALUES (?, ?, ?)', (name, self._name_key(name), email))
+
+    def _insert_game(self, game):
+        game.id = self._write(
+            'INSERT INTO games (user, target, attempts_allowed, '
+            'attempts_remaining, game_over, cancel, guessed_letters, '
+            'current_guess, moves) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (game.user, game.target, game.attempts_allowed,
+             game.attempts_remaining, game.game_over, game.cancel,
+             game.guessed_letters, game.current_guess,
+             buffer(game.moves))).lastrowid
+
+    def _load_game(self, game_id):
+        row = self._db.execute(
+            'SELECT user, target, attempts_allowed, attempts_remaining, '
+            'game_over, cancel, guessed_letters, current_guess, moves '
+            'FROM games WHERE id = ?', (game_id,)).fetchone()
+        if not row:
+            return None
+        (user, target, allowed, remaining, game_over, cancel, guessed,
+         current_guess, moves) = row
+        return GameState(game_id, user, target, allowed, remaining,
+                         bool(game_over), bool(cancel), guessed,
+                         current_guess, str(moves))
+
+    def _save_game(self, game):
+        self._write(
+            'UPDATE games SET attempts_remaining = ?, game_over = ?, '
+            'cancel = ?, guessed_letters = ?, current_guess = ?, moves = ? '
+            'WHERE id = ?',
+            (game.attempts_remaining, game.game_over, game.cancel,
+             game.guessed_letters, game.current_guess, buffer(game.moves),
+             game.id))
+
+    def _add_score(self, score):
+        self._write('INSERT INTO scores (user, date, won, guesses, score) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (score.user, score.date.isoformat(), score.won,
+                     score.guesses, score.score))
+        self._write('INSERT OR IGNORE INTO ranks (user, total_score) '
+                    'VALUES (?, 0)', (score.user,))
+        self._write('UPDATE ranks SET total_score = total_score + ? '
+                    'WHERE user = ?', (score.score, score.user))
+
+    def user_scores(self, user_name):
+        with self._lock:
+            user = self._user_id(user_name)
+            if user is None:
+                raise NotFoundError('A User with that name does not exist!')
+            rows = self._db.execute(
+                'SELECT date, won, guesses, score FROM scores '
+                'WHERE user = ? ORDER BY date DESC', (user,)).fetchall()
+        return [ScoreState(user, datetime.datetime.strptime(
+            date, '%Y-%m-%d').date(), bool(won), guesses, score)
+                for date, won, guesses, score in rows]
+
+    def top_ranks(self, number_of_results):
+        with self._lock:
+            return self._db.execute(
+                'SELECT users.name, ranks.total_score FROM ranks '
+                'JOIN users ON users.id = ranks.user '
+                'ORDER BY ranks.total_score DESC LIMIT ?',
+                (number_of_results,)).fetchall()
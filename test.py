@@ -1,4 +1,3 @@
-with open('words.txt', 'r') as f:
-            words = f.read().splitlines()
+from corpus import get_corpus
 
-print len(words)
\ No newline at end of file
+print len(get_corpus())
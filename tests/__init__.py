@@ -0,0 +1,8 @@
+"""Tests of the game. Run them from the root of the app, where the word list
+is, with:
+
+    python -m unittest discover -s tests -t .
+
+The tests of the code that runs on App Engine need the SDK. They are skipped
+unless it can be imported; point APPENGINE_SDK at the SDK directory
+(google_appengine) to run them against the testbed stubs."""
@@ -0,0 +1,162 @@
+"""support.py - Shared setup of the tests needing the App Engine SDK. They
+derive from AppEngineTestCase, which runs each test against fresh testbed
+stubs and is skipped when the SDK or a library of the app cannot be
+imported. benchmark.py runs against the same stubs, through init_testbed."""
+
+import os
+import sys
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SDK = os.environ.get('APPENGINE_SDK')
+if SDK and SDK not in sys.path:
+    sys.path.insert(0, SDK)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+
+try:
+    from google.appengine.api import apiproxy_rpc, apiproxy_stub_map, memcache
+    from google.appengine.datastore import datastore_stub_util
+    from google.appengine.ext import ndb, testbed
+    import main
+    import models
+except ImportError as e:
+    AVAILABLE = False
+    REASON = 'The App Engine SDK or a library is missing: {}'.format(e)
+else:
+    AVAILABLE = True
+    REASON = None
+
+
+class FakeQuery(object):
+    """Stands for a query, with the methods given"""
+
+    def __init__(self, **methods):
+        self.__dict__.update(methods)
+
+
+def init_testbed():
+    """Returns an active testbed with empty Datastore, memcache and task
+    queue stubs. Queries are strongly consistent."""
+    bed = testbed.Testbed()
+    bed.activate()
+    # endpoints expects a version id of the form major.minor.
+    bed.setup_env(current_version_id='test.1', overwrite=True)
+    bed.init_datastore_v3_stub(
+        consistency_policy=datastore_stub_util.
+        PseudoRandomHRConsistencyPolicy(probability=1))
+    bed.init_memcache_stub()
+    bed.init_taskqueue_stub(root_path=ROOT)
+    ndb.get_context().clear_cache()
+    return bed
+
+
+def inject_latency(seconds, services=('datastore_v3', 'memcache',
+                                      'taskqueue')):
+    """Makes every call to the stubs of the current testbed for the given
+    services complete the given seconds after it was made. Calls made before
+    the first of them is waited on overlap, as against the real services,
+    so the elapsed time counts round trips rather than calls."""
+    for service in services:
+        apiproxy_stub_map.apiproxy.ReplaceStub(service, LatencyStub(
+            apiproxy_stub_map.apiproxy.GetStub(service), seconds))
+
+
+class LatencyStub(object):
+    """Wraps the stub of a service for inject_latency"""
+
+    def __init__(self, stub, seconds):
+        self.stub = stub
+        self.seconds = seconds
+
+    def __getattr__(self, name):
+        return getattr(self.stub, name)
+
+    def CreateRPC(self):
+        return DelayedRPC(stub=self.stub, delay=self.seconds)
+
+    def MakeSyncCall(self, service, call, request, response):
+        time.sleep(self.seconds)
+        self.stub.MakeSyncCall(service, call, request, response)
+
+
+if AVAILABLE:
+    class DelayedRPC(apiproxy_rpc.RPC):
+        """An RPC of the stubs, made when it is waited on once its delay
+        has passed since it started"""
+
+        def __init__(self, delay=0, **kwargs):
+            super(DelayedRPC, self).__init__(**kwargs)
+            self.delay = delay
+
+        def _MakeCallImpl(self):
+            self.due = time.time() + self.delay
+            super(DelayedRPC, self)._MakeCallImpl()
+
+        def _WaitImpl(self):
+            time.sleep(max(0, self.due - time.time()))
+            return super(DelayedRPC, self)._WaitImpl()
+
+
+@unittest.skipUnless(AVAILABLE, REASON)
+class AppEngineTestCase(unittest.TestCase):
+    """Runs each test against the stubs of init_testbed"""
+
+    def setUp(self):
+        self.testbed = init_testbed()
+        self.addCleanup(self.testbed.deactivate)
+        self.taskqueue = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+
+    def create_user(self, name):
+        """Returns the key of a new user"""
+        user = models.User(name=name)
+        user.put()
+        models.UserName(key=models.UserName.key_for(name), user=user.key).put()
+        return user.key
+
+    def create_game(self, user_key, target, attempts=5):
+        """Returns a new game of a user with a known target"""
+        game = models.Game(user=user_key, target=target,
+                           attempts_allowed=attempts,
+                           attempts_remaining=attempts, game_over=False,
+                           word_state='_' * len(target), cancel=False,
+                           current_guess='', guessed_letters=0)
+        game.put()
+        models.Game_History(key=models.Game_History.key_for(game.key)).put()
+        return game
+
+    def patch(self, owner, name, value):
+        """Replaces an attribute for the duration of the test"""
+        old = owner.__dict__.get(name)
+        setattr(owner, name, value)
+        if old is None:
+            self.addCleanup(delattr, owner, name)
+        else:
+            self.addCleanup(setattr, owner, name, old)
+
+    def tasks(self, url):
+        """Returns the tasks enqueued on the default queue for a url"""
+        return self.taskqueue.get_filtered_tasks(url=url)
+
+    def run_tasks(self, url):
+        """Runs the tasks enqueued for a url through the handlers of main,
+        along with those they enqueue for it in turn. Returns how many ran."""
+        count = 0
+        tasks = self.tasks(url)
+        while tasks:
+            for task in tasks:
+                self.taskqueue.DeleteTask('default', task.name)
+                response = main.app.get_response(
+                    task.url, method='POST', body=task.payload,
+                    content_type='application/x-www-form-urlencoded')
+                self.assertLess(response.status_int, 300, response.body)
+                count += 1
+            tasks = self.tasks(url)
+        return count
+
+    def clear_caches(self):
+        """Drops the in-context cache and memcache"""
+        ndb.get_context().clear_cache()
+        memcache.flush_all()
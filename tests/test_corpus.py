@@ -0,0 +1,157 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import corpus
+from corpus import CorpusRegistry, WordCorpus, normalize_words
+from engine import MAX_WORD_LENGTH
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class RandomWordTest(unittest.TestCase):
+    def setUp(self):
+        self.words = WordCorpus.from_words(['a', 'an', 'ant', 'ants', 'plant'])
+
+    def test_length_range(self):
+        for _ in range(20):
+            self.assertIn(self.words.random_word(min_length=2, max_length=3),
+                          ('an', 'ant'))
+        self.assertEqual(self.words.random_word(min_length=5), 'plant')
+        self.assertEqual(self.words.random_word(max_length=1), 'a')
+
+    def test_empty_ranges_are_rejected(self):
+        for min_length, max_length in ((0, None), (None, 0), (-1, 3),
+                                       (4, 2)):
+            self.assertRaises(ValueError, self.words.random_word,
+                              min_length=min_length, max_length=max_length)
+
+    def test_no_match(self):
+        self.assertRaises(ValueError, self.words.random_word, min_length=6)
+        self.assertEqual(self.words.count(min_length=6), 0)
+
+
+class NormalizeTest(unittest.TestCase):
+    def test_unplayable_words_are_dropped(self):
+        longest = 'a' * MAX_WORD_LENGTH
+        self.assertEqual(
+            normalize_words(['Ant', 'ant', "can't", 'caf\xc3\xa9', '', ' Bee ',
+                             longest, longest + 'a']),
+            ['ant', 'bee', longest])
+
+
+class CompiledFormatTest(unittest.TestCase):
+    WORDS = ['a', 'ox', 'cat', 'dog', 'zebra', 'quartz', 'jazz', 'strength',
+             'rhythm', 'ee', 'banana', 'mississippi', 'y' * MAX_WORD_LENGTH]
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'words.bin')
+        self.source = WordCorpus.from_words(normalize_words(self.WORDS))
+        with open(self.path, 'wb') as f:
+            self.source.write(f)
+
+    def assertSameCorpus(self, compiled):
+        self.assertEqual(len(compiled), len(self.source))
+        self.assertEqual([compiled.word(i) for i in range(len(compiled))],
+                         [self.source.word(i)
+                          for i in range(len(self.source))])
+        for difficulty in (None,) + corpus.DIFFICULTIES:
+            for length in (None, 2, 6, MAX_WORD_LENGTH):
+                self.assertEqual(
+                    list(compiled.words(max_length=length,
+                                        difficulty=difficulty)),
+                    list(self.source.words(max_length=length,
+                                           difficulty=difficulty)))
+        self.assertEqual(list(compiled.words(min_length=3, max_length=3,
+                                             distinct=3)), ['cat', 'dog'])
+
+    def test_mapped(self):
+        if corpus.mmap is None:
+            self.skipTest('mmap is missing')
+        compiled = WordCorpus.from_compiled(self.path)
+        self.assertIsInstance(compiled._data, corpus.mmap.mmap)
+        self.assertSameCorpus(compiled)
+
+    def test_read_without_mmap(self):
+        mmap = corpus.mmap
+        corpus.mmap = None
+        self.addCleanup(setattr, corpus, 'mmap', mmap)
+        compiled = WordCorpus.from_compiled(self.path)
+        self.assertIsInstance(compiled._data, str)
+        self.assertSameCorpus(compiled)
+
+    def test_written_again_unchanged(self):
+        compiled = WordCorpus.from_compiled(self.path)
+        copy = self.path + '.copy'
+        with open(copy, 'wb') as f:
+            compiled.write(f)
+        with open(self.path, 'rb') as original, open(copy, 'rb') as f:
+            self.assertEqual(f.read(), original.read())
+
+    def test_other_files_are_rejected(self):
+        with open(self.path, 'wb') as f:
+            f.write('\n'.join(self.WORDS).ljust(64))
+        self.assertRaises(ValueError, WordCorpus.from_compiled, self.path)
+
+
+class Derived(object):
+    def __init__(self, nbytes):
+        self.nbytes = nbytes
+
+
+class CorpusRegistryTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        for name in ('birds', 'trees'):
+            with open(os.path.join(directory, name + '.txt'), 'w') as f:
+                f.write('\n'.join(['oak', 'elm', 'wren', 'lark']))
+        dictionaries = corpus.DICTIONARIES_DIR
+        corpus.DICTIONARIES_DIR = directory
+        self.addCleanup(setattr, corpus, 'DICTIONARIES_DIR', dictionaries)
+        self.registry = CorpusRegistry()
+
+    def test_compiled_dictionaries_are_preferred(self):
+        parsed = corpus.load_corpus('birds')
+        self.assertIsInstance(parsed._data, str)
+        with open(os.path.join(corpus.DICTIONARIES_DIR, 'birds.bin'),
+                  'wb') as f:
+            parsed.write(f)
+        compiled = corpus.load_corpus('birds')
+        self.assertGreater(compiled._base, 0)
+        self.assertEqual(sorted(compiled.words()), sorted(parsed.words()))
+
+    def test_derived_structures_count_towards_the_budget(self):
+        birds = self.registry.get('birds')
+        self.registry.get('trees')
+        self.registry.max_bytes = 2 * birds.nbytes + 100
+        size = birds.nbytes
+        self.assertIs(birds.derived('index', lambda words: Derived(1000)),
+                      birds.derived('index', lambda words: Derived(0)))
+        self.assertEqual(birds.nbytes, size + 1000)
+
+        stats = self.registry.stats()
+        self.assertFalse(stats['birds']['resident'])
+        self.assertEqual(stats['birds']['bytes'], size + 1000)
+        self.assertTrue(stats['trees']['resident'])
+
+    @unittest.skipUnless(numpy, 'NumPy is missing')
+    def test_hint_index_is_counted(self):
+        import hint
+        birds = self.registry.get('birds')
+        size = birds.nbytes
+        hints = birds.derived('hints', hint.HintIndex)
+        self.assertEqual(birds.nbytes, size)
+        self.assertEqual(hints.hint('_r__', 0)[0], 'e')
+        self.assertEqual(birds.nbytes, size + hints.nbytes)
+        self.assertEqual(hints.nbytes, 2 * 4 + 2 * 26)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import struct
+import unittest
+
+from engine import InvalidGuessError, MAX_WORD_LENGTH, WordEngine, \
+    check_attempts, is_over, pack_move, pack_word_states, play_turn, \
+    replay_moves, score_game
+
+
+class WordEngineTest(unittest.TestCase):
+    def test_repeated_letters(self):
+        game = WordEngine('banana')
+        self.assertEqual(game.play('a'), 0b101010)
+        self.assertEqual(game.word_state, '_a_a_a')
+        self.assertEqual(game.play('N'), 0b010100)
+        self.assertEqual(game.word_state, '_anana')
+        self.assertRaises(InvalidGuessError, game.play, 'a')
+        self.assertRaises(InvalidGuessError, game.play, 'A')
+        self.assertFalse(game.won)
+        self.assertEqual(game.play('b'), 0b000001)
+        self.assertTrue(game.won)
+
+    def test_misses(self):
+        game = WordEngine('cat')
+        self.assertEqual(game.play('z'), 0)
+        self.assertTrue(game.has_guessed('z'))
+        self.assertRaises(InvalidGuessError, game.play, 'z')
+        self.assertEqual(game.word_state, '___')
+
+    def test_whole_word_guesses(self):
+        game = WordEngine('banana')
+        game.play('a')
+        # Only the positions not revealed yet are hits.
+        self.assertEqual(game.play('BANANA'), 0b010101)
+        self.assertTrue(game.won)
+        self.assertEqual(game.word_state, 'banana')
+        self.assertTrue(game.has_guessed('n'))
+
+    def test_invalid_guesses(self):
+        game = WordEngine('cat')
+        for guess in ('', '1', 'c4t', 'ca', 'cats', 'dog'):
+            self.assertRaises(InvalidGuessError, game.play, guess)
+        self.assertEqual((game.guessed, game.word_state), (0, '___'))
+
+    def test_restored_state(self):
+        game = WordEngine('banana')
+        game.play('a')
+        game.play('z')
+        restored = WordEngine('banana', game.guessed)
+        self.assertEqual(restored.word_state, '_a_a_a')
+        self.assertRaises(InvalidGuessError, restored.play, 'z')
+        legacy = WordEngine.from_word_state('banana', '_a_a_a')
+        self.assertEqual(legacy.word_state, '_a_a_a')
+        self.assertEqual(legacy.play('z'), 0)
+
+
+class RulesTest(unittest.TestCase):
+    def test_misses_cost_an_attempt(self):
+        game = WordEngine('cat')
+        self.assertEqual(play_turn(game, 'c', 2), ('Letter Found!', 1, 2))
+        self.assertEqual(play_turn(game, 'z', 2), ('Letter not found!', 0, 1))
+        self.assertFalse(is_over(game, 1))
+        self.assertEqual(play_turn(game, 'q', 1),
+                         ('Letter not found! Game over!', 0, 0))
+        self.assertTrue(is_over(game, 0))
+
+    def test_invalid_guesses_cost_nothing(self):
+        game = WordEngine('cat')
+        play_turn(game, 'c', 2)
+        for guess in ('c', 'dog', '?'):
+            self.assertRaises(InvalidGuessError, play_turn, game, guess, 2)
+        self.assertEqual(game.word_state, 'c__')
+
+    def test_wins(self):
+        game = WordEngine('cat')
+        self.assertEqual(play_turn(game, 'cat', 1),
+                         ('Word Guessed Correctly! Game over!', 0b111, 1))
+        self.assertTrue(is_over(game, 1))
+
+    def test_scores(self):
+        self.assertEqual(score_game(5, 5), (0, 1.0))
+        self.assertEqual(score_game(10, 8), (2, 0.8))
+        self.assertEqual(score_game(5, 0), (5, 0.0))
+
+    def test_attempts(self):
+        check_attempts(1)
+        self.assertRaises(ValueError, check_attempts, 0)
+
+
+class MoveLogTest(unittest.TestCase):
+    def play(self, target, guesses):
+        """Returns the move log of guesses and the word state after each"""
+        game = WordEngine(target)
+        moves, states = [], []
+        for guess in guesses:
+            moves.append(pack_move(guess, game.play(guess)))
+            states.append(game.word_state)
+        return ''.join(moves), states
+
+    def test_round_trip(self):
+        guesses = ['a', 'z', 'n', 'banana']
+        moves, states = self.play('banana', guesses)
+        self.assertEqual(list(replay_moves('banana', moves)),
+                         zip(guesses, states))
+
+    def test_longest_words(self):
+        target = ('abcdefghijklmnopqrstuvwxyz' * 2)[:MAX_WORD_LENGTH]
+        guesses = ['f', 'e', target]
+        moves, states = self.play(target, guesses)
+        self.assertEqual(list(replay_moves(target, moves)),
+                         zip(guesses, states))
+        self.assertRaises(struct.error, pack_move, 'a',
+                          1 << MAX_WORD_LENGTH)
+
+    def test_word_states(self):
+        guesses = ['', 'a', 'z', 'banana']
+        word_states = ['______', '_a_a_a', '_a_a_a', 'banana']
+        self.assertEqual(
+            list(replay_moves('banana', pack_word_states(guesses,
+                                                         word_states))),
+            zip(guesses, word_states)[1:])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import threading
+import unittest
+
+from tests import support
+
+if support.AVAILABLE:
+    from google.appengine.api import memcache
+    from google.appengine.ext import ndb
+    from models import Game, GameCache, Game_History
+
+
+class GameCacheTest(support.AppEngineTestCase):
+    def setUp(self):
+        super(GameCacheTest, self).setUp()
+        self.game = self.create_game(self.create_user('alice'), 'abcdefgh')
+
+    def cached(self):
+        """Returns the cached game and history, failing if none is"""
+        cached = memcache.get(GameCache._memcache_key(self.game.key))
+        self.assertIsNotNone(cached)
+        return cached
+
+    def assertCurrent(self):
+        """Asserts that the cached state is the one in the Datastore"""
+        game, game_history = self.cached()
+        ndb.get_context().clear_cache()
+        stored = self.game.key.get()
+        self.assertEqual((game.word_state, game.attempts_remaining,
+                          game.game_over, game.cancel),
+                         (stored.word_state, stored.attempts_remaining,
+                          stored.game_over, stored.cancel))
+        self.assertEqual(game_history.moves,
+                         Game_History.key_for(self.game.key).get().moves)
+
+    def read_during(self, change):
+        """Reads the game through an empty cache, making change between the
+        read from the Datastore and the caching of the state read"""
+        add = memcache.add
+
+        def add_after_change(*args, **kwargs):
+            change()
+            return add(*args, **kwargs)
+        self.patch(memcache, 'add', add_after_change)
+        try:
+            return GameCache.get(self.game.key)
+        finally:
+            self.patch(memcache, 'add', add)
+
+    def test_moves_are_written_through(self):
+        GameCache.get(self.game.key)
+        Game.play_move(self.game.key, 'a')
+        self.assertCurrent()
+
+    def test_end_is_not_overwritten_by_a_stale_read(self):
+        game, _ = self.read_during(
+            lambda: Game.play_move(self.game.key, 'abcdefgh'))
+        self.assertFalse(game.game_over)
+        self.assertTrue(self.cached()[0].game_over)
+        self.assertCurrent()
+
+    def test_cancel_is_not_overwritten_by_a_stale_read(self):
+        game, _ = self.read_during(lambda: Game.cancel_game(self.game.key))
+        self.assertFalse(game.cancel)
+        self.assertTrue(self.cached()[0].cancel)
+        self.assertCurrent()
+
+    def test_concurrent_moves(self):
+        GameCache.get(self.game.key)
+
+        def play(guess):
+            try:
+                Game.play_move(self.game.key, guess)
+            except Exception:
+                # Moves losing the contention fail, as they may in
+                # production; the cache must still match the Datastore.
+                pass
+            GameCache.get(self.game.key)
+        threads = [threading.Thread(target=play, args=(guess,))
+                   for guess in 'abcdef']
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertCurrent()
+        self.assertGreater(len(self.cached()[1].moves), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
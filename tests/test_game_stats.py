@@ -0,0 +1,68 @@
+import unittest
+
+from tests import support
+
+if support.AVAILABLE:
+    from models import Game, GameStats
+
+
+class GameStatsTest(support.AppEngineTestCase):
+    def setUp(self):
+        super(GameStatsTest, self).setUp()
+        self.user = self.create_user('alice')
+
+    def new_game(self, target):
+        game = Game.new_game(self.user, 5)
+        game.target = target
+        game.word_state = '_' * len(target)
+        game.put()
+        return game
+
+    def test_games_adjust_the_counters_through_tasks(self):
+        game = self.new_game('cat')
+        cancelled = self.new_game('dog')
+        Game.play_move(game.key, 'z')
+        Game.play_move(game.key, 'a')
+        Game.cancel_game(cancelled.key)
+        # The transactions of the games do not touch the shards.
+        self.assertEqual(GameStats.query().count(), 0)
+        self.assertEqual(self.run_tasks('/tasks/adjust_game_stats'), 4)
+        self.assertEqual(GameStats.totals(), (1, 4))
+
+        Game.play_move(game.key, 'cat')
+        self.run_tasks('/tasks/adjust_game_stats')
+        self.assertEqual(GameStats.totals(), (0, 0))
+
+    def test_hits_do_not_adjust_the_counters(self):
+        game = self.new_game('cat')
+        self.run_tasks('/tasks/adjust_game_stats')
+        Game.play_move(game.key, 'c')
+        self.assertEqual(self.tasks('/tasks/adjust_game_stats'), [])
+
+    def test_reconcile_corrects_drift(self):
+        self.new_game('cat')
+        self.new_game('dog')
+        GameStats.adjust(5, 5)
+        GameStats.reconcile()
+        self.assertEqual(GameStats.totals(), (2, 10))
+
+    def test_reconcile_keeps_adjustments_made_during_the_scan(self):
+        self.new_game('cat')
+        self.run_tasks('/tasks/adjust_game_stats')
+        query = Game.query
+
+        def scan(*args, **kwargs):
+            # A game is counted while the scan runs, after the scan passed it.
+            games = list(query(*args, **kwargs).iter())
+            GameStats.adjust(1, 5)
+            return iter(games)
+        self.patch(Game, 'query', classmethod(
+            lambda cls, *args, **kwargs: support.FakeQuery(
+                iter=lambda **options: scan(*args, **kwargs))))
+
+        GameStats.reconcile()
+        self.assertEqual(GameStats.totals(), (2, 10))
+
+
+if __name__ == '__main__':
+    unittest.main()
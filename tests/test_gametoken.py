@@ -0,0 +1,110 @@
+import base64
+import unittest
+
+from tests import support
+
+try:
+    import gametoken
+    from gametoken import InvalidTokenError, TokenCodec, TokenGame
+except ImportError as e:
+    CRYPTO = 'pycrypto is missing: {}'.format(e)
+else:
+    CRYPTO = None
+
+if support.AVAILABLE:
+    from models import Game, Rank, Score, UserStats
+
+
+def unpad(token):
+    return base64.urlsafe_b64decode(str(token) + '=' * (-len(token) % 4))
+
+
+def pad(data):
+    return base64.urlsafe_b64encode(data).rstrip('=')
+
+
+@unittest.skipIf(CRYPTO, CRYPTO)
+class TokenCodecTest(unittest.TestCase):
+    def setUp(self):
+        self.codec = TokenCodec('secret')
+        self.game = TokenGame.new(7, 'cat', 5)
+        self.game.play('z')
+        self.token = self.codec.encode(self.game)
+
+    def test_round_trip(self):
+        game = self.codec.decode(self.token)
+        self.assertEqual((game.game_id, game.user_id, game.engine.target,
+                          game.engine.guessed, game.attempts_remaining),
+                         (self.game.game_id, 7, 'cat',
+                          self.game.engine.guessed, 4))
+
+    def test_altered_tokens_are_rejected(self):
+        data = unpad(self.token)
+        for i in range(len(data)):
+            altered = data[:i] + chr(ord(data[i]) ^ 1) + data[i + 1:]
+            self.assertRaises(InvalidTokenError, self.codec.decode,
+                              pad(altered))
+
+    def test_truncated_tokens_are_rejected(self):
+        data = unpad(self.token)
+        for size in (0, 1, gametoken.SIGNATURE_SIZE, len(data) - 1):
+            self.assertRaises(InvalidTokenError, self.codec.decode,
+                              pad(data[:size]))
+        self.assertRaises(InvalidTokenError, self.codec.decode, u'\xe9')
+
+    def test_other_secrets_are_rejected(self):
+        self.assertRaises(InvalidTokenError, TokenCodec('other').decode,
+                          self.token)
+
+    def test_other_versions_are_rejected(self):
+        data = unpad(self.token)[:-gametoken.SIGNATURE_SIZE]
+        data = chr(gametoken.VERSION + 1) + data[1:]
+        self.assertRaises(InvalidTokenError, self.codec.decode,
+                          pad(data + self.codec._sign(data)))
+
+
+@unittest.skipIf(CRYPTO, CRYPTO)
+class TokenGameTest(support.AppEngineTestCase):
+    def setUp(self):
+        super(TokenGameTest, self).setUp()
+        self.user = self.create_user('alice')
+        game, self.token = Game.new_token_game(self.user, 5)
+        self.target = game.engine.target
+
+    @staticmethod
+    def miss(target):
+        return 'z' if 'z' not in target else 'q'
+
+    def test_replayed_games_are_scored_once(self):
+        # Any game can be won by replaying its first token with the target.
+        Game.play_token_move(self.token, self.miss(self.target))
+        self.assertEqual(Score.query().count(), 0)
+        for _ in range(3):
+            game, _, _ = Game.play_token_move(self.token, self.target)
+            self.assertTrue(game.engine.won)
+        score = Score.query().get()
+        self.assertEqual(Score.query().count(), 1)
+        self.assertEqual((score.key.id(), score.won, score.score),
+                         ('token-' + game.game_id.encode('hex'), True, 1.0))
+        self.assertEqual(Rank.key_for(self.user).get().total_score, 1.0)
+        self.assertEqual(self.run_tasks('/tasks/move_score_bucket'), 1)
+        self.assertEqual(self.run_tasks('/tasks/roll_up_scores'), 1)
+        self.assertEqual(UserStats.key_for(self.user).get().games, 1)
+
+    def test_lost_games_stay_lost(self):
+        game, token = Game.new_token_game(self.user, 1)
+        target = game.engine.target
+        Game.play_token_move(token, self.miss(target))
+        game, _, _ = Game.play_token_move(token, target)
+        self.assertTrue(game.engine.won)
+        self.assertEqual([(score.won, score.score) for score in Score.query()],
+                         [(False, 0.0)])
+
+    def test_guesses_cannot_be_repeated(self):
+        game, _, token = Game.play_token_move(self.token, self.target[0])
+        self.assertRaises(ValueError, Game.play_token_move, token,
+                          self.target[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import json
+import unittest
+
+from tests import support
+
+if support.AVAILABLE:
+    import api
+    import endpoints
+    import main
+    from utils import RpcCounter
+
+
+class HandlerStatsTest(support.AppEngineTestCase):
+    def setUp(self):
+        super(HandlerStatsTest, self).setUp()
+        self.reset()
+        self.addCleanup(self.reset)
+        self.game = self.create_game(self.create_user('alice'), 'cat')
+        self.api = api.GuessANumberApi()
+
+    def reset(self):
+        response = main.app.get_response('/tasks/handler_stats',
+                                         method='POST')
+        self.assertEqual(response.status_int, 204)
+
+    def report(self):
+        response = main.app.get_response('/tasks/handler_stats')
+        self.assertEqual(response.content_type, 'application/json')
+        return json.loads(response.body)
+
+    def make_move(self, urlsafe_key, guess):
+        return self.api.make_move(api.MAKE_MOVE_REQUEST.combined_message_class(
+            urlsafe_game_key=urlsafe_key, guess=guess))
+
+    def test_requests_are_reported(self):
+        missing = self.create_game(self.game.user, 'dog').key
+        missing.delete()
+        with RpcCounter() as rpcs:
+            self.make_move(self.game.key.urlsafe(), 'c')
+            self.make_move(self.game.key.urlsafe(), 'z')
+            self.assertRaises(endpoints.NotFoundException, self.make_move,
+                              missing.urlsafe(), 'a')
+        self.run_tasks('/tasks/adjust_game_stats')
+
+        report = self.report()
+        handlers = report['handlers']
+        self.assertEqual(sorted(handlers), ['AdjustGameStats.post',
+                                            'GuessANumberApi.make_move'])
+        moves = handlers['GuessANumberApi.make_move']
+        self.assertEqual((moves['requests'], moves['errors']), (3, 1))
+        self.assertEqual(sum(moves['histogram']), 3)
+        self.assertEqual(len(moves['histogram']),
+                         len(report['latency_buckets_ms']) + 1)
+        self.assertGreaterEqual(moves['ms'], moves['max_ms'])
+        self.assertEqual((moves['rpcs'], moves['datastore_rpcs'],
+                          moves['rpc_bytes'], moves['memcache_hits'],
+                          moves['memcache_misses']),
+                         (rpcs.count(), rpcs.count('datastore_v3'),
+                          rpcs.size(), rpcs.memcache['hits'],
+                          rpcs.memcache['misses']))
+        self.assertEqual(handlers['AdjustGameStats.post']['requests'], 1)
+
+        self.reset()
+        self.assertEqual(self.report()['handlers'], {})
+
+
+if __name__ == '__main__':
+    unittest.main()
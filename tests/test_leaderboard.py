@@ -0,0 +1,150 @@
+import os
+import random
+import threading
+import time
+import unittest
+
+from tests import support
+
+if support.AVAILABLE:
+    from google.appengine.ext import ndb
+    from models import Game, Rank, ScoreBucket, LEADERBOARD_SIZE
+
+
+class ScoreBucketTest(support.AppEngineTestCase):
+    def test_scores_fall_within_their_bucket(self):
+        for total in (0.0, 0.05, 0.1, 0.6, 1.0, 2.5, 17.2, 140.0, 1e9):
+            bucket_id = ScoreBucket.id_for(total)
+            self.assertLess(total, ScoreBucket.upper_bound(bucket_id))
+            if bucket_id > 1:
+                self.assertGreaterEqual(
+                    total, ScoreBucket.upper_bound(bucket_id - 1))
+
+    def test_games_move_ranks_through_tasks(self):
+        user = self.create_user('alice')
+        for target in ('cat', 'dog'):
+            game = Game.new_game(user, 5)
+            game.target = target
+            game.put()
+            buckets = ScoreBucket.query().fetch()
+            Game.play_move(game.key, target)
+            # The transaction of the game does not touch the buckets.
+            self.assertEqual(ScoreBucket.query().fetch(), buckets)
+            self.assertEqual(self.run_tasks('/tasks/move_score_bucket'), 1)
+            rank = Rank.key_for(user).get()
+            bucket = ScoreBucket.key_for(rank.total_score).get()
+            self.assertEqual(bucket.count, 1)
+        self.assertEqual(
+            sum(bucket.count for bucket in ScoreBucket.query()), 1)
+
+    def test_positions(self):
+        totals = [0.0, 0.2, 0.2, 1.0, 1.05, 3.5, 40.0]
+        ranks = [Rank(user=ndb.Key('User', i + 1), total_score=total)
+                 for i, total in enumerate(totals)]
+        ndb.put_multi(ranks)
+        ScoreBucket.rebuild()
+        for rank in ranks:
+            self.assertEqual(
+                rank.position_async().get_result(),
+                1 + len([total for total in totals if total > rank.total_score]))
+
+    def test_top_is_capped(self):
+        ndb.put_multi([Rank(user=ndb.Key('User', i + 1), total_score=float(i))
+                       for i in range(LEADERBOARD_SIZE + 5)])
+        self.assertEqual(len(Rank.top()), LEADERBOARD_SIZE)
+        self.assertEqual([rank.total_score for rank in Rank.top(3)],
+                         [104.0, 103.0, 102.0])
+        self.assertEqual(len(Rank.top(LEADERBOARD_SIZE + 5)),
+                         LEADERBOARD_SIZE + 5)
+        self.assertRaises(ValueError, Rank.top, -1)
+
+    def test_top_is_invalidated_once_committed(self):
+        user = self.create_user('alice')
+        game = self.create_game(user, 'cat')
+        self.assertEqual(Rank.top(), [])
+        invalidate_top = Rank.invalidate_top
+        committed = []
+
+        def invalidate(total_score):
+            # A concurrent request reads the ranks as the cache is dropped.
+            read = threading.Thread(target=lambda: committed.append(
+                Rank.key_for(user).get() is not None))
+            read.start()
+            read.join()
+            invalidate_top(total_score)
+        self.patch(Rank, 'invalidate_top', staticmethod(invalidate))
+        Game.play_move(game.key, 'cat')
+        self.assertEqual(committed, [True])
+        self.assertEqual([rank.total_score for rank in Rank.top()], [1.0])
+
+
+@unittest.skipUnless(os.environ.get('LOAD_TEST_USERS'),
+                     'Set LOAD_TEST_USERS, e.g. to 100000, to run it')
+class LeaderboardLoadTest(support.AppEngineTestCase):
+    """Compares the leaderboard's reads with a scan of every rank, as
+    rankings used to be computed, over LOAD_TEST_USERS synthetic users"""
+    SAMPLES = 20
+
+    def setUp(self):
+        super(LeaderboardLoadTest, self).setUp()
+        rng = random.Random(0)
+        self.users = int(os.environ['LOAD_TEST_USERS'])
+        self.totals = []
+        for start in range(0, self.users, 500):
+            batch = []
+            for _ in range(min(500, self.users - start)):
+                # Most users play a few games, a few play many.
+                games = int(rng.expovariate(0.1))
+                total = sum(rng.choice((0.0, 0.2, 0.4, 0.6, 0.8, 1.0))
+                            for _ in range(games))
+                self.totals.append(total)
+                batch.append(Rank(user=ndb.Key('User', len(self.totals)),
+                                  total_score=total))
+            ndb.put_multi(batch)
+        self.totals.sort(reverse=True)
+        ScoreBucket.rebuild()
+        self.clear_caches()
+
+    def entities_read(self, rank, position):
+        """Returns the buckets and the index entries a position reads"""
+        above = ScoreBucket.query(
+            ScoreBucket.key > ScoreBucket.key_for(rank.total_score)).fetch()
+        return len(above) + position - 1 - sum(b.count for b in above)
+
+    def test_reads_and_writes(self):
+        started = time.time()
+        scanned = len(list(Rank.query().order(-Rank.total_score)))
+        scan_seconds = time.time() - started
+
+        ranks = random.Random(1).sample(list(Rank.query()), self.SAMPLES)
+        positions = []
+        started = time.time()
+        for rank in ranks:
+            positions.append(rank.position_async().get_result())
+        position_seconds = (time.time() - started) / self.SAMPLES
+        read = 0
+        for rank, position in zip(ranks, positions):
+            self.assertEqual(position, 1 + sum(
+                1 for total in self.totals if total > rank.total_score))
+            read += self.entities_read(rank, position)
+
+        started = time.time()
+        Rank.top()
+        top_seconds = time.time() - started
+
+        game = self.create_game(self.create_user('alice'), 'cat')
+        started = time.time()
+        Game.play_move(game.key, 'cat')
+        self.run_tasks('/tasks/move_score_bucket')
+        write_seconds = time.time() - started
+
+        print('\n{} users: a scan reads {} ranks in {:.2f}s. A position reads '
+              '{:.0f} entities in {:.3f}s on average, the top {} take {:.3f}s '
+              'and a game end with its bucket task takes {:.3f}s.'.format(
+                  self.users, scanned, scan_seconds,
+                  float(read) / self.SAMPLES, position_seconds,
+                  LEADERBOARD_SIZE, top_seconds, write_seconds))
+        self.assertLess(read / self.SAMPLES, self.users / 20)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import unittest
+from datetime import date
+
+from tests import support
+
+if support.AVAILABLE:
+    import api
+    from google.appengine.ext import ndb
+    from models import Rank, Score, User
+    from utils import RpcCounter
+
+
+class ListingRpcTest(support.AppEngineTestCase):
+    """Lists make as many Datastore calls for one item as for a full page:
+    the names of their users are read with a single get"""
+    # One item and a full page of the default size.
+    SIZES = (1, 50)
+
+    def setUp(self):
+        super(ListingRpcTest, self).setUp()
+        # One more than the largest page, so that every page has a next one.
+        self.users = [self.create_user('user{}'.format(i))
+                      for i in range(max(self.SIZES) + 1)]
+        ndb.put_multi([Score(user=user, date=date.today(), won=True,
+                             guesses=1, score=0.8) for user in self.users])
+        ndb.put_multi([Rank(key=Rank.key_for(user), user=user,
+                            total_score=0.8) for user in self.users])
+        # The first users have as many active games as the sizes.
+        for user, size in zip(self.users, self.SIZES):
+            for _ in range(size):
+                self.create_game(user, 'cat')
+        self.api = api.GuessANumberApi()
+
+    def assertConstant(self, call):
+        """Asserts that call(size), listing size items, makes the same
+        Datastore calls for every size"""
+        calls = []
+        for size in self.SIZES:
+            self.clear_caches()
+            with RpcCounter() as rpcs:
+                self.assertEqual(call(size), size)
+            calls.append(dict((name, count) for (service, name), count
+                              in rpcs.calls.items()
+                              if service == 'datastore_v3'))
+        self.assertEqual(calls[0], calls[-1])
+
+    def test_names(self):
+        self.assertConstant(lambda size: len(
+            User.names_async(self.users[:size]).get_result()))
+
+    def test_scores(self):
+        self.assertConstant(lambda size: len(self.api.get_scores(
+            api.SCORES_REQUEST.combined_message_class(page_size=size)).items))
+
+    def test_high_scores(self):
+        self.assertConstant(lambda size: len(self.api.get_high_scores(
+            api.HIGH_SCORES_REQUEST.combined_message_class(
+                number_of_results=size)).items))
+
+    def test_rankings(self):
+        self.assertConstant(lambda size: len(self.api.get_user_rankings(
+            api.RankingForm(number_of_results=size)).items))
+
+    def test_user_games(self):
+        names = dict(zip(self.SIZES, ('user0', 'user1')))
+        self.assertConstant(lambda size: len(self.api.get_user_games(
+            api.USER_REQUEST.combined_message_class(
+                user_name=names[size])).items))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+
+from tests import support
+
+if support.AVAILABLE:
+    from models import Game, Game_History
+
+
+class GameHistoryMigrationTest(support.AppEngineTestCase):
+    def setUp(self):
+        super(GameHistoryMigrationTest, self).setUp()
+        self.game = self.create_game(self.create_user('alice'), 'cat')
+        Game_History(key=Game_History.key_for(self.game.key),
+                     guesses=['', 'a', 'z'],
+                     word_states=['___', '_a_', '_a_']).put()
+
+    def test_legacy_history_is_converted(self):
+        self.assertIsNone(Game_History.migrate_batch())
+        history = Game_History.key_for(self.game.key).get()
+        self.assertFalse(history.is_legacy)
+        self.assertEqual(list(history.replay('cat')),
+                         [('', '___'), ('a', '_a_'), ('z', '_a_')])
+
+    def test_move_appended_after_the_scan_is_kept(self):
+        page = Game_History.query().fetch_page
+
+        def fetch_page(*args, **kwargs):
+            # A move commits between the scan and the conversion.
+            result = page(*args, **kwargs)
+            Game.play_move(self.game.key, 't')
+            return result
+        self.patch(Game_History, 'query', classmethod(
+            lambda cls, *args, **kwargs: support.FakeQuery(fetch_page=fetch_page)))
+
+        Game_History.migrate_batch()
+        history = Game_History.key_for(self.game.key).get()
+        self.assertEqual([guess for guess, _ in history.replay('cat')],
+                         ['', 'a', 'z', 't'])
+
+
+if __name__ == '__main__':
+    unittest.main()
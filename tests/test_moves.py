@@ -0,0 +1,113 @@
+import unittest
+
+from tests import support
+
+if support.AVAILABLE:
+    import api
+    import endpoints
+    from google.appengine.ext import ndb
+    from models import Game, Game_History, Rank, Score
+    from utils import RpcCounter
+
+
+class MoveRpcTest(support.AppEngineTestCase):
+    """A move reads the game and its history with one get and writes
+    everything it changes with one put, in one transaction"""
+
+    def setUp(self):
+        super(MoveRpcTest, self).setUp()
+        self.game = self.create_game(self.create_user('alice'), 'hangman')
+        # The name of the player, in the form, is then served from memcache.
+        self.clear_caches()
+        self.game.user.get()
+        ndb.get_context().clear_cache()
+
+    def make_move(self, guess):
+        request = api.MAKE_MOVE_REQUEST.combined_message_class(
+            urlsafe_game_key=self.game.key.urlsafe(), guess=guess)
+        return api.GuessANumberApi().make_move(request)
+
+    def assertRoundTrips(self, rpcs, gets=1):
+        self.assertEqual(rpcs.count('datastore_v3', 'BeginTransaction'), 1)
+        self.assertEqual(rpcs.count('datastore_v3', 'Get'), gets)
+        self.assertEqual(rpcs.count('datastore_v3', 'Put'), 1)
+        self.assertEqual(rpcs.count('datastore_v3', 'Commit'), 1)
+        self.assertEqual(rpcs.count('datastore_v3', 'RunQuery'), 0)
+
+    def test_hit(self):
+        with RpcCounter() as rpcs:
+            form = self.make_move('a')
+        self.assertEqual(form.message, 'Letter Found!')
+        self.assertEqual(form.word_state, '_a___a_')
+        self.assertRoundTrips(rpcs)
+
+    def test_miss(self):
+        with RpcCounter() as rpcs:
+            form = self.make_move('z')
+        self.assertEqual(form.attempts_remaining, 4)
+        self.assertRoundTrips(rpcs)
+
+    def test_end(self):
+        # The Rank is read once the game is known to be over, and the Score
+        # and Rank are written along with the game.
+        with RpcCounter() as rpcs:
+            form = self.make_move('hangman')
+        self.assertTrue(form.game_over)
+        self.assertRoundTrips(rpcs, gets=2)
+        self.assertEqual(Score.query().count(), 1)
+        self.assertEqual(Rank.query().get().total_score, 1.0)
+
+    def test_several_moves(self):
+        with RpcCounter() as rpcs:
+            game, moves = Game.play_moves(self.game.key, ['h', 'z', 'n'])
+        self.assertEqual([move.word_state for move in moves],
+                         ['h______', 'h______', 'h_n___n'])
+        self.assertRoundTrips(rpcs)
+        history = Game_History.key_for(self.game.key).get()
+        self.assertEqual([guess for guess, _ in history.replay(game.target)],
+                         ['', 'h', 'z', 'n'])
+
+
+
+class MakeMovesTest(support.AppEngineTestCase):
+    def setUp(self):
+        super(MakeMovesTest, self).setUp()
+        self.game = self.create_game(self.create_user('alice'), 'hangman')
+        self.api = api.GuessANumberApi()
+        self.urlsafe_key = self.game.key.urlsafe()
+
+    def make_moves(self, guesses):
+        return self.api.make_moves(api.MAKE_MOVES_REQUEST.combined_message_class(
+            urlsafe_game_key=self.urlsafe_key, guesses=guesses))
+
+    def test_invalid_guess_plays_none(self):
+        # Read once, so that the cached game would show a partial batch.
+        self.api.get_game(api.GET_GAME_REQUEST.combined_message_class(
+            urlsafe_game_key=self.urlsafe_key))
+        for guesses, invalid in ((['h', 'z', '1', 'n'], 3),
+                                 (['h', 'z', 'h'], 3), (['h', ''], 2)):
+            with self.assertRaises(endpoints.BadRequestException) as raised:
+                self.make_moves(guesses)
+            self.assertIn('Guess #{}'.format(invalid), str(raised.exception))
+            form = self.api.get_game(
+                api.GET_GAME_REQUEST.combined_message_class(
+                    urlsafe_game_key=self.urlsafe_key))
+            self.assertEqual((form.word_state, form.attempts_remaining),
+                             ('_______', 5))
+            ndb.get_context().clear_cache()
+            game = self.game.key.get()
+            self.assertEqual((game.word_state, game.attempts_remaining,
+                              game.guessed_letters), ('_______', 5, 0))
+            self.assertEqual(Game_History.key_for(self.game.key).get().moves,
+                             '')
+        self.assertEqual(self.tasks('/tasks/adjust_game_stats'), [])
+
+    def test_moves_stop_when_the_game_ends(self):
+        form = self.make_moves(['hangman', 'z'])
+        self.assertEqual(len(form.moves), 1)
+        self.assertTrue(form.game.game_over)
+        self.assertEqual(form.game.attempts_remaining, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+
+from tests import support
+
+if support.AVAILABLE:
+    import api
+    import endpoints
+    from models import Game, Game_History, GameStats
+
+
+class NewGamesTest(support.AppEngineTestCase):
+    def setUp(self):
+        super(NewGamesTest, self).setUp()
+        self.alice = self.create_user('alice')
+        self.bob = self.create_user('bob')
+        self.api = api.GuessANumberApi()
+
+    def new_games_bulk(self, names, attempts=5):
+        return self.api.new_games_bulk(api.NewGamesBulkForm(
+            user_names=names, attempts=attempts))
+
+    def test_games_are_created_with_their_histories(self):
+        games = Game.new_games([self.alice, self.bob, self.alice], 4)
+        self.assertEqual([game.user for game in games],
+                         [self.alice, self.bob, self.alice])
+        self.assertEqual(len(set(game.key for game in games)), 3)
+        for game in games:
+            stored = game.key.get()
+            self.assertEqual((stored.target, stored.attempts_remaining,
+                              stored.word_state),
+                             (game.target, 4, '_' * len(game.target)))
+            self.assertEqual(Game_History.key_for(game.key).get().moves, '')
+        # The counters are adjusted by a single task.
+        self.assertEqual(self.run_tasks('/tasks/adjust_game_stats'), 1)
+        self.assertEqual(GameStats.totals(), (3, 12))
+
+    def test_endpoint_creates_a_game_per_name(self):
+        forms = self.new_games_bulk(['alice', 'Bob', 'alice'])
+        self.assertEqual([form.user_name for form in forms.items],
+                         ['alice', 'bob', 'alice'])
+        self.assertEqual(Game.query().count(), 3)
+        self.assertEqual(Game_History.query().count(), 3)
+        self.run_tasks('/tasks/adjust_game_stats')
+        self.assertEqual(GameStats.totals(), (3, 15))
+
+    def test_unknown_names_create_no_game(self):
+        with self.assertRaises(endpoints.NotFoundException) as raised:
+            self.new_games_bulk(['alice', 'carol', 'dave'])
+        self.assertIn('carol, dave', str(raised.exception))
+        self.assertEqual(Game.query().count(), 0)
+        self.assertEqual(self.tasks('/tasks/adjust_game_stats'), [])
+
+    def test_number_of_games_is_bounded(self):
+        for names in ([], ['alice'] * (api.MAX_BULK_GAMES + 1)):
+            self.assertRaises(endpoints.BadRequestException,
+                              self.new_games_bulk, names)
+        self.assertRaises(endpoints.BadRequestException,
+                          self.new_games_bulk, ['alice'], attempts=0)
+        self.assertEqual(Game.query().count(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
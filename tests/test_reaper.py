@@ -0,0 +1,80 @@
+import threading
+import unittest
+from datetime import datetime, timedelta
+
+from tests import support
+
+if support.AVAILABLE:
+    from models import ArchivedGame, Game, GameCache, GameStats, Game_History
+
+
+class ReapTest(support.AppEngineTestCase):
+    def setUp(self):
+        super(ReapTest, self).setUp()
+        self.user = self.create_user('alice')
+        self.game = Game.new_game(self.user, 5)
+        self.game.target = 'cat'
+        self.game.word_state = '___'
+        self.game.put()
+        # Every game was last played before then.
+        self.before = datetime.utcnow() + timedelta(days=1)
+
+    def test_stale_games_are_archived(self):
+        Game.play_move(self.game.key, 'z')
+        GameCache.get(self.game.key)
+        self.assertIsNone(Game.reap_batch(False, self.before))
+        self.assertIsNone(self.game.key.get())
+        self.assertIsNone(Game_History.key_for(self.game.key).get())
+        self.assertIsNone(GameCache.get(self.game.key)[0])
+        archive = ArchivedGame.get_by_id(self.game.key.id())
+        self.assertEqual((archive.target, archive.attempts_remaining),
+                         ('cat', 4))
+        self.assertEqual(self.run_tasks('/tasks/adjust_game_stats'), 3)
+        self.assertEqual(GameStats.totals(), (0, 0))
+
+    def test_game_ended_while_reaped_is_kept(self):
+        archive = ArchivedGame.archive
+
+        def archive_during_move(game, game_history):
+            # The move commits between the check and the deletion, from
+            # another request.
+            move = threading.Thread(
+                target=Game.play_move, args=(self.game.key, 'cat'))
+            move.start()
+            move.join()
+            self.patch(ArchivedGame, 'archive', archive)
+            return archive(game, game_history)
+        self.patch(ArchivedGame, 'archive', staticmethod(archive_during_move))
+        Game.reap_batch(False, self.before)
+        self.assertTrue(self.game.key.get().game_over)
+        self.assertIsNone(ArchivedGame.get_by_id(self.game.key.id()))
+
+
+class GameActivityMigrationTest(support.AppEngineTestCase):
+    def setUp(self):
+        super(GameActivityMigrationTest, self).setUp()
+        self.patch(Game.last_activity, '_auto_now', False)
+        self.game = self.create_game(self.create_user('alice'), 'cat')
+        self.patch(Game.last_activity, '_auto_now', True)
+
+    def test_activity_is_stamped(self):
+        self.assertIsNone(self.game.key.get().last_activity)
+        self.assertIsNone(Game.migrate_batch())
+        self.assertIsNotNone(self.game.key.get().last_activity)
+
+    def test_move_made_after_the_scan_is_kept(self):
+        page = Game.query().fetch_page
+
+        def fetch_page(*args, **kwargs):
+            result = page(*args, **kwargs)
+            Game.play_move(self.game.key, 'a')
+            return result
+        self.patch(Game, 'query', classmethod(
+            lambda cls, *args, **kwargs: support.FakeQuery(
+                fetch_page=fetch_page)))
+        Game.migrate_batch()
+        self.assertEqual(self.game.key.get().word_state, '_a_')
+
+
+if __name__ == '__main__':
+    unittest.main()
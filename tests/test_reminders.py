@@ -0,0 +1,137 @@
+import os
+import random
+import time
+import unittest
+
+from tests import support
+
+if support.AVAILABLE:
+    from google.appengine.api import app_identity, mail
+    from google.appengine.ext import ndb, testbed
+    import main
+    from models import Game, User
+    from utils import RpcCounter
+
+
+class RemindersTestCase(support.AppEngineTestCase):
+    def setUp(self):
+        super(RemindersTestCase, self).setUp()
+        self.testbed.init_mail_stub()
+        self.mail = self.testbed.get_stub(testbed.MAIL_SERVICE_NAME)
+
+    def new_games(self, user, count, **fields):
+        ndb.put_multi([Game(user=user, target='cat', attempts_allowed=5,
+                            attempts_remaining=5, word_state='___',
+                            current_guess='', guessed_letters=0,
+                            **dict(dict(game_over=False, cancel=False),
+                                   **fields))
+                       for _ in range(count)])
+
+    def remind(self):
+        """Runs the hourly job along with its tasks and returns the number
+        of scan tasks"""
+        main.app.get_response('/crons/send_reminder')
+        scans = self.run_tasks('/tasks/scan_reminders')
+        self.run_tasks('/tasks/send_reminders')
+        return scans
+
+    def reminders(self):
+        """Returns the (recipient, body) of each email sent"""
+        return [(message.to, message.body.decode())
+                for message in self.mail.get_sent_messages()]
+
+
+class RemindersTest(RemindersTestCase):
+    def setUp(self):
+        super(RemindersTest, self).setUp()
+        # Pages of three games and shards of two users.
+        self.patch(main, 'REMINDER_SCAN_BATCH', 3)
+        self.patch(main, 'REMINDER_SHARD_SIZE', 2)
+
+    def test_users_spanning_pages_are_emailed_once(self):
+        counts = {'alice': 4, 'bob': 1, 'carol': 2, 'dave': 3, 'erin': 0}
+        for name, count in counts.items():
+            user = User(name=name, email='{}@example.com'.format(name))
+            user.put()
+            self.new_games(user.key, count)
+            self.new_games(user.key, 2, game_over=True)
+            self.new_games(user.key, 1, cancel=True)
+        # Without an email.
+        self.new_games(User(name='frank').put(), 2)
+
+        # Ten incomplete games, three to a page.
+        self.assertEqual(self.remind(), 4)
+        self.assertEqual(sorted(self.reminders()), [
+            ('{}@example.com'.format(name),
+             'Hello {}, you still have {} incomplete Hangman games!'.format(
+                 name, count))
+            for name, count in sorted(counts.items()) if count])
+
+
+@unittest.skipUnless(os.environ.get('LOAD_TEST_USERS'),
+                     'Set LOAD_TEST_USERS, e.g. to 50000, to run it')
+class RemindersLoadTest(RemindersTestCase):
+    """Compares the scan and mail tasks with the original job, which
+    queried the games of every user with an email, over LOAD_TEST_USERS
+    synthetic users. The stub scans every game for each query of the
+    original job, so it is run over SAMPLE users and its Datastore calls are
+    scaled to every user."""
+    SAMPLE = 50
+
+    def setUp(self):
+        super(RemindersLoadTest, self).setUp()
+        rng = random.Random(0)
+        self.users = int(os.environ['LOAD_TEST_USERS'])
+        self.reminded = 0
+        for start in range(0, self.users, 500):
+            users = [User(name='user{}'.format(i),
+                          email='user{}@example.com'.format(i) if i % 10 else
+                          None)
+                     for i in range(start, min(start + 500, self.users))]
+            ndb.put_multi(users)
+            # Half of the users have incomplete games.
+            playing = [user for user in users if rng.random() < 0.5]
+            ndb.put_multi([Game(user=user.key, target='cat',
+                                attempts_allowed=5, attempts_remaining=5,
+                                game_over=False, word_state='___',
+                                cancel=False, current_guess='',
+                                guessed_letters=0)
+                           for user in playing
+                           for _ in range(rng.randint(1, 3))])
+            self.reminded += sum(1 for user in playing if user.email)
+        self.clear_caches()
+
+    def original(self, users):
+        """The original hourly job, over the first users with an email"""
+        app_id = app_identity.get_application_id()
+        for user in User.query(User.email != None).fetch(users):
+            games = Game.query(Game.user == user.key, Game.game_over == False,
+                               Game.cancel == False).fetch()
+            if games:
+                mail.send_mail('noreply@{}.appspotmail.com'.format(app_id),
+                               user.email, 'This is a reminder',
+                               'Hello {}, you still have {} incomplete '
+                               'Hangman games!'.format(user.name, len(games)))
+
+    def test_scan_against_original(self):
+        with RpcCounter() as rpcs:
+            started = time.time()
+            scans = self.remind()
+            seconds = time.time() - started
+        self.assertEqual(len(self.reminders()), self.reminded)
+
+        emailed = User.query(User.email != None).count()
+        sample = min(self.SAMPLE, emailed)
+        with RpcCounter() as original_rpcs:
+            self.original(sample)
+        original_calls = original_rpcs.count('datastore_v3') * emailed / sample
+
+        print('\n{} users, {} reminded: {} scan tasks and their mail tasks '
+              'made {} Datastore calls in {:.1f}s. The original job makes '
+              '{} Datastore calls, one after the other in one request.'.format(
+                  self.users, self.reminded, scans,
+                  rpcs.count('datastore_v3'), seconds, original_calls))
+        self.assertLess(rpcs.count('datastore_v3'), original_calls / 10)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+from datetime import date
+
+from tests import support
+
+if support.AVAILABLE:
+    from google.appengine.ext import ndb
+    from models import DailyLeader, DailyStats, Game, Score, UserStats
+
+
+class RollUpTest(support.AppEngineTestCase):
+    def setUp(self):
+        super(RollUpTest, self).setUp()
+        self.alice = self.create_user('alice')
+        self.bob = self.create_user('bob')
+
+    def win(self, user, target, misses=''):
+        game = Game.new_game(user, 5)
+        game.target = target
+        game.put()
+        for guess in misses:
+            Game.play_move(game.key, guess)
+        Game.play_move(game.key, target)
+
+    def test_scores_are_rolled_up_by_tasks(self):
+        self.win(self.alice, 'cat')
+        self.win(self.bob, 'dog', misses='z')
+        # The transactions of the games do not touch the rollups.
+        self.assertEqual(UserStats.query().count(), 0)
+        self.assertEqual(DailyStats.query().count(), 0)
+        self.assertEqual(self.run_tasks('/tasks/roll_up_scores'), 2)
+
+        stats = UserStats.key_for(self.bob).get()
+        self.assertEqual((stats.games, stats.wins, stats.guesses), (1, 1, 1))
+        day = DailyStats.for_day_async(date.today()).get_result()
+        self.assertEqual((day.games, day.wins, day.guesses), (2, 2, 1))
+        self.assertEqual([(leader.user, leader.score) for leader in day.leaders],
+                         [(self.alice, 1.0), (self.bob, 0.8)])
+
+    def test_scores_are_rolled_up_once(self):
+        self.win(self.alice, 'cat')
+        self.run_tasks('/tasks/roll_up_scores')
+        Score.roll_up_batch(Score.query().fetch(keys_only=True))
+        self.assertEqual(UserStats.key_for(self.alice).get().games, 1)
+
+    def test_unsharded_day_is_merged(self):
+        today = date.today()
+        DailyStats(key=ndb.Key(DailyStats, today.isoformat()), games=3,
+                   wins=1, guesses=7, total_score=1.4, best_score=0.8,
+                   leaders=[DailyLeader(user=self.alice, score=0.8)]).put()
+        self.win(self.alice, 'cat')
+        self.run_tasks('/tasks/roll_up_scores')
+        day = DailyStats.for_day_async(today).get_result()
+        self.assertEqual((day.games, day.wins, day.best_score), (4, 2, 1.0))
+        self.assertEqual([(leader.user, leader.score) for leader in day.leaders],
+                         [(self.alice, 1.0)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+
+from tests import support
+
+if support.AVAILABLE:
+    import api
+    from models import Game, Game_History, Rank, UserStats
+    from utils import RpcCounter
+
+
+class RoundTripTest(support.AppEngineTestCase):
+    """Endpoints make the Datastore calls that do not depend on each other
+    together"""
+
+    def setUp(self):
+        super(RoundTripTest, self).setUp()
+        self.user = self.create_user('alice')
+        self.api = api.GuessANumberApi()
+        self.by_name = api.USER_REQUEST.combined_message_class(
+            user_name='alice')
+
+    def test_new_game_puts_once(self):
+        with RpcCounter() as rpcs:
+            form = self.api.new_game(api.NEW_GAME_REQUEST.combined_message_class(
+                user_name='alice', attempts=5))
+        self.assertEqual(rpcs.count('datastore_v3', 'Put'), 1)
+        game = Game.query().get()
+        self.assertEqual(form.urlsafe_key, game.key.urlsafe())
+        self.assertIsNotNone(Game_History.key_for(game.key).get())
+        self.assertEqual(len(self.tasks('/tasks/adjust_game_stats')), 1)
+
+    def test_user_is_read_along_with_its_entities(self):
+        Rank(key=Rank.key_for(self.user), user=self.user,
+             total_score=1.0).put()
+        UserStats(key=UserStats.key_for(self.user), games=1).put()
+        # The UserName, then the user along with its entity, then for the
+        # rank the buckets of its position.
+        for call, gets in ((self.api.get_user_stats, 2),
+                           (self.api.get_user_rank, 3)):
+            self.clear_caches()
+            with RpcCounter() as rpcs:
+                self.assertEqual(call(self.by_name).user_name, 'alice')
+            self.assertEqual(rpcs.count('datastore_v3', 'Get'), gets)
+
+if __name__ == '__main__':
+    unittest.main()
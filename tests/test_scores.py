@@ -0,0 +1,108 @@
+import csv
+import unittest
+from datetime import date, timedelta
+
+from tests import support
+
+if support.AVAILABLE:
+    import api
+    import endpoints
+    from google.appengine.ext import ndb
+    import main
+    from models import Score
+
+
+class ScorePagesTest(support.AppEngineTestCase):
+    def setUp(self):
+        super(ScorePagesTest, self).setUp()
+        self.alice = self.create_user('alice')
+        self.bob = self.create_user('bob')
+        # Distinct guesses identify the scores; their values tie in pairs.
+        ndb.put_multi([Score(user=(self.alice, self.bob)[i % 2],
+                             date=date.today() - timedelta(days=i // 4),
+                             won=True, guesses=i, score=0.2 * (i // 2))
+                       for i in range(11)])
+        self.api = api.GuessANumberApi()
+
+    def pages(self, call, request_class, page_size, **fields):
+        """Returns the guesses of every page of a listing, read through
+        next_cursor, and the number of pages"""
+        guesses, cursor, pages = [], None, 0
+        while True:
+            request = request_class(cursor=cursor, **fields)
+            setattr(request, page_size[0], page_size[1])
+            forms = call(request)
+            guesses.extend(form.guesses for form in forms.items)
+            pages += 1
+            cursor = forms.next_cursor
+            if not cursor:
+                return guesses, pages
+
+    def test_pages_cover_every_score_once(self):
+        for page_size in (1, 3, 11, 50):
+            guesses, pages = self.pages(
+                self.api.get_scores, api.SCORES_REQUEST.combined_message_class,
+                ('page_size', page_size))
+            self.assertEqual(sorted(guesses), range(11))
+            self.assertEqual(pages, max(1, -(-11 // page_size)))
+
+            guesses, _ = self.pages(
+                self.api.get_high_scores,
+                api.HIGH_SCORES_REQUEST.combined_message_class,
+                ('number_of_results', page_size))
+            self.assertEqual(sorted(guesses), range(11))
+            self.assertEqual([i // 2 for i in guesses],
+                             sorted((i // 2 for i in range(11)), reverse=True))
+
+            guesses, _ = self.pages(
+                self.api.get_user_scores,
+                api.USER_SCORES_REQUEST.combined_message_class,
+                ('page_size', page_size), user_name='bob')
+            self.assertEqual(sorted(guesses), range(1, 11, 2))
+
+    def test_malformed_cursors_are_rejected(self):
+        self.assertRaises(
+            endpoints.BadRequestException, self.api.get_scores,
+            api.SCORES_REQUEST.combined_message_class(cursor='not a cursor'))
+
+
+class ExportScoresTest(support.AppEngineTestCase):
+    def setUp(self):
+        super(ExportScoresTest, self).setUp()
+        # Requests of two batches of three scores.
+        self.patch(main.ExportScores, 'BATCH_SIZE', 3)
+        self.patch(main.ExportScores, 'BATCHES_PER_REQUEST', 2)
+        self.users = [self.create_user(name) for name in ('alice', 'bob')]
+
+    def export(self):
+        """Returns the CSV rows of an export, read through X-Next-Cursor,
+        and the number of requests"""
+        rows, cursor, requests = [], '', 0
+        while True:
+            response = main.app.get_response(
+                '/tasks/export_scores?cursor={}'.format(cursor))
+            self.assertEqual(response.status_int, 200)
+            rows.extend(csv.reader(response.body.splitlines()))
+            requests += 1
+            cursor = response.headers.get('X-Next-Cursor')
+            if not cursor:
+                return rows, requests
+
+    def test_export_spans_requests(self):
+        for count, requests in ((13, 3), (12, 3), (5, 1)):
+            ndb.delete_multi(Score.query().fetch(keys_only=True))
+            ndb.put_multi([Score(user=self.users[i % 2], date=date.today(),
+                                 won=i % 3 == 0, guesses=i, score=0.5)
+                           for i in range(count)])
+            rows, made = self.export()
+            self.assertEqual(made, requests)
+            self.assertEqual(rows[0], ['user_name', 'date', 'won', 'guesses',
+                                       'score'])
+            self.assertEqual(sorted(int(row[3]) for row in rows[1:]),
+                             range(count))
+            self.assertEqual(set(row[0] for row in rows[1:]),
+                             set(['alice', 'bob']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from tests import support
+
+from engine import replay_moves
+from storage import InMemoryRepository, NotFoundError, SQLiteRepository
+
+if support.AVAILABLE:
+    from ndb_storage import NdbRepository
+
+
+class RepositoryContract(object):
+    """The behaviour every Repository shares, run against each backend by
+    the test cases below"""
+
+    def make_repository(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        super(RepositoryContract, self).setUp()
+        self.repository = self.make_repository()
+        self.addCleanup(self.repository.close)
+        for name in ('alice', 'bob', 'carol'):
+            self.assertTrue(self.repository.create_user(name))
+
+    def win(self, user_name, misses=0):
+        """Plays a game of a user to a win after a number of misses"""
+        game = self.repository.new_game(user_name)
+        missed = [letter for letter in 'zqxjkvbwyfmpgh'
+                  if letter not in game.target][:misses]
+        for letter in missed:
+            self.repository.make_move(game.id, letter)
+        return self.repository.make_move(game.id, game.target)
+
+    def test_names_are_unique(self):
+        self.assertFalse(self.repository.create_user(' Alice'))
+
+    def test_unknown_users(self):
+        self.assertRaises(NotFoundError, self.repository.new_game, 'dave')
+        self.assertRaises(NotFoundError, self.repository.user_scores, 'dave')
+
+    def test_invalid_games_and_guesses(self):
+        self.assertRaises(ValueError, self.repository.new_game, 'alice', 0)
+        game = self.repository.new_game('alice')
+        self.repository.make_move(game.id, game.target[0])
+        self.assertRaises(ValueError, self.repository.make_move, game.id,
+                          game.target[0])
+
+    def test_moves(self):
+        game = self.repository.new_game('alice', attempts=3)
+        miss = [letter for letter in 'zqx' if letter not in game.target][0]
+        state, msg = self.repository.make_move(game.id, miss)
+        self.assertEqual(state.attempts_remaining, 2)
+        self.assertFalse(state.game_over)
+        state, msg = self.repository.make_move(game.id, game.target)
+        self.assertTrue(state.game_over)
+        self.assertTrue(msg.endswith('Game over!'))
+        self.assertEqual(self.repository.make_move(game.id, 'a')[1],
+                         'Game already over!')
+        stored = self.repository.get_game(game.id)
+        self.assertEqual((stored.word_state, stored.attempts_remaining),
+                         (game.target, 2))
+        self.assertEqual([guess for guess, _ in
+                          replay_moves(game.target, stored.moves)],
+                         [miss, game.target])
+
+    def test_scores(self):
+        self.win('alice', misses=1)
+        scores = self.repository.user_scores('alice')
+        self.assertEqual([(score.won, score.guesses, score.score)
+                          for score in scores], [(True, 1, 0.8)])
+        self.assertEqual(self.repository.user_scores('bob'), [])
+
+    def test_top_ranks(self):
+        self.win('alice', misses=2)
+        self.win('bob')
+        self.win('carol', misses=1)
+        ranks = [('bob', 1.0), ('carol', 0.8), ('alice', 0.6)]
+        self.assertEqual([tuple(rank) for rank in
+                          self.repository.top_ranks(2)], ranks[:2])
+        self.assertEqual([tuple(rank) for rank in
+                          self.repository.top_ranks(-1)], ranks)
+        self.assertEqual(list(self.repository.top_ranks(0)), [])
+
+
+class InMemoryRepositoryTest(RepositoryContract, unittest.TestCase):
+    def make_repository(self):
+        return InMemoryRepository()
+
+
+class SQLiteRepositoryTest(RepositoryContract, unittest.TestCase):
+    def make_repository(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        return SQLiteRepository(os.path.join(directory, 'hangman.db'),
+                                commit_every=1)
+
+
+class NdbRepositoryTest(RepositoryContract, support.AppEngineTestCase):
+    def make_repository(self):
+        return NdbRepository()
+
+
+if __name__ == '__main__':
+    unittest.main()
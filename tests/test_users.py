@@ -0,0 +1,81 @@
+import threading
+import unittest
+
+from tests import support
+
+if support.AVAILABLE:
+    import api
+    import endpoints
+    from google.appengine.api import datastore_errors
+    from models import User, UserName
+    from utils import RpcCounter
+
+
+class CreateUserTest(support.AppEngineTestCase):
+    def create(self, name):
+        request = api.USER_REQUEST.combined_message_class(user_name=name)
+        return api.GuessANumberApi().create_user(request)
+
+    def test_name_is_unique(self):
+        self.create('alice')
+        self.assertRaises(endpoints.ConflictException, self.create,
+                          'Alice ')
+        self.assertEqual(User.get_by_name('alice').name, 'alice')
+
+    def test_concurrent_creations(self):
+        results = []
+
+        def create():
+            try:
+                self.create('bob')
+                results.append('created')
+            except endpoints.ConflictException:
+                results.append('conflict')
+        threads = [threading.Thread(target=create) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(results), 8)
+        self.assertEqual(results.count('created'), 1)
+        self.assertEqual(results.count('conflict'), 7)
+        self.assertEqual(User.query(User.name == 'bob').count(), 1)
+        self.assertEqual(UserName.key_for('bob').get().user,
+                         User.get_by_name('bob').key)
+
+    def test_contention_is_a_conflict(self):
+        def contended(user_key, name, email):
+            raise datastore_errors.TransactionFailedError()
+        self.patch(User, '_create', staticmethod(contended))
+        self.assertRaises(endpoints.ConflictException, self.create, 'carol')
+
+
+class UnindexedUserTest(support.AppEngineTestCase):
+    """Users created before UserName existed, until they are migrated"""
+    def setUp(self):
+        super(UnindexedUserTest, self).setUp()
+        self.alice = User(name='Alice')
+        self.alice.put()
+
+    def test_names_are_matched_ignoring_case(self):
+        self.assertEqual(User.get_by_name('ALICE').key, self.alice.key)
+        self.assertEqual(User.keys_by_name(['alice']),
+                         {'alice': self.alice.key})
+        self.assertEqual(UserName.key_for('alice').get().user,
+                         self.alice.key)
+
+    def test_names_cannot_be_taken_again(self):
+        self.assertIsNone(User.create('alice', None))
+        self.assertEqual(User.query().count(), 1)
+        self.assertEqual(User.get_by_name('alice').key, self.alice.key)
+
+    def test_index_is_only_read_once_migrated(self):
+        self.assertIsNone(UserName.migrate_batch())
+        with RpcCounter() as rpcs:
+            self.assertIsNone(User.get_by_name('bob'))
+        self.assertEqual(rpcs.count('datastore_v3', 'RunQuery'), 0)
+        self.assertEqual(User.get_by_name('aLiCe').key, self.alice.key)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,20 +1,26 @@
 """utils.py - File for collecting general utility functions."""
 
+import bisect
+import collections
+import functools
+import json
 import logging
+import threading
+import time
+from google.appengine.api import apiproxy_stub_map, datastore_errors
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.ext import ndb
 import endpoints
 
-def get_by_urlsafe(urlsafe, model):
-    """Returns an ndb.Model entity that the urlsafe key points to. Checks
-        that the type of entity returned is of the correct kind. Raises an
-        error if the key String is malformed or the entity is of the incorrect
-        kind
+def get_key_by_urlsafe(urlsafe, model):
+    """Returns the ndb.Key that the urlsafe key string points to without
+        fetching the entity. Raises an error if the key String is malformed or
+        the key is of the incorrect kind
     Args:
         urlsafe: A urlsafe key string
         model: The expected entity kind
     Returns:
-        The entity that the urlsafe Key string points to or None if no entity
-        exists.
+        The Key that the urlsafe Key string represents.
     Raises:
         ValueError:"""
     try:
@@ -27,9 +33,162 @@ def get_by_urlsafe(urlsafe, model):
         else:
             raise
 
-    entity = key.get()
-    if not entity:
-        return None
-    if not isinstance(entity, model):
+    if key.kind() != model._get_kind():
         raise ValueError('Incorrect Kind')
-    return entity
+    return key
+
+def get_cursor(urlsafe):
+    """Returns the query Cursor of a urlsafe cursor string, or None for an
+        empty one. Raises a BadRequestException if it is malformed."""
+    if not urlsafe:
+        return None
+    try:
+        return Cursor(urlsafe=urlsafe)
+    except (datastore_errors.BadValueError, TypeError):
+        raise endpoints.BadRequestException('Invalid Cursor')
+
+def get_by_urlsafe(urlsafe, model):
+    """Returns an ndb.Model entity that the urlsafe key points to. Checks
+        that the type of entity returned is of the correct kind. Raises an
+        error if the key String is malformed or the entity is of the incorrect
+        kind
+    Args:
+        urlsafe: A urlsafe key string
+        model: The expected entity kind
+    Returns:
+        The entity that the urlsafe Key string points to or None if no entity
+        exists.
+    Raises:
+        ValueError:"""
+    return get_key_by_urlsafe(urlsafe, model).get()
+
+
+_rpc_counters = threading.local()
+
+def _count_rpc(service, call, request, response):
+    size = request.ByteSize() + response.ByteSize()
+    hits = misses = 0
+    if service == 'memcache' and call == 'Get':
+        hits = response.item_size()
+        misses = request.key_size() - hits
+    for counter in getattr(_rpc_counters, 'active', ()):
+        counter.calls[(service, call)] += 1
+        counter.bytes[(service, call)] += size
+        counter.memcache['hits'] += hits
+        counter.memcache['misses'] += misses
+
+class RpcCounter(object):
+    """Counts the App Engine API calls made by the current thread while it is
+        active, along with their request and response bytes and the memcache
+        keys found and missed, e.g. to assert the number of Datastore round
+        trips of a request against the testbed stubs:
+
+        with RpcCounter() as rpcs:
+            api.make_move(request)
+        assert rpcs.count('datastore_v3', 'Put') == 1"""
+
+    def __init__(self):
+        self.calls = collections.Counter()
+        self.bytes = collections.Counter()
+        self.memcache = collections.Counter()
+
+    def __enter__(self):
+        # Testbeds replace the proxy, so the hook is (re)installed on the
+        # current one. Append is a no-op if it is already installed.
+        apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+            'rpc_counter', _count_rpc)
+        if not hasattr(_rpc_counters, 'active'):
+            _rpc_counters.active = []
+        _rpc_counters.active.append(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _rpc_counters.active.remove(self)
+
+    def count(self, service=None, call=None):
+        """Returns the number of calls, optionally only those made to a
+            service ('datastore_v3', 'memcache', ...) or one of its methods"""
+        return sum(n for (s, c), n in self.calls.items()
+                   if service in (None, s) and call in (None, c))
+
+    def size(self, service=None, call=None):
+        """Returns the request and response bytes of the calls, filtered as
+            for count"""
+        return sum(n for (s, c), n in self.bytes.items()
+                   if service in (None, s) and call in (None, c))
+
+
+class HandlerStats(object):
+    """Aggregates the requests of each handler served by this instance: a
+        latency histogram along with the totals of the API calls they made.
+        Histogram bucket i counts the requests that took at most
+        LATENCY_BUCKETS[i] ms, the last one those that took longer."""
+    LATENCY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+    TOTALS = ('requests', 'errors', 'ms', 'rpcs', 'datastore_rpcs',
+              'rpc_bytes', 'memcache_hits', 'memcache_misses')
+
+    def __init__(self):
+        self._handlers = {}
+        self._lock = threading.Lock()
+
+    def record(self, record):
+        """Adds the record of a request, as logged by instrumented"""
+        bucket = bisect.bisect_left(self.LATENCY_BUCKETS, record['ms'])
+        with self._lock:
+            handler = self._handlers.get(record['handler'])
+            if handler is None:
+                handler = self._handlers[record['handler']] = {
+                    'histogram': [0] * (len(self.LATENCY_BUCKETS) + 1),
+                    'max_ms': 0}
+                handler.update(dict.fromkeys(self.TOTALS, 0))
+            handler['histogram'][bucket] += 1
+            handler['max_ms'] = max(handler['max_ms'], record['ms'])
+            handler['requests'] += 1
+            handler['errors'] += 1 if record['error'] else 0
+            for total in self.TOTALS[2:]:
+                handler[total] += record[total]
+
+    def snapshot(self):
+        """Returns a copy of the statistics of every handler"""
+        with self._lock:
+            return dict((name, dict(handler, histogram=list(
+                handler['histogram'])))
+                        for name, handler in self._handlers.items())
+
+    def reset(self):
+        with self._lock:
+            self._handlers.clear()
+
+handler_stats = HandlerStats()
+
+def instrumented(f):
+    """Decorates an endpoints method or a webapp2 handler method to record
+        its wall time, API calls, RPC bytes and memcache hits and misses.
+        Each request is logged as a JSON record and added to handler_stats.
+        Apply it outside ndb.toplevel so that the calls completed by the
+        toplevel are counted."""
+    @functools.wraps(f)
+    def wrapper(self, *args, **kwargs):
+        error = None
+        start = time.time()
+        with RpcCounter() as rpcs:
+            try:
+                return f(self, *args, **kwargs)
+            except Exception, e:
+                error = e.__class__.__name__
+                raise
+            finally:
+                record = {
+                    'handler': '{}.{}'.format(self.__class__.__name__,
+                                              f.__name__),
+                    'ms': round((time.time() - start) * 1000.0, 3),
+                    'rpcs': rpcs.count(),
+                    'datastore_rpcs': rpcs.count('datastore_v3'),
+                    'rpc_bytes': rpcs.size(),
+                    'memcache_hits': rpcs.memcache['hits'],
+                    'memcache_misses': rpcs.memcache['misses'],
+                    'error': error,
+                }
+                logging.info('handler_stats %s', json.dumps(record))
+                handler_stats.record(record)
+    return wrapper